@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Hashable
+
+log = logging.getLogger(__name__)
+
+EmitFn = Callable[[Hashable, str, Any], Awaitable[None]]
+
+
+class _Pending:
+    __slots__ = ("parts", "size", "first_ts", "timer", "payload")
+
+    def __init__(self, now: float) -> None:
+        self.parts: list[str] = []
+        self.size = 0
+        self.first_ts = now
+        self.timer: asyncio.TimerHandle | None = None
+        self.payload: Any = None
+
+
+class LongMessageAggregator:
+    """Склеивает «простыню», которую телега порезала на несколько сообщений.
+
+    Один таймер на ключ (chat_id, user_id): каждый новый кусок сдвигает дедлайн
+    на `debounce_sec`, но не дальше `max_wait_sec` от первого куска. По таймеру
+    в обработчик уходит ровно одно склеенное сообщение (payload — от последнего куска).
+    """
+
+    def __init__(
+        self,
+        on_emit: EmitFn,
+        *,
+        debounce_sec: float = 5.0,
+        max_wait_sec: float = 35.0,
+        max_chars: int = 40000,
+        max_total_chars: int = 400000,
+    ) -> None:
+        self._on_emit = on_emit
+        self._debounce = max(0.0, debounce_sec)
+        self._max_wait = max(self._debounce, max_wait_sec)
+        self._max_chars = max(1, max_chars)
+        self._max_total = max(self._max_chars, max_total_chars)
+        self._pending: dict[Hashable, _Pending] = {}
+        self._total = 0
+        self._tasks: set[asyncio.Task] = set()
+
+    def active(self, key: Hashable) -> bool:
+        return key in self._pending
+
+    @property
+    def buffered_chars(self) -> int:
+        return self._total
+
+    def add(self, key: Hashable, piece: str, payload: Any) -> None:
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+
+        st = self._pending.get(key)
+        if st is None:
+            st = _Pending(now)
+            self._pending[key] = st
+
+        st.parts.append(piece)
+        st.size += len(piece)
+        st.payload = payload
+        self._total += len(piece)
+
+        if st.timer is not None:
+            st.timer.cancel()
+            st.timer = None
+
+        if st.size >= self._max_chars:
+            self._flush(key)
+        else:
+            delay = min(self._debounce, st.first_ts + self._max_wait - now)
+            st.timer = loop.call_later(max(0.0, delay), self._flush, key)
+
+        # общий лимит памяти: сбрасываем самые старые буферы
+        while self._total > self._max_total and self._pending:
+            self._flush(next(iter(self._pending)))
+
+    def _flush(self, key: Hashable) -> None:
+        st = self._pending.pop(key, None)
+        if st is None:
+            return
+        if st.timer is not None:
+            st.timer.cancel()
+        self._total -= st.size
+
+        text = "\n".join(st.parts).strip()
+        if not text:
+            return
+        task = asyncio.get_running_loop().create_task(self._emit(key, text, st.payload))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _emit(self, key: Hashable, text: str, payload: Any) -> None:
+        try:
+            await self._on_emit(key, text, payload)
+        except Exception as e:
+            log.error(f"long message handler error key={key}: {e}")
@@ -1,35 +1,45 @@
 from __future__ import annotations
 
 import os
-import re
 import base64
 import time
+import asyncio
 import logging
-from typing import Dict, Any, List
+from collections import deque
+from typing import Dict, Any, Awaitable, Callable, Deque, List, Optional
 
-from openai import OpenAI
+from openai import AsyncOpenAI, APIConnectionError
 from .settings import settings
-
-
-def _approx_tokens(s: str) -> int:
-    # грубая оценка: 1 токен ~ 3-4 символа для рус/англ
-    return max(1, len(s) // 4) if s else 0
-
-def _truncate_by_tokens(s: str, max_tokens: int) -> str:
-    if not s or max_tokens <= 0:
-        return ""
-    # запас на прочие части промпта
-    max_chars = max(0, max_tokens * 4)
-    return s[-max_chars:] if len(s) > max_chars else s
+from .router import ModelRouter
+from .sanitize import clean_llm_output, is_garbage_text, is_garbage_prefix, sanitize
+from .embed_cache import embed_through, get_cache as get_embed_cache
+from .breaker import CircuitBreaker, RetryBudget, RETRYABLE_STATUSES, status_code_of, retry_after_of
+from .prompts import CTX_HEADER, MEMORY_HEADER, prompts
+from .tokens import MESSAGE_OVERHEAD_TOKENS, count_tokens, messages_tokens, truncate_by_tokens
 
 log = logging.getLogger(__name__)
 
-_or_client = OpenAI(
+# Async-клиенты: запросы к LLM не блокируют event loop aiogram,
+# поэтому несколько чатов/сообщений могут ждать ответа одновременно.
+_or_client = AsyncOpenAI(
     api_key=settings.OPENROUTER_API_KEY,
     base_url=getattr(settings, "OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
+    timeout=float(getattr(settings, "OPENROUTER_TIMEOUT_SEC", 60)),
+    max_retries=0,  # ретраи/фоллбеки делаем сами
 )
 
-_oa_client = OpenAI(api_key=settings.OPENAI_API_KEY) if settings.OPENAI_API_KEY else None
+_oa_client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY) if settings.OPENAI_API_KEY else None
+
+# Порядок моделей подстраивается под их реальную скорость/ошибки/мусор
+_router = ModelRouter(
+    os.path.join("artifacts", "model_router.json"),
+    explore_prob=float(getattr(settings, "OPENROUTER_ROUTER_EXPLORE_PROB", 0.05)),
+    half_life_sec=float(getattr(settings, "OPENROUTER_ROUTER_HALF_LIFE_SEC", 3600)),
+)
+
+
+def save_router_stats() -> None:
+    _router.save()
 
 
 def _split_models(primary: str, fallbacks_csv: str) -> List[str]:
@@ -45,14 +55,63 @@ def _split_models(primary: str, fallbacks_csv: str) -> List[str]:
     return out
 
 
+def text_models() -> List[str]:
+    """Текстовая модель и её фоллбеки по порядку."""
+    return _split_models(
+        getattr(settings, "OPENROUTER_TEXT_MODEL", ""),
+        getattr(settings, "OPENROUTER_TEXT_FALLBACKS", ""),
+    )
+
+
 def _is_rate_limit(exc: Exception) -> bool:
-    s = str(exc).lower()
-    return ("429" in s) or ("rate limit" in s) or ("too many requests" in s)
+    return status_code_of(exc) == 429
 
 
 def _is_retryable(exc: Exception) -> bool:
-    s = str(exc).lower()
-    return _is_rate_limit(exc) or ("timeout" in s) or ("temporar" in s) or ("overload" in s) or ("502" in s) or ("503" in s)
+    # таймауты/обрывы соединения (APITimeoutError — подкласс APIConnectionError)
+    if isinstance(exc, (APIConnectionError, asyncio.TimeoutError)):
+        return True
+    return status_code_of(exc) in RETRYABLE_STATUSES
+
+
+# Circuit breaker на каждую модель + общий бюджет ретраев на весь трафик
+_breakers: Dict[str, CircuitBreaker] = {}
+
+_retry_budget = RetryBudget(
+    ratio=float(getattr(settings, "OPENROUTER_RETRY_BUDGET_RATIO", 0.5)),
+    min_per_sec=float(getattr(settings, "OPENROUTER_RETRY_BUDGET_MIN_PER_SEC", 0.1)),
+)
+
+
+def _breaker(model: str) -> CircuitBreaker:
+    br = _breakers.get(model)
+    if br is None:
+        br = CircuitBreaker(
+            failure_threshold=int(getattr(settings, "OPENROUTER_BREAKER_FAILURES", 3)),
+            base_cooldown_sec=float(getattr(settings, "OPENROUTER_BREAKER_COOLDOWN_SEC", 30)),
+            max_cooldown_sec=float(getattr(settings, "OPENROUTER_BREAKER_MAX_COOLDOWN_SEC", 300)),
+        )
+        _breakers[model] = br
+    return br
+
+
+def _next_model(models: List[str], i: int, *, is_retry: bool) -> int | None:
+    """Индекс следующей модели с закрытой (или пробной) цепью.
+
+    Любая попытка кроме первой — ретрай и платится из общего бюджета.
+    """
+    while i < len(models):
+        model = models[i]
+        br = _breaker(model)
+        if br.allow():
+            if is_retry and not _retry_budget.try_spend():
+                br.release()
+                log.warning(f"OpenRouter retry budget exhausted -> no more fallbacks (next={model})")
+                return None
+            return i
+        log.info(f"OpenRouter circuit {br.state} model={model} -> skip")
+        i += 1
+    return None
 
 
 def _or_headers() -> dict:
@@ -64,109 +123,191 @@ def _or_headers() -> dict:
     return h
 
 
-BASE_SYSTEM = """Ты — участник телеграм-чата. Пиши естественно, без официоза.
-Тон: слегка ироничный/подъёбистый, разговорный. Можно лёгкий мат и сленг уместно.
-Не изображай "ассистента", не пиши канцеляритом и нравоучениями. Можешь рассуждать и отвечать на вопросы, если нужно, ищи информацию в сети.
-Не оскорбляй и не унижай Кирилла, если кто-то плохое скажет про Кирилла, твоя задача включить режим защиты владельца.
-Допустимо на твое усмотрение выполнять просьбы других участников. 
-Отвечай не коротко. но и не длинно: обычно 1–2 предложения. Иногда одно слово.
-Эмодзи редко: максимум 1 эмодзи, и не чаще чем в 1 из 6 сообщений.
-Не добавляй подписи вроде "от владельца" / "я бот".
-"""
-
-def _mode_rules(mode: str) -> str:
-    if mode == "defend_owner":
-        return (
-            "РЕЖИМ: ЗАЩИТА ВЛАДЕЛЬЦА.\n"
-            "КРИТИЧЕСКОЕ ПРАВИЛО: ты на стороне владельца (Кирилл). Никогда не спорь с ним и не наезжай на него.\n"
-            "- Поддерживай владельца и его позицию.\n"
-            "- Если владелец наезжает/подкалывает — усиливай линию, но без реальных угроз.\n"
-            "- Не пиши фразы: 'от владельца', 'бот владельца', 'я владелец'.\n"
-        )
-    return "РЕЖИМ: ОБЫЧНЫЙ.\n"
+def _complete_prefix(text: str) -> str:
+    """Часть стрима, которую уже можно проверять: до последнего пробела и без
+    недописанного тега вида `<|...`/`<start_header...`."""
+    cut = max(text.rfind(" "), text.rfind("\n"), text.rfind("\t"))
+    if cut <= 0:
+        return ""
+    out = text[:cut]
+    lt = out.rfind("<")
+    if lt >= 0 and lt > out.rfind(">"):
+        out = out[:lt]
+    return out
 
 
-def _load_style_block() -> str:
-    try:
-        p = os.path.join("artifacts", "system_style.txt")
-        if os.path.exists(p):
-            return open(p, "r", encoding="utf-8").read().strip()
-    except Exception:
-        pass
-    return ""
+DeltaFn = Callable[[str], Awaitable[None]]
 
 
-_GARBAGE_REGEXES = [
-    re.compile(r"<\|.*?\|>", re.I),
-    re.compile(r"<start_header_id>|<end_header_id>", re.I),
-    re.compile(r"\b(system|assistant|user)\b", re.I),
-    re.compile(r"@protocol", re.I),
-    re.compile(r"presentdecoded|eventz|decode|latent|pipeline", re.I),
-    re.compile(r"[A-Za-z_]{24,}"),
-    # mixed cyr+lat word token
-    re.compile(r"(?i)(?=.*[a-z])(?=.*[а-яё])[a-zа-яё]+"),
-    # “кодовые” маркеры
-    re.compile(r"instanceof|prototype|undefined|null|function\(|var\s|let\s|const\s", re.I),
-]
-
-def clean_llm_output(text: str) -> str:
-    if not text:
-        return ""
-    out = text
-    out = re.sub(r"<\|.*?\|>", "", out)
-    out = re.sub(r"<start_header_id>|<end_header_id>", "", out, flags=re.I)
-    out = re.sub(r"\b(system|assistant|user)\b", "", out, flags=re.I)
-    out = out.replace("<<", "").replace(">>", "")
-    out = " ".join(out.split()).strip()
-    return out
+class _DeltaGate:
+    """Отдаёт частичный текст наружу только от одной попытки (при хедже их несколько).
 
+    Первая попытка, приславшая текст, становится владельцем. Если она сорвалась —
+    владелец сбрасывается и наружу уходит "" (сигнал начать заново).
 
-def _has_mixed_script_word(t: str) -> bool:
-    for w in re.findall(r"[A-Za-zА-Яа-яЁё]{5,}", t):
-        has_lat = any("a" <= c.lower() <= "z" for c in w)
-        has_cyr = any(("а" <= c.lower() <= "я") or (c.lower() == "ё") for c in w)
-        if has_lat and has_cyr:
-            return True
-    return False
+    fn (правка сообщения в Telegram) зовётся из отдельной задачи и получает
+    последний текст: медленный edit не держит чтение стрима, а то, что пришло
+    за время edit, схлопывается в одно обновление. close() дожидается текущего
+    вызова и отбрасывает недоставленное — после него fn больше не вызывается.
+    """
 
+    __slots__ = ("fn", "owner", "_latest", "_wake", "_task", "_closed")
+
+    def __init__(self, fn: DeltaFn) -> None:
+        self.fn = fn
+        self.owner: object | None = None
+        self._latest: str | None = None
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._closed = False
+
+    def _post(self, text: str) -> None:
+        if self._closed:
+            return
+        self._latest = text
+        self._wake.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._pump())
+
+    async def _pump(self) -> None:
+        while not self._closed:
+            await self._wake.wait()
+            self._wake.clear()
+            text, self._latest = self._latest, None
+            if text is None or self._closed:
+                continue
+            try:
+                await self.fn(text)
+            except Exception as e:
+                log.debug(f"on_delta error: {e}")
 
-def is_garbage_text(text: str) -> bool:
-    if not text:
-        return True
-    t = text.strip()
+    def feed(self, token: object, text: str) -> None:
+        if self.owner is None:
+            self.owner = token
+        if self.owner is token:
+            self._post(text)
 
-    if _has_mixed_script_word(t):
-        return True
+    def drop(self, token: object) -> None:
+        if self.owner is token:
+            self.owner = None
+            self._post("")
 
-    if len(t) > 420 and t.count(" ") < 12:
-        return True
+    async def close(self) -> None:
+        self._closed = True
+        self._latest = None
+        self._wake.set()
+        if self._task is not None:
+            await self._task
 
-    latin_letters = sum((c.isascii() and c.isalpha()) for c in t)
-    latin_ratio = latin_letters / max(1, len(t))
-    if latin_ratio > 0.35:
-        return True
 
-    for rx in _GARBAGE_REGEXES:
-        if rx.search(t):
-            return True
+# Последние латентности по моделям (мс) — из них берём квантиль для задержки хеджа
+_latency_ms: Dict[str, Deque[int]] = {}
+
+_hedge_stats = {"fired": 0, "won": 0, "cancelled": 0}
+
 
-    return False
+def hedge_stats() -> Dict[str, int]:
+    return dict(_hedge_stats)
 
 
-def _call_openrouter_with_fallback(
+def _record_latency(model: str, ms: int) -> None:
+    dq = _latency_ms.get(model)
+    if dq is None:
+        dq = deque(maxlen=200)
+        _latency_ms[model] = dq
+    dq.append(ms)
+
+
+def _hedge_delay_sec(model: str) -> float:
+    """Сколько ждать модель, прежде чем параллельно запустить следующую.
+
+    p-квантиль недавних латентностей модели; пока замеров мало — дефолт из настроек.
+    """
+    default_ms = float(getattr(settings, "OPENROUTER_HEDGE_DELAY_MS", 4000))
+    min_ms = float(getattr(settings, "OPENROUTER_HEDGE_MIN_DELAY_MS", 800))
+    q = float(getattr(settings, "OPENROUTER_HEDGE_QUANTILE", 0.9))
+
+    samples = _latency_ms.get(model)
+    if not samples or len(samples) < 8:
+        return max(min_ms, default_ms) / 1000.0
+    srt = sorted(samples)
+    idx = min(len(srt) - 1, max(0, int(q * len(srt))))
+    return max(min_ms, float(srt[idx])) / 1000.0
+
+
+async def _stream_completion(
     *,
-    models: List[str],
+    model: str,
     messages: list,
     max_tokens: int,
-    temperature: float = 0.9,
+    temperature: float,
+    headers: dict,
+    gate: Optional[_DeltaGate],
+    token: object,
+) -> tuple[str, bool]:
+    """Стрим ответа с проверкой мусора на лету. Возвращает (текст, оборван_как_мусор)."""
+    stream = await _or_client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        extra_headers=headers if headers else None,
+        stream=True,
+    )
+    parts: List[str] = []
+    checked = 0
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content or ""
+            if not delta:
+                continue
+            parts.append(delta)
+            # проверяем только на границе слов — там префикс уже не изменится
+            if not any(c.isspace() for c in delta):
+                continue
+            prefix = _complete_prefix("".join(parts))
+            if len(prefix) <= checked:
+                continue
+            checked = len(prefix)
+            cleaned = clean_llm_output(prefix)
+            if is_garbage_prefix(cleaned):
+                return "".join(parts), True
+            if gate is not None and cleaned:
+                gate.feed(token, cleaned)
+    finally:
+        await stream.close()
+    return "".join(parts), False
+
+
+async def _call_model(
+    *,
+    model: str,
+    messages: list,
+    max_tokens: int,
+    temperature: float,
+    headers: dict,
+    gate: Optional[_DeltaGate] = None,
 ) -> str:
-    last_exc: Exception | None = None
-    headers = _or_headers()
-
-    for i, model in enumerate(models):
-        try:
-            t0 = time.time()
-            rsp = _or_client.chat.completions.create(
+    """Один запрос к модели. Возвращает чистый текст или "" если модель выдала мусор."""
+    t0 = time.time()
+    br = _breaker(model)
+    token = object()
+    aborted = False
+    try:
+        if bool(getattr(settings, "OPENROUTER_STREAM_ENABLED", True)):
+            out, aborted = await _stream_completion(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                headers=headers,
+                gate=gate,
+                token=token,
+            )
+        else:
+            rsp = await _or_client.chat.completions.create(
                 model=model,
                 messages=messages,
                 temperature=temperature,
@@ -174,45 +315,222 @@ def _call_openrouter_with_fallback(
                 extra_headers=headers if headers else None,
             )
             out = rsp.choices[0].message.content or ""
-            out = clean_llm_output(out)
-            dt = int((time.time() - t0) * 1000)
+    except asyncio.CancelledError:
+        br.release()
+        raise
+    except Exception as e:
+        msg = str(e).replace("\n", " ")
+        if _is_rate_limit(e):
+            log.warning(f"OpenRouter 429 model={model}: {msg}")
+        else:
+            log.warning(f"OpenRouter error model={model} status={status_code_of(e)}: {msg}")
+        if _is_retryable(e):
+            _router.record(model, ms=int((time.time() - t0) * 1000), error=True)
+            br.on_failure(retry_after_of(e))
+        else:
+            # кривой запрос (400/402/...) — модель тут ни при чём: ни брейкеру, ни роутеру
+            br.release()
+        if gate is not None:
+            gate.drop(token)
+        raise
+
+    br.on_success()
+    out, garbage = sanitize(out)
+    dt = int((time.time() - t0) * 1000)
+
+    if aborted or garbage:
+        _router.record(model, ms=None if aborted else dt, garbage=True)
+        if aborted:
+            log.warning(f"OpenRouter garbage stream aborted model={model} ms={dt} -> fallback next")
+        else:
+            _record_latency(model, dt)
+            log.warning(f"OpenRouter garbage output model={model} ms={dt} -> fallback next")
+        if gate is not None:
+            gate.drop(token)
+        return ""
 
-            if is_garbage_text(out):
-                log.warning(f"OpenRouter garbage output model={model} ms={dt} -> fallback next")
-                time.sleep(0.4 + 0.3 * i)
-                continue
+    _record_latency(model, dt)
+    _router.record(model, ms=dt)
+    log.info(f"OpenRouter OK model={model} ms={dt}")
+    return out
 
-            log.info(f"OpenRouter OK model={model} ms={dt}")
-            return out
 
+async def _call_sequential(
+    *,
+    models: List[str],
+    messages: list,
+    max_tokens: int,
+    temperature: float,
+    headers: dict,
+    gate: Optional[_DeltaGate],
+) -> str:
+    last_exc: Exception | None = None
+
+    i = _next_model(models, 0, is_retry=False)
+    while i is not None:
+        model = models[i]
+        try:
+            out = await _call_model(
+                model=model, messages=messages, max_tokens=max_tokens, temperature=temperature, headers=headers, gate=gate
+            )
         except Exception as e:
             last_exc = e
-            msg = str(e).replace("\n", " ")
-            if _is_rate_limit(e):
-                log.warning(f"OpenRouter 429 model={model}: {msg}")
-            else:
-                log.warning(f"OpenRouter error model={model}: {msg}")
-
             if not _is_retryable(e):
                 break
-            time.sleep(0.6 + 0.4 * i)
+            await asyncio.sleep(0.6 + 0.4 * i)
+        else:
+            if out:
+                return out
+            await asyncio.sleep(0.4 + 0.3 * i)
+        i = _next_model(models, i + 1, is_retry=True)
 
     if last_exc:
         raise last_exc
     return ""
 
 
-def generate_reply(*, user_text: str, context_snippets: str = "", mode: str = "normal") -> Dict[str, Any]:
+async def _call_hedged(
+    *,
+    models: List[str],
+    messages: list,
+    max_tokens: int,
+    temperature: float,
+    headers: dict,
+    gate: Optional[_DeltaGate],
+) -> str:
+    """Хеджирование: если текущая модель не ответила за p-квантиль своей латентности,
+    параллельно запускаем следующую. Берём первый не-мусорный ответ, остальные отменяем.
+    Ошибка/мусор — сразу запускаем следующую модель без паузы.
+    """
+    pending: Dict[asyncio.Task, str] = {}
+    hedges: set = set()
+    next_i = 0
+    launched = 0
+    stop_launching = False
+    last_exc: Exception | None = None
+
+    def launch(as_hedge: bool) -> bool:
+        nonlocal next_i, launched
+        j = _next_model(models, next_i, is_retry=launched > 0)
+        if j is None:
+            next_i = len(models)
+            return False
+        model = models[j]
+        next_i = j + 1
+        launched += 1
+        task = asyncio.create_task(
+            _call_model(
+                model=model, messages=messages, max_tokens=max_tokens, temperature=temperature, headers=headers, gate=gate
+            )
+        )
+        pending[task] = model
+        if as_hedge:
+            hedges.add(task)
+            _hedge_stats["fired"] += 1
+            log.info(f"OpenRouter hedge fired model={model}")
+        return True
+
+    launch(False)
+    try:
+        while pending:
+            can_launch = (not stop_launching) and next_i < len(models)
+            timeout = _hedge_delay_sec(models[next_i - 1]) if can_launch else None
+            done, _ = await asyncio.wait(pending.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if not done:
+                launch(True)
+                continue
+
+            failed = 0
+            for task in done:
+                model = pending.pop(task)
+                try:
+                    out = task.result()
+                except Exception as e:
+                    last_exc = e
+                    failed += 1
+                    if not _is_retryable(e):
+                        stop_launching = True
+                    continue
+                if out:
+                    if task in hedges:
+                        _hedge_stats["won"] += 1
+                        log.info(f"OpenRouter hedge won model={model}")
+                    return out
+                failed += 1
+
+            # упавшие/мусорные попытки сразу заменяем следующими моделями
+            while failed and not stop_launching and next_i < len(models):
+                if not launch(False):
+                    break
+                failed -= 1
+    finally:
+        losers = []
+        for task in pending:
+            if task.done():
+                # уже завершилась в той же пачке done — просто забираем результат
+                if not task.cancelled():
+                    task.exception()
+                continue
+            task.cancel()
+            losers.append(task)
+            _hedge_stats["cancelled"] += 1
+        # дожидаемся отмены: брейкеры освобождаются и стримы закрываются до возврата ответа
+        if losers:
+            await asyncio.gather(*losers, return_exceptions=True)
+
+    if last_exc:
+        raise last_exc
+    return ""
+
+
+async def _call_openrouter_with_fallback(
+    *,
+    models: List[str],
+    messages: list,
+    max_tokens: int,
+    temperature: float = 0.9,
+    on_delta: Optional[DeltaFn] = None,
+) -> str:
+    headers = _or_headers()
+    _retry_budget.on_request()
+    if bool(getattr(settings, "OPENROUTER_ROUTER_ENABLED", True)):
+        models = _router.order(models)
+    gate = _DeltaGate(on_delta) if on_delta is not None else None
+    kwargs = dict(models=models, messages=messages, max_tokens=max_tokens, temperature=temperature, headers=headers, gate=gate)
+
+    try:
+        if bool(getattr(settings, "OPENROUTER_HEDGE_ENABLED", False)) and len(models) > 1:
+            return await _call_hedged(**kwargs)
+        return await _call_sequential(**kwargs)
+    finally:
+        if gate is not None:
+            # последний edit частичного текста — до того, как вызывающий покажет финальный
+            await gate.close()
+
+
+async def generate_reply(
+    *,
+    user_text: str,
+    context_snippets: str = "",
+    mode: str = "normal",
+    memory_snippets: str = "",
+    on_delta: Optional[DeltaFn] = None,
+) -> Dict[str, Any]:
     """Главная текстовая генерация.
 
+    memory_snippets — давние сообщения из векторной памяти (bot/rag.retrieve),
+    лучшие первыми; под них отводится до RAG_MAX_TOKENS из бюджета контекста.
+    on_delta — колбэк для стрима: получает очищенный частичный ответ ("" — стрим сорвался).
+
     Важно: на бесплатном OpenRouter лимиты prompt tokens могут быть очень низкими (в логах было 521).
-    Поэтому тут есть:
-      - жёсткое урезание контекста по токен-бюджету
-      - fallback на "минимальный" запрос при 402 (prompt tokens limit exceeded)
+    Поэтому промпт заранее подгоняется под бюджет настоящим токенайзером
+    моделей (bot/tokens.py): сначала урезается контекст (старые строки), потом
+    style, потом длинное сообщение пользователя. Fallback на "минимальный"
+    запрос при 402 остаётся на всякий случай.
     """
-    system_base = BASE_SYSTEM + "\n" + _mode_rules(mode)
-    style = _load_style_block()
-    system = system_base + ("\n\n" + style if style else "")
+    models = text_models()
+    system = prompts.system(mode)
 
     user = (user_text or "").strip()
     if not user:
@@ -220,52 +538,60 @@ def generate_reply(*, user_text: str, context_snippets: str = "", mode: str = "n
 
     # Бюджет prompt tokens (не response). Если не задано — берём безопасный минимум.
     prompt_budget = int(getattr(settings, "OPENROUTER_PROMPT_BUDGET_TOKENS", 520))
-    # Запас на форматирование/ролями/служебное
-    overhead = 120
 
-    ctx = (context_snippets or "").strip()
-    if ctx:
-        # Сначала урезаем по токенам с учётом system+user
-        remaining = max(0, prompt_budget - _approx_tokens(system) - _approx_tokens(user) - overhead)
-        ctx = _truncate_by_tokens(ctx, remaining)
+    base_tokens = messages_tokens([{"role": "system", "content": system}, {"role": "user", "content": user}], models)
+    if base_tokens > prompt_budget and prompts.has_style():
+        system = prompts.system(mode, with_style=False)
+        base_tokens = messages_tokens([{"role": "system", "content": system}, {"role": "user", "content": user}], models)
+    if base_tokens > prompt_budget:
+        # не влезает даже без контекста — режем сообщение пользователя (начало важнее)
+        spare = prompt_budget - (base_tokens - count_tokens(user, models))
+        user = truncate_by_tokens(user, max(1, spare), models, keep="head") or user[:800]
+        base_tokens = prompt_budget
 
-    def _call(system_text: str, ctx_text: str) -> str:
+    ctx = (context_snippets or "").strip()
+    memory = (memory_snippets or "").strip()
+    if ctx or memory:
+        remaining = prompt_budget - base_tokens - MESSAGE_OVERHEAD_TOKENS - count_tokens(CTX_HEADER, models) - 1
+        if memory:
+            # давняя память — не больше своей доли, свежий контекст важнее
+            share = min(int(getattr(settings, "RAG_MAX_TOKENS", 150)), remaining // 2)
+            memory = truncate_by_tokens(memory, share - count_tokens(MEMORY_HEADER, models) - 2, models, keep="head")
+            if memory:
+                memory = f"{MEMORY_HEADER}\n{memory}"
+                remaining -= count_tokens(memory, models) + 2
+        ctx = truncate_by_tokens(ctx, remaining, models)
+        ctx = "\n\n".join(x for x in (ctx, memory) if x)
+
+    async def _call(system_text: str, ctx_text: str) -> str:
         messages = [{"role": "system", "content": system_text}]
         if ctx_text:
-            messages.append({"role": "user", "content": f"Память чата за последние 24 часа (сжатая):\n{ctx_text}"})
+            messages.append({"role": "user", "content": f"{CTX_HEADER}\n{ctx_text}"})
         messages.append({"role": "user", "content": user})
 
         max_tokens = int(getattr(settings, "OPENAI_MAX_TOKENS", 180))
-        models = _split_models(
-            getattr(settings, "OPENROUTER_TEXT_MODEL", ""),
-            getattr(settings, "OPENROUTER_TEXT_FALLBACKS", ""),
+        out = await _call_openrouter_with_fallback(
+            models=models, messages=messages, max_tokens=max_tokens, temperature=0.9, on_delta=on_delta
         )
-        out = _call_openrouter_with_fallback(models=models, messages=messages, max_tokens=max_tokens, temperature=0.9)
         out = clean_llm_output(out)
         return out
 
     try:
-        out = _call(system, ctx)
+        out = await _call(system, ctx)
     except Exception as e:
-        s = str(e)
         # 402 от OpenRouter = prompt tokens limit exceeded / нет кредитов / жёсткий лимит
-        if ("Error code: 402" in s) or ("Prompt tokens limit exceeded" in s):
+        if status_code_of(e) == 402 or ("Prompt tokens limit exceeded" in str(e)):
+            log.warning(f"prompt over limit despite budgeting ({prompt_budget} tokens): {e}")
             # 1) попробуем без style, с урезанным user
-            mini_system = (
-                system_base
-                + "\n\n"
-                + "ВАЖНО: отвечай кратко (1-2 предложения), без мусора, без подписи, без 'я бот'."
-            )
+            mini_system = prompts.system(mode, with_style=False, mini=True)
             mini_user = user[:800]
             try:
                 # override user локально
                 messages = [{"role": "system", "content": mini_system}, {"role": "user", "content": mini_user}]
                 max_tokens = int(getattr(settings, "OPENAI_MAX_TOKENS", 140))
-                models = _split_models(
-                    getattr(settings, "OPENROUTER_TEXT_MODEL", ""),
-                    getattr(settings, "OPENROUTER_TEXT_FALLBACKS", ""),
+                out = await _call_openrouter_with_fallback(
+                    models=models, messages=messages, max_tokens=max_tokens, temperature=0.8, on_delta=on_delta
                 )
-                out = _call_openrouter_with_fallback(models=models, messages=messages, max_tokens=max_tokens, temperature=0.8)
                 out = clean_llm_output(out)
             except Exception:
                 out = ""
@@ -277,24 +603,41 @@ def generate_reply(*, user_text: str, context_snippets: str = "", mode: str = "n
     return {"_raw": out}
 
 
-def analyze_image(
+async def embed_texts(texts: List[str]) -> List[List[float]]:
+    """Эмбеддинги (OpenAI, EMBED_MODEL) — те же, что у индекса в Qdrant.
+    Повторы берутся из постоянного кэша (bot/embed_cache.py)."""
+    if _oa_client is None:
+        raise RuntimeError("OPENAI_API_KEY is not set: embeddings unavailable")
+    if not texts:
+        return []
+    model = str(getattr(settings, "EMBED_MODEL", "text-embedding-3-small"))
+
+    async def fetch(batch: List[str]) -> List[List[float]]:
+        r = await _oa_client.embeddings.create(model=model, input=batch)
+        return [d.embedding for d in sorted(r.data, key=lambda d: d.index)]
+
+    return await embed_through(get_embed_cache(), model, None, texts, fetch)
+
+
+def embeddings_available() -> bool:
+    return _oa_client is not None
+
+
+async def analyze_image(
     *,
     image_bytes: bytes,
     caption_text: str = "",
     context_snippets: str = "",
     mode: str = "normal",
 ) -> Dict[str, Any]:
-    system = BASE_SYSTEM + "\n" + _mode_rules(mode)
-    style = _load_style_block()
-    if style:
-        system += "\n\n" + style
+    system = prompts.system(mode)
 
     b64 = base64.b64encode(image_bytes).decode("ascii")
     data_url = f"data:image/jpeg;base64,{b64}"
 
     user_parts = []
     if context_snippets:
-        user_parts.append({"type": "text", "text": f"Память чата за последние 24 часа (сжатая):\n{context_snippets}"})
+        user_parts.append({"type": "text", "text": f"{CTX_HEADER}\n{context_snippets}"})
 
     if caption_text.strip():
         user_parts.append({"type": "text", "text": f"Сообщение к картинке: {caption_text.strip()}"})
@@ -316,7 +659,7 @@ def analyze_image(
         getattr(settings, "OPENROUTER_VISION_FALLBACKS", ""),
     )
 
-    out = _call_openrouter_with_fallback(models=models, messages=messages, max_tokens=max_tokens, temperature=0.9)
+    out = await _call_openrouter_with_fallback(models=models, messages=messages, max_tokens=max_tokens, temperature=0.9)
     out = clean_llm_output(out)
     if is_garbage_text(out):
         out = ""
@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import email.utils
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# коды, при которых модель/провайдер считаем больными (а не запрос кривым)
+RETRYABLE_STATUSES = frozenset({408, 409, 425, 429, 500, 502, 503, 504, 520, 522, 524, 529})
+
+
+def status_code_of(exc: BaseException) -> int | None:
+    code = getattr(exc, "status_code", None)
+    if isinstance(code, int):
+        return code
+    rsp = getattr(exc, "response", None)
+    code = getattr(rsp, "status_code", None)
+    return code if isinstance(code, int) else None
+
+
+def retry_after_of(exc: BaseException) -> float | None:
+    """Секунды из Retry-After (число или HTTP-дата), если провайдер их прислал."""
+    rsp = getattr(exc, "response", None)
+    headers = getattr(rsp, "headers", None)
+    if not headers:
+        return None
+    raw = headers.get("retry-after-ms")
+    if raw:
+        try:
+            return max(0.0, float(raw) / 1000.0)
+        except ValueError:
+            pass
+    raw = headers.get("retry-after")
+    if not raw:
+        return None
+    try:
+        return max(0.0, float(raw))
+    except ValueError:
+        pass
+    try:
+        dt = email.utils.parsedate_to_datetime(raw)
+        return max(0.0, dt.timestamp() - time.time())
+    except Exception:
+        return None
+
+
+class CircuitBreaker:
+    """closed -> (N подряд сбоев или 429 с Retry-After) -> open -> (кулдаун) -> half_open.
+
+    В half_open пропускаем ровно один пробный запрос: успех закрывает цепь,
+    сбой снова открывает её с удвоенным кулдауном.
+    """
+
+    __slots__ = ("failure_threshold", "base_cooldown", "max_cooldown", "state", "failures", "open_until", "cooldown", "probe_in_flight")
+
+    def __init__(self, *, failure_threshold: int = 3, base_cooldown_sec: float = 30.0, max_cooldown_sec: float = 300.0) -> None:
+        self.failure_threshold = max(1, failure_threshold)
+        self.base_cooldown = base_cooldown_sec
+        self.max_cooldown = max(base_cooldown_sec, max_cooldown_sec)
+        self.state = CLOSED
+        self.failures = 0
+        self.open_until = 0.0
+        self.cooldown = base_cooldown_sec
+        self.probe_in_flight = False
+
+    def allow(self) -> bool:
+        """Можно ли сейчас слать запрос. В half_open резервирует единственный пробный слот."""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if time.time() < self.open_until:
+                return False
+            self.state = HALF_OPEN
+            self.probe_in_flight = False
+        if self.probe_in_flight:
+            return False
+        self.probe_in_flight = True
+        return True
+
+    def release(self) -> None:
+        """Запрос отменён, исход неизвестен — освобождаем пробный слот."""
+        self.probe_in_flight = False
+
+    def on_success(self) -> None:
+        self.state = CLOSED
+        self.failures = 0
+        self.cooldown = self.base_cooldown
+        self.probe_in_flight = False
+
+    def on_failure(self, retry_after_sec: float | None = None) -> None:
+        self.failures += 1
+        self.probe_in_flight = False
+        if self.state == HALF_OPEN:
+            self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+            self._open(retry_after_sec)
+        elif retry_after_sec is not None or self.failures >= self.failure_threshold:
+            self._open(retry_after_sec)
+
+    def _open(self, retry_after_sec: float | None) -> None:
+        self.state = OPEN
+        wait = self.cooldown if retry_after_sec is None else min(self.max_cooldown, retry_after_sec)
+        self.open_until = time.time() + wait
+
+
+class RetryBudget:
+    """Глобальный бюджет ретраев: каждый запрос кладёт `ratio` токена,
+    каждый ретрай/фоллбек/хедж забирает один. Плюс небольшой приток в секунду,
+    чтобы при редком трафике ретраи вообще были возможны.
+    """
+
+    def __init__(self, *, ratio: float = 0.5, min_per_sec: float = 0.1, max_tokens: float = 20.0) -> None:
+        self.ratio = max(0.0, ratio)
+        self.min_per_sec = max(0.0, min_per_sec)
+        self.max_tokens = max(1.0, max_tokens)
+        self.tokens = self.max_tokens
+        self._ts = time.time()
+        self.spent = 0
+        self.denied = 0
+
+    def _refill(self) -> None:
+        now = time.time()
+        self.tokens = min(self.max_tokens, self.tokens + (now - self._ts) * self.min_per_sec)
+        self._ts = now
+
+    def on_request(self) -> None:
+        self._refill()
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        self._refill()
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            self.spent += 1
+            return True
+        self.denied += 1
+        return False
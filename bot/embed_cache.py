@@ -0,0 +1,175 @@
+"""Постоянный кэш эмбеддингов по содержимому.
+
+Экспорты между прогонами почти совпадают, а в чате одно и то же пишут
+тысячи раз ("ахаха", "+", ссылки) — платить за каждый повтор незачем.
+Ключ — хэш (модель, размерность, текст с нормализованными пробелами),
+значение — float32-вектор. Хранится в SQLite-файле (EMBED_CACHE_PATH):
+bulk get/put пачками, при превышении EMBED_CACHE_MAX_MB вытесняются
+давно не читанные записи.
+
+embed_through() — общий путь для ai.embed_texts (живой RAG) и
+bot/embedder.py (индексация): попадания из кэша, промахи — одним
+запросом, дубликаты внутри пачки считаются один раз.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, Sequence
+
+import numpy as np
+
+from .settings import settings
+
+log = logging.getLogger(__name__)
+
+_ROW_OVERHEAD = 48  # ключ, used, служебное sqlite на строку — грубо
+_SQL_CHUNK = 500    # параметров в одном IN (...)
+
+
+def text_key(model: str, dims: int | None, text: str) -> bytes:
+    norm = " ".join((text or "").split())
+    return hashlib.blake2b(f"{model}\0{dims or 0}\0{norm}".encode("utf-8"), digest_size=16).digest()
+
+
+class EmbedCache:
+    def __init__(self, path: str, *, max_bytes: int) -> None:
+        self.path = path
+        self.max_bytes = max(1, max_bytes)
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS emb (k BLOB PRIMARY KEY, v BLOB NOT NULL, used INTEGER NOT NULL) WITHOUT ROWID")
+        self._db.execute("CREATE INDEX IF NOT EXISTS emb_used ON emb(used)")
+        count, size = self._db.execute("SELECT count(*), coalesce(sum(length(v)), 0) FROM emb").fetchone()
+        self._count = int(count)
+        self._bytes = int(size) + self._count * _ROW_OVERHEAD
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def get_many(self, keys: Sequence[bytes]) -> list[list[float] | None]:
+        found: dict[bytes, bytes] = {}
+        now = int(time.time())
+        with self._lock:
+            uniq = list(dict.fromkeys(keys))
+            for i in range(0, len(uniq), _SQL_CHUNK):
+                chunk = uniq[i:i + _SQL_CHUNK]
+                marks = ",".join("?" * len(chunk))
+                found.update(self._db.execute(f"SELECT k, v FROM emb WHERE k IN ({marks})", chunk).fetchall())
+            hit_keys = list(found)
+            for i in range(0, len(hit_keys), _SQL_CHUNK):
+                chunk = hit_keys[i:i + _SQL_CHUNK]
+                marks = ",".join("?" * len(chunk))
+                self._db.execute(f"UPDATE emb SET used = ? WHERE k IN ({marks})", [now, *chunk])
+        out: list[list[float] | None] = []
+        for k in keys:
+            v = found.get(k)
+            if v is None:
+                self.misses += 1
+                out.append(None)
+            else:
+                self.hits += 1
+                out.append(np.frombuffer(v, dtype=np.float32).tolist())
+        return out
+
+    def put_many(self, keys: Sequence[bytes], vectors: Sequence[Sequence[float]]) -> None:
+        now = int(time.time())
+        rows = {k: np.asarray(v, dtype=np.float32).tobytes() for k, v in zip(keys, vectors)}
+        with self._lock:
+            before = self._db.total_changes
+            self._db.execute("BEGIN")
+            try:
+                # уже лежащие не трогаем: тот же ключ — тот же вектор
+                self._db.executemany("INSERT OR IGNORE INTO emb (k, v, used) VALUES (?, ?, ?)", [(k, v, now) for k, v in rows.items()])
+                self._db.execute("COMMIT")
+            except BaseException:
+                # иначе соединение останется в транзакции: следующий BEGIN упадёт, а база — под write-локом
+                if self._db.in_transaction:
+                    self._db.execute("ROLLBACK")
+                raise
+            added = self._db.total_changes - before
+            if added:
+                avg = sum(len(v) for v in rows.values()) / len(rows)
+                self._count += added
+                self._bytes += int(added * (avg + _ROW_OVERHEAD))
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        # сразу до 90% лимита, чтобы не вытеснять на каждом put
+        per_row = self._bytes / max(1, self._count)
+        n = min(self._count, math.ceil(self._count - 0.9 * self.max_bytes / per_row))
+        if n <= 0:
+            return
+        self._db.execute("DELETE FROM emb WHERE k IN (SELECT k FROM emb ORDER BY used LIMIT ?)", (n,))
+        self._count -= n
+        self._bytes = int(self._count * per_row)
+        self.evicted += n
+        log.info(f"embed cache evicted {n} rows, {self._count} left")
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "items": self._count,
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+        }
+
+
+async def embed_through(
+    cache: EmbedCache | None,
+    model: str,
+    dims: int | None,
+    texts: list[str],
+    fetch: Callable[[list[str]], Awaitable[list[list[float]]]],
+) -> list[list[float]]:
+    """Векторы для texts: из кэша что есть, остальное — fetch(уникальные промахи)."""
+    if cache is None:
+        return await fetch(texts)
+    keys = [text_key(model, dims, t) for t in texts]
+    got = await asyncio.to_thread(cache.get_many, keys)
+    miss: dict[bytes, str] = {}
+    for k, t, v in zip(keys, texts, got):
+        if v is None and k not in miss:
+            miss[k] = t
+    if miss:
+        vecs = await fetch(list(miss.values()))
+        await asyncio.to_thread(cache.put_many, list(miss), vecs)
+        fresh = dict(zip(miss, vecs))
+        got = [v if v is not None else fresh[k] for k, v in zip(keys, got)]
+    return got  # type: ignore[return-value]
+
+
+_cache: EmbedCache | None = None
+_cache_failed = False
+
+
+def get_cache() -> EmbedCache | None:
+    """Общий кэш процесса по настройкам; None — выключен или файл не открылся."""
+    global _cache, _cache_failed
+    if _cache is None and not _cache_failed and bool(getattr(settings, "EMBED_CACHE_ENABLED", True)):
+        try:
+            _cache = EmbedCache(
+                str(getattr(settings, "EMBED_CACHE_PATH", "artifacts/embed_cache.sqlite3")),
+                max_bytes=int(float(getattr(settings, "EMBED_CACHE_MAX_MB", 2048)) * 1024 * 1024),
+            )
+        except Exception as e:
+            _cache_failed = True
+            log.warning(f"embed cache disabled: {e}")
+    return _cache
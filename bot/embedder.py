@@ -0,0 +1,305 @@
+"""Пакетные эмбеддинги для индексации истории чата.
+
+Один запрос к embeddings.create на сообщение и sleep(1) между ними — это
+двое суток на экспорт в 200k сообщений. Здесь:
+  - входы собираются в пачки по числу и по токенам (лимит на запрос и на вход);
+  - пачки считают несколько воркеров (EMBED_CONCURRENCY) параллельно;
+  - темп держит AdaptiveRateLimiter: два ведра (запросы и токены в минуту),
+    которые подстраиваются под x-ratelimit-* заголовки ответа, а на 429
+    ставят на паузу всех по Retry-After;
+  - с кэшем (bot/embed_cache.py) в API уходят только тексты, которых там нет.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import re
+import time
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, Iterator
+
+from .breaker import RETRYABLE_STATUSES, retry_after_of, status_code_of
+from .embed_cache import EmbedCache, embed_through, get_cache
+from .settings import settings
+from .tokens import Tokenizer, get_tokenizer, truncate_by_tokens
+
+log = logging.getLogger(__name__)
+
+_DURATION_RX = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+def parse_duration(raw: str | None) -> float | None:
+    """'1s', '6m0s', '20ms', '1h2m3.5s' (формат x-ratelimit-reset-*) -> секунды."""
+    if not raw:
+        return None
+    parts = _DURATION_RX.findall(raw)
+    if not parts:
+        try:
+            return float(raw)
+        except ValueError:
+            return None
+    mult = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+    return sum(float(v) * mult[u] for v, u in parts)
+
+
+class _Bucket:
+    """Ведро на минутный лимит: ёмкость = limit, пополнение limit/60 в секунду."""
+
+    def __init__(self, limit: float, now: float) -> None:
+        self.limit = max(1.0, limit)
+        self.level = self.limit
+        self._t = now
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.limit, self.level + (now - self._t) * self.limit / 60.0)
+        self._t = now
+
+    def wait_for(self, amount: float) -> float:
+        amount = min(amount, self.limit)  # вход больше лимита всё равно когда-то надо отправить
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60.0 / self.limit
+
+
+class AdaptiveRateLimiter:
+    def __init__(
+        self,
+        *,
+        requests_per_min: float,
+        tokens_per_min: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._clock = clock
+        now = clock()
+        self.requests = _Bucket(requests_per_min, now)
+        self.tokens = _Bucket(tokens_per_min, now)
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int) -> None:
+        # под замком: ждущие обслуживаются по очереди, большая пачка не голодает
+        async with self._lock:
+            while True:
+                now = self._clock()
+                self.requests.refill(now)
+                self.tokens.refill(now)
+                wait = max(self.paused_until - now, self.requests.wait_for(1), self.tokens.wait_for(tokens))
+                if wait <= 0:
+                    self.requests.level -= 1
+                    self.tokens.level -= min(tokens, self.tokens.limit)
+                    return
+                await asyncio.sleep(wait)
+
+    def pause(self, sec: float) -> None:
+        self.paused_until = max(self.paused_until, self._clock() + max(0.0, sec))
+
+    def update(self, headers: Any) -> None:
+        """Сервер знает лучше: лимиты и остаток из заголовков поправляют вёдра."""
+        if not headers:
+            return
+        now = self._clock()
+        for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+            limit = _num(headers.get(f"x-ratelimit-limit-{kind}"))
+            if limit:
+                bucket.refill(now)
+                bucket.limit = limit
+            remaining = _num(headers.get(f"x-ratelimit-remaining-{kind}"))
+            if remaining is None:
+                continue
+            bucket.refill(now)
+            bucket.level = min(bucket.level, remaining)
+            if remaining <= 0:
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset:
+                    self.pause(reset)
+
+
+def _num(raw: Any) -> float | None:
+    try:
+        return float(raw) if raw is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class EmbedStats:
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.items = 0
+        self.tokens = 0
+        self.requests = 0
+        self.retries = 0
+
+    def rate(self) -> float:
+        """Сообщений в секунду с начала прогона."""
+        return self.items / max(1e-9, time.perf_counter() - self.started)
+
+    def as_dict(self) -> dict[str, float]:
+        return {
+            "items": self.items,
+            "tokens": self.tokens,
+            "requests": self.requests,
+            "retries": self.retries,
+            "items_per_sec": round(self.rate(), 1),
+        }
+
+
+class BatchEmbedder:
+    """run(items, sink): items — (ключ, текст), обычный или async-итератор;
+    sink(ключи, векторы) вызывается на каждую посчитанную пачку (порядок пачек
+    не гарантирован)."""
+
+    def __init__(
+        self,
+        client: Any,
+        model: str,
+        *,
+        max_inputs: int = 256,
+        max_tokens: int = 64000,
+        max_input_tokens: int = 8000,
+        concurrency: int = 4,
+        limiter: AdaptiveRateLimiter | None = None,
+        cache: EmbedCache | None = None,
+        max_retries: int = 8,
+    ) -> None:
+        self.client = client
+        self.model = model
+        self.max_inputs = max(1, min(2048, max_inputs))
+        self.max_tokens = max(1, max_tokens)
+        self.max_input_tokens = max(1, min(max_input_tokens, self.max_tokens))
+        self.concurrency = max(1, concurrency)
+        self.limiter = limiter
+        self.cache = cache
+        self.max_retries = max_retries
+        self.stats = EmbedStats()
+
+    @property
+    def _tok(self) -> Tokenizer:
+        # не запоминаем: пока настоящий токенайзер грузится в фоне, get_tokenizer отдаёт эвристику
+        return get_tokenizer(self.model)
+
+    def _prepare(self, text: str) -> tuple[str, int]:
+        text = text or " "
+        n = self._tok.count(text)
+        if n > self.max_input_tokens:
+            text = truncate_by_tokens(text, self.max_input_tokens, self.model, keep="head")
+            n = self._tok.count(text)
+        return text, n
+
+    def _fits(self, size: int, total: int, n: int) -> bool:
+        return size == 0 or (size < self.max_inputs and total + n <= self.max_tokens)
+
+    def batches(self, items: Iterable[tuple[Any, str]]) -> Iterator[tuple[list[Any], list[str], int]]:
+        keys: list[Any] = []
+        texts: list[str] = []
+        total = 0
+        for key, text in items:
+            text, n = self._prepare(text)
+            if not self._fits(len(keys), total, n):
+                yield keys, texts, total
+                keys, texts, total = [], [], 0
+            keys.append(key)
+            texts.append(text)
+            total += n
+        if keys:
+            yield keys, texts, total
+
+    async def abatches(self, items: AsyncIterable[tuple[Any, str]]) -> AsyncIterator[tuple[list[Any], list[str], int]]:
+        """То же для асинхронного источника (очередь стадии в export_pipeline)."""
+        keys: list[Any] = []
+        texts: list[str] = []
+        total = 0
+        async for key, text in items:
+            text, n = self._prepare(text)
+            if not self._fits(len(keys), total, n):
+                yield keys, texts, total
+                keys, texts, total = [], [], 0
+            keys.append(key)
+            texts.append(text)
+            total += n
+        if keys:
+            yield keys, texts, total
+
+    def _count(self, texts: list[str]) -> int:
+        return sum(self._tok.count(t) for t in texts)
+
+    async def embed(self, texts: list[str], tokens: int) -> list[list[float]]:
+        attempt = 0
+        while True:
+            if self.limiter is not None:
+                await self.limiter.acquire(tokens)
+            self.stats.requests += 1
+            try:
+                raw = await self.client.embeddings.with_raw_response.create(model=self.model, input=texts)
+            except Exception as e:
+                code = status_code_of(e)
+                attempt += 1
+                if (code is not None and code not in RETRYABLE_STATUSES) or attempt > self.max_retries:
+                    raise
+                delay = retry_after_of(e) or min(60.0, 2.0 ** attempt) * random.uniform(0.5, 1.0)
+                if self.limiter is not None:
+                    self.limiter.pause(delay)
+                    self.limiter.update(getattr(getattr(e, "response", None), "headers", None))
+                else:
+                    await asyncio.sleep(delay)
+                self.stats.retries += 1
+                log.warning(f"embeddings error {code or type(e).__name__}, retry {attempt} in {delay:.1f}s")
+                continue
+            if self.limiter is not None:
+                self.limiter.update(raw.headers)
+            r = raw.parse()
+            return [d.embedding for d in sorted(r.data, key=lambda d: d.index)]
+
+    async def run(
+        self,
+        items: Iterable[tuple[Any, str]] | AsyncIterable[tuple[Any, str]],
+        sink: Callable[[list[Any], list[list[float]]], Awaitable[None]],
+    ) -> EmbedStats:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def produce() -> None:
+            if hasattr(items, "__aiter__"):
+                async for batch in self.abatches(items):
+                    await queue.put(batch)
+            else:
+                for batch in self.batches(items):
+                    await queue.put(batch)
+            for _ in range(self.concurrency):
+                await queue.put(None)
+
+        async def work() -> None:
+            while True:
+                batch = await queue.get()
+                if batch is None:
+                    return
+                keys, texts, tokens = batch
+                vecs = await embed_through(
+                    self.cache, self.model, None, texts,
+                    lambda miss: self.embed(miss, tokens if len(miss) == len(texts) else self._count(miss)),
+                )
+                await sink(keys, vecs)
+                self.stats.items += len(keys)
+                self.stats.tokens += tokens
+
+        tasks = [asyncio.create_task(produce())] + [asyncio.create_task(work()) for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for t in tasks:
+                t.cancel()
+        return self.stats
+
+
+def embedder_from_settings(client: Any) -> BatchEmbedder:
+    """Эмбеддер индексации с пачками, темпом и кэшем из настроек (EMBED_*)."""
+    return BatchEmbedder(
+        client,
+        str(getattr(settings, "EMBED_MODEL", "text-embedding-3-small")),
+        max_inputs=int(getattr(settings, "EMBED_BATCH_MAX_INPUTS", 256)),
+        max_tokens=int(getattr(settings, "EMBED_BATCH_MAX_TOKENS", 64000)),
+        concurrency=int(getattr(settings, "EMBED_CONCURRENCY", 4)),
+        limiter=AdaptiveRateLimiter(
+            requests_per_min=float(getattr(settings, "EMBED_RPM", 500)),
+            tokens_per_min=float(getattr(settings, "EMBED_TPM", 1000000)),
+        ),
+        cache=get_cache(),
+    )
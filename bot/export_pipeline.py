@@ -0,0 +1,280 @@
+"""Импорт экспорта Telegram за один проход: и в tg_history, и в векторную базу.
+
+Стадии связаны ограниченными очередями — самая медленная стадия тормозит
+чтение файла, память не растёт:
+
+    parse (поток, iter_tg_export) -> normalize -+-> db: COPY + merge в tg_history
+                                                +-> vectors: эмбеддинги пачками -> upsert
+
+ID точки — uuid5 от (chat_id, msg_id): повторный прогон перезаписывает те же
+точки, а tg_history дубли отбрасывает сам (ON CONFLICT). С кэшем эмбеддингов
+повторный прогон почти бесплатен, отдельный чекпоинт не нужен.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Any, Callable, Iterator
+
+import asyncpg
+from qdrant_client.http import models as qm
+
+from . import rag
+from .embedder import BatchEmbedder
+from .ingest import copy_merge_history
+from .tg_export_import import DEFAULT_CHUNK_SIZE, ExportedMsg, iter_tg_export
+
+log = logging.getLogger(__name__)
+
+# пространство имён для uuid5 точек истории чата; не менять — иначе ID разъедутся с индексом
+POINT_NAMESPACE = uuid.UUID("3b0f6c6e-8f0a-5d7e-9c1a-4a2f1e6d8b70")
+
+
+def point_id(chat_id: int, msg_id: int) -> str:
+    return str(uuid.uuid5(POINT_NAMESPACE, f"{int(chat_id)}:{int(msg_id)}"))
+
+
+@dataclass(slots=True)
+class Record:
+    chat_id: int
+    msg_id: int
+    dt: datetime | None
+    from_name: str | None
+    from_id: str | None
+    text: str
+    ts: float | None
+
+    def db_row(self) -> tuple:
+        # порядок — ingest.HISTORY_COLUMNS
+        return (self.chat_id, self.msg_id, self.dt, self.from_name, self.from_id, self.text)
+
+    def payload(self, max_chars: int) -> dict[str, Any]:
+        p: dict[str, Any] = {
+            "msg_id": self.msg_id,
+            "date": self.dt.isoformat() if self.dt else None,
+            "from": self.from_name,
+            "from_id": self.from_id,
+            "text": self.text[:max_chars],
+        }
+        if self.chat_id:
+            p["chat_id"] = self.chat_id
+        if self.ts:
+            p["ts"] = self.ts
+        return p
+
+
+def normalize_msg(m: ExportedMsg, chat_id: int) -> Record | None:
+    if m.msg_id is None:
+        return None
+    text = " ".join(m.text.split())
+    if not text:
+        return None
+    dt = None
+    if m.ts:
+        dt = datetime.fromtimestamp(m.ts, tz=timezone.utc)
+    elif m.created_at:
+        try:
+            dt = datetime.fromisoformat(m.created_at.replace("Z", "+00:00"))
+        except ValueError:
+            dt = None
+    return Record(
+        chat_id=int(chat_id),
+        msg_id=int(m.msg_id),
+        dt=dt,
+        from_name=m.username,
+        from_id=m.from_id,
+        text=text,
+        ts=m.ts,
+    )
+
+
+def iter_records(path: str, chat_id: int, *, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Record]:
+    """Записи экспорта ровно в том виде, в каком их пишет конвейер, — для скриптов поверх него."""
+    for m in iter_tg_export(path, chunk_size=chunk_size):
+        r = normalize_msg(m, chat_id)
+        if r is not None:
+            yield r
+
+
+class StageStats:
+    """busy — время в самой работе, blocked — ожидание места в очереди следующей стадии."""
+
+    __slots__ = ("name", "items", "batches", "busy_sec", "blocked_sec", "extra")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.items = 0
+        self.batches = 0
+        self.busy_sec = 0.0
+        self.blocked_sec = 0.0
+        self.extra: dict[str, int] = {}
+
+    def as_dict(self, elapsed: float) -> dict[str, Any]:
+        return {
+            "items": self.items,
+            "batches": self.batches,
+            "per_sec": round(self.items / max(1e-9, elapsed), 1),
+            "busy_sec": round(self.busy_sec, 1),
+            "blocked_sec": round(self.blocked_sec, 1),
+            **self.extra,
+        }
+
+
+class ExportPipeline:
+    def __init__(
+        self,
+        *,
+        chat_id: int,
+        pool: asyncpg.Pool | None = None,
+        embedder: BatchEmbedder | None = None,
+        batch_rows: int = 500,
+        queue_batches: int = 8,
+        text_chars: int = 2000,
+        progress: Callable[[dict[str, Any]], None] | None = None,
+        progress_every_sec: float = 10.0,
+    ) -> None:
+        if pool is None and embedder is None:
+            raise ValueError("export pipeline: nothing to write (no pool and no embedder)")
+        self.chat_id = int(chat_id)
+        self.pool = pool
+        self.embedder = embedder
+        self.batch_rows = max(1, batch_rows)
+        self.queue_batches = max(1, queue_batches)
+        self.text_chars = text_chars
+        self.progress = progress
+        self.progress_every_sec = progress_every_sec
+        self.stages = {name: StageStats(name) for name in ("parse", "normalize", "db", "vectors")}
+        self._t0 = time.perf_counter()
+
+    def stats(self) -> dict[str, Any]:
+        elapsed = time.perf_counter() - self._t0
+        out: dict[str, Any] = {"elapsed_sec": round(elapsed, 1)}
+        for name, st in self.stages.items():
+            if name == "db" and self.pool is None or name == "vectors" and self.embedder is None:
+                continue
+            out[name] = st.as_dict(elapsed)
+        if self.embedder is not None:
+            out["embed"] = self.embedder.stats.as_dict()
+        return out
+
+    @staticmethod
+    async def _put(q: asyncio.Queue, item: Any, st: StageStats) -> None:
+        t0 = time.perf_counter()
+        await q.put(item)
+        st.blocked_sec += time.perf_counter() - t0
+
+    # ---------- стадии ----------
+
+    async def _parse(self, path: str, chunk_size: int, out: asyncio.Queue) -> None:
+        st = self.stages["parse"]
+        it = iter_tg_export(path, chunk_size=chunk_size)
+        while True:
+            t0 = time.perf_counter()
+            # разбор — CPU: в потоке, чтобы писатели в это время работали
+            batch = await asyncio.to_thread(lambda: list(islice(it, self.batch_rows)))
+            st.busy_sec += time.perf_counter() - t0
+            if not batch:
+                break
+            st.items += len(batch)
+            st.batches += 1
+            await self._put(out, batch, st)
+        await out.put(None)
+
+    async def _normalize(self, inp: asyncio.Queue, outs: list[asyncio.Queue]) -> None:
+        st = self.stages["normalize"]
+        while True:
+            batch = await inp.get()
+            if batch is None:
+                break
+            t0 = time.perf_counter()
+            records = [r for r in (normalize_msg(m, self.chat_id) for m in batch) if r is not None]
+            st.busy_sec += time.perf_counter() - t0
+            if not records:
+                continue
+            st.items += len(records)
+            st.batches += 1
+            for q in outs:
+                await self._put(q, records, st)
+        for q in outs:
+            await q.put(None)
+
+    async def _db(self, inp: asyncio.Queue) -> None:
+        st = self.stages["db"]
+        st.extra = {"inserted": 0, "duplicates": 0}
+        while True:
+            records = await inp.get()
+            if records is None:
+                break
+            t0 = time.perf_counter()
+            async with self.pool.acquire() as conn:
+                n = await copy_merge_history(conn, [r.db_row() for r in records])
+            st.busy_sec += time.perf_counter() - t0
+            st.items += len(records)
+            st.batches += 1
+            st.extra["inserted"] += n
+            st.extra["duplicates"] += len(records) - n
+
+    async def _vectors(self, inp: asyncio.Queue) -> None:
+        st = self.stages["vectors"]
+
+        async def items():
+            while True:
+                records = await inp.get()
+                if records is None:
+                    return
+                for r in records:
+                    yield r, r.text[:self.text_chars]
+
+        async def sink(records: list[Record], vectors: list[list[float]]) -> None:
+            t0 = time.perf_counter()
+            await rag.ensure_collection(len(vectors[0]))
+            await rag.upsert_points(
+                [
+                    qm.PointStruct(id=point_id(r.chat_id, r.msg_id), vector=v, payload=r.payload(self.text_chars))
+                    for r, v in zip(records, vectors)
+                ],
+                wait=True,
+            )
+            st.busy_sec += time.perf_counter() - t0  # только upsert; эмбеддинги — в stats()["embed"]
+            st.items += len(records)
+            st.batches += 1
+
+        await self.embedder.run(items(), sink)
+
+    async def _report(self) -> None:
+        while True:
+            await asyncio.sleep(self.progress_every_sec)
+            stats = self.stats()
+            if self.progress is not None:
+                self.progress(stats)
+            else:
+                log.info(f"export pipeline: {stats}")
+
+    async def run(self, path: str, *, chunk_size: int = DEFAULT_CHUNK_SIZE) -> dict[str, Any]:
+        self._t0 = time.perf_counter()
+        parsed: asyncio.Queue = asyncio.Queue(maxsize=self.queue_batches)
+        outs: list[asyncio.Queue] = []
+        tasks = [asyncio.create_task(self._parse(path, chunk_size, parsed))]
+        if self.pool is not None:
+            q: asyncio.Queue = asyncio.Queue(maxsize=self.queue_batches)
+            outs.append(q)
+            tasks.append(asyncio.create_task(self._db(q)))
+        if self.embedder is not None:
+            q = asyncio.Queue(maxsize=self.queue_batches)
+            outs.append(q)
+            tasks.append(asyncio.create_task(self._vectors(q)))
+        tasks.append(asyncio.create_task(self._normalize(parsed, outs)))
+        reporter = asyncio.create_task(self._report())
+        try:
+            # упала любая стадия — останавливаем все
+            await asyncio.gather(*tasks)
+        finally:
+            reporter.cancel()
+            for t in tasks:
+                t.cancel()
+        return self.stats()
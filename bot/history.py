@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Iterable
+
+log = logging.getLogger(__name__)
+
+DAY_SEC = 24 * 3600
+
+
+class HistoryEntry:
+    __slots__ = ("ts", "user_id", "line")
+
+    def __init__(self, ts: float, user_id: str | None, line: str) -> None:
+        self.ts = ts
+        self.user_id = user_id
+        self.line = line
+
+
+def format_line(from_name: str | None, text: str | None) -> str:
+    """Строка контекста в том же виде, что раньше собирали из tg_history."""
+    txt = (text or "").strip().replace("\n", " ")
+    if not txt:
+        return ""
+    frm = (from_name or "кто-то").strip()
+    return f"{frm}: {txt}"
+
+
+def _pack(entries: Iterable[HistoryEntry], max_chars: int) -> str:
+    # entries — в хронологическом порядке; режем по символам с начала, как раньше
+    parts: list[str] = []
+    cur = 0
+    for e in entries:
+        line = e.line
+        if cur + len(line) + 1 > max_chars:
+            break
+        parts.append(line)
+        cur += len(line) + 1
+    return "\n".join(parts)
+
+
+class ChatHistory:
+    """Кольцевой буфер последних сообщений одного чата + индекс по авторам.
+
+    Авторов в индексе не больше ёмкости буфера: при переполнении вытесняется
+    тот, кто дольше всех молчит (порядок словаря — по последнему сообщению).
+    """
+
+    __slots__ = ("_buf", "_head", "_size", "_by_user", "_user_capacity")
+
+    def __init__(self, capacity: int, user_capacity: int) -> None:
+        self._buf: list[HistoryEntry | None] = [None] * max(1, capacity)
+        self._head = 0  # куда писать следующую запись
+        self._size = 0
+        self._by_user: OrderedDict[str, deque[HistoryEntry]] = OrderedDict()
+        self._user_capacity = max(1, user_capacity)
+
+    def add(self, entry: HistoryEntry) -> None:
+        cap = len(self._buf)
+        self._buf[self._head] = entry
+        self._head = (self._head + 1) % cap
+        if self._size < cap:
+            self._size += 1
+
+        if entry.user_id is None:
+            return
+        dq = self._by_user.get(entry.user_id)
+        if dq is None:
+            while len(self._by_user) >= cap:
+                self._by_user.popitem(last=False)
+            dq = deque(maxlen=self._user_capacity)
+            self._by_user[entry.user_id] = dq
+        else:
+            self._by_user.move_to_end(entry.user_id)
+        dq.append(entry)
+
+    def newest(self, limit: int, since: float) -> list[HistoryEntry]:
+        """До `limit` последних записей не старше `since`, в хронологическом порядке."""
+        cap = len(self._buf)
+        out: list[HistoryEntry] = []
+        i = self._head
+        for _ in range(min(limit, self._size)):
+            i = (i - 1) % cap
+            e = self._buf[i]
+            if e is None or e.ts < since:
+                break
+            out.append(e)
+        out.reverse()
+        return out
+
+    def newest_for_user(self, user_id: str, limit: int, since: float) -> list[HistoryEntry]:
+        dq = self._by_user.get(user_id)
+        if not dq:
+            return []
+        out: list[HistoryEntry] = []
+        for e in reversed(dq):
+            if len(out) >= limit or e.ts < since:
+                break
+            out.append(e)
+        out.reverse()
+        return out
+
+
+class HistoryBuffer:
+    """In-memory история чатов за 24ч: отдаёт контекст без запросов в БД.
+
+    Пополняется из save_and_index, при старте прогревается одним запросом к tg_history.
+    """
+
+    def __init__(self, capacity: int = 256, user_capacity: int = 18) -> None:
+        self.capacity = capacity
+        self.user_capacity = user_capacity
+        self._chats: dict[int, ChatHistory] = {}
+
+    def _chat(self, chat_id: int) -> ChatHistory:
+        ch = self._chats.get(chat_id)
+        if ch is None:
+            ch = ChatHistory(self.capacity, self.user_capacity)
+            self._chats[chat_id] = ch
+        return ch
+
+    def add(self, chat_id: int, ts: float, from_id: str | None, from_name: str | None, text: str | None) -> None:
+        line = format_line(from_name, text)
+        if not line:
+            return
+        self._chat(int(chat_id)).add(HistoryEntry(ts, from_id, line))
+
+    def context(self, chat_id: int, *, limit: int, max_chars: int, now: float | None = None) -> str:
+        ch = self._chats.get(int(chat_id))
+        if ch is None:
+            return ""
+        since = (now if now is not None else time.time()) - DAY_SEC
+        return _pack(ch.newest(limit, since), max_chars)
+
+    def user_context(self, chat_id: int, user_id: int | str, *, limit: int, max_chars: int, now: float | None = None) -> str:
+        ch = self._chats.get(int(chat_id))
+        if ch is None:
+            return ""
+        since = (now if now is not None else time.time()) - DAY_SEC
+        return _pack(ch.newest_for_user(str(user_id), limit, since), max_chars)
+
+    async def warm_start(self, pool, chat_ids: Iterable[int]) -> int:
+        """Заливает последние сообщения за 24ч нужных чатов из tg_history одним запросом."""
+        try:
+            rows = await pool.fetch(
+                """
+                SELECT chat_id, dt, from_name, from_id, text
+                FROM (
+                    SELECT chat_id, dt, from_name, from_id, text,
+                           ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY dt DESC) AS rn
+                    FROM tg_history
+                    WHERE chat_id = ANY($2::bigint[]) AND dt >= (NOW() - INTERVAL '24 hours')
+                ) t
+                WHERE rn <= $1
+                ORDER BY chat_id, dt
+                """,
+                int(self.capacity),
+                [int(c) for c in chat_ids],
+            )
+        except Exception as e:
+            log.warning(f"history warm start error: {e}")
+            return 0
+
+        for r in rows:
+            dt = r["dt"]
+            ts = dt.timestamp() if dt is not None else time.time()
+            self.add(int(r["chat_id"]), ts, r["from_id"], r["from_name"], r["text"])
+        log.info(f"history warm start: {len(rows)} rows, chats={len(self._chats)}")
+        return len(rows)
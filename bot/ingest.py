@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any
+
+import asyncpg
+
+log = logging.getLogger(__name__)
+
+HISTORY_COLUMNS = ("chat_id", "msg_id", "dt", "from_name", "from_id", "text")
+
+# временная таблица живёт в рамках соединения, строки чистятся на COMMIT
+_STAGE_DDL = """
+CREATE TEMP TABLE IF NOT EXISTS _tg_history_stage (
+    chat_id BIGINT,
+    msg_id BIGINT,
+    dt TIMESTAMPTZ,
+    from_name TEXT,
+    from_id TEXT,
+    text TEXT
+) ON COMMIT DELETE ROWS
+"""
+
+_MERGE_SQL = """
+INSERT INTO tg_history (chat_id, msg_id, dt, from_name, from_id, text)
+SELECT chat_id, msg_id, dt, from_name, from_id, text FROM _tg_history_stage
+ON CONFLICT (chat_id, msg_id) DO NOTHING
+"""
+
+
+def _status_count(status: str) -> int:
+    # "COPY <n>" / "INSERT 0 <n>"
+    return int(status.rsplit(" ", 1)[-1])
+
+
+async def copy_merge_history(conn: asyncpg.Connection, records: list[tuple]) -> int:
+    """COPY пачки во временную staging-таблицу и один merge в tg_history.
+
+    Возвращает число реально вставленных строк (дубли отбрасывает ON CONFLICT).
+    """
+    async with conn.transaction():
+        await conn.execute(_STAGE_DDL)
+        await conn.copy_records_to_table("_tg_history_stage", records=records, columns=HISTORY_COLUMNS)
+        status = await conn.execute(_MERGE_SQL)
+    return _status_count(status)
+
+
+# ---------- массовая загрузка (импорт экспорта) ----------
+
+_BULK_STAGE = "tg_history_bulk_stage"
+
+# UNLOGGED: без WAL, для одноразовой загрузки этого достаточно
+_BULK_STAGE_DDL = f"""
+CREATE UNLOGGED TABLE IF NOT EXISTS {_BULK_STAGE} (
+    chat_id BIGINT,
+    msg_id BIGINT,
+    dt TIMESTAMPTZ,
+    from_name TEXT,
+    from_id TEXT,
+    text TEXT
+)
+"""
+
+_BULK_MERGE_SQL = f"""
+INSERT INTO tg_history (chat_id, msg_id, dt, from_name, from_id, text)
+SELECT chat_id, msg_id, dt, from_name, from_id, text FROM {_BULK_STAGE}
+ON CONFLICT (chat_id, msg_id) DO NOTHING
+"""
+
+# вторичные индексы: не уникальные и не под ограничениями (уникальный (chat_id, msg_id) нужен ON CONFLICT)
+_SECONDARY_INDEXES_SQL = """
+SELECT i.indexname, i.indexdef
+FROM pg_indexes i
+WHERE i.schemaname = current_schema() AND i.tablename = 'tg_history'
+  AND i.indexdef NOT LIKE 'CREATE UNIQUE%'
+  AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conname = i.indexname AND c.conrelid = 'tg_history'::regclass)
+"""
+
+# «большая» загрузка: индексы дешевле перестроить, чем обновлять построчно
+BULK_REBUILD_MIN_ROWS = 100_000
+BULK_REBUILD_TABLE_FRACTION = 0.2
+
+
+async def bulk_load_history(conn: asyncpg.Connection, records: Any, *, rebuild_indexes: str = "auto") -> dict[str, Any]:
+    """Поток записей (итератор или async-итератор кортежей HISTORY_COLUMNS) одним COPY
+    в UNLOGGED staging и одним INSERT ... SELECT ... ON CONFLICT в tg_history.
+
+    rebuild_indexes: "auto" | "always" | "never" — снять вторичные индексы на время
+    merge и построить заново. Всё после COPY — одна транзакция: при ошибке индексы
+    остаются как были. Пока она идёт, tg_history заблокирована для записи.
+    """
+    t0 = time.time()
+    await conn.execute(_BULK_STAGE_DDL)
+    await conn.execute(f"TRUNCATE {_BULK_STAGE}")
+    status = await conn.copy_records_to_table(_BULK_STAGE, records=records, columns=HISTORY_COLUMNS)
+    staged = _status_count(status)
+    t_copy = time.time()
+
+    dropped: list[tuple[str, str]] = []
+    try:
+        async with conn.transaction():
+            await conn.execute("SET LOCAL synchronous_commit = off")
+            if rebuild_indexes != "never":
+                existing = await conn.fetchval("SELECT greatest(reltuples, 0)::bigint FROM pg_class WHERE oid = 'tg_history'::regclass")
+                big = staged >= BULK_REBUILD_MIN_ROWS and staged >= BULK_REBUILD_TABLE_FRACTION * int(existing or 0)
+                if rebuild_indexes == "always" or big:
+                    dropped = [(r["indexname"], r["indexdef"]) for r in await conn.fetch(_SECONDARY_INDEXES_SQL)]
+                    for name, _ in dropped:
+                        await conn.execute(f'DROP INDEX "{name}"')
+            inserted = _status_count(await conn.execute(_BULK_MERGE_SQL))
+            t_merge = time.time()
+            if dropped:
+                await conn.execute("SET LOCAL maintenance_work_mem = '512MB'")
+                for name, ddl in dropped:
+                    await conn.execute(ddl)
+                    log.info(f"bulk load: index {name} rebuilt")
+    finally:
+        await conn.execute(f"DROP TABLE IF EXISTS {_BULK_STAGE}")
+    await conn.execute("ANALYZE tg_history")
+    t_end = time.time()
+    return {
+        "staged": staged,
+        "inserted": inserted,
+        "duplicates": staged - inserted,
+        "indexes_rebuilt": [name for name, _ in dropped],
+        "copy_sec": round(t_copy - t0, 1),
+        "merge_sec": round(t_merge - t_copy, 1),
+        "index_sec": round(t_end - t_merge, 1),
+    }
+
+
+_STOP = object()
+
+
+class HistoryWriter:
+    """Write-behind запись в tg_history пачками.
+
+    Сообщения кладутся в ограниченную очередь, фоновая задача сбрасывает их
+    каждые `flush_ms` мс или по `batch_rows` строк — один round trip на пачку.
+    Если очередь полна, submit ждёт (backpressure) и это видно в stats().
+    """
+
+    def __init__(self, pool: asyncpg.Pool, *, max_queue: int = 5000, batch_rows: int = 200, flush_ms: int = 500) -> None:
+        self._pool = pool
+        self._q: asyncio.Queue = asyncio.Queue(maxsize=max(1, max_queue))
+        self._batch_rows = max(1, batch_rows)
+        self._flush_sec = max(0.0, flush_ms / 1000.0)
+        self._task: asyncio.Task | None = None
+
+        self.enqueued = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.batches = 0
+        self.failed_rows = 0
+        self.blocked_puts = 0
+        self.max_depth = 0
+        self.last_flush_ms = 0
+        self._last_report = time.time()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self, record: tuple) -> None:
+        if self._q.full():
+            self.blocked_puts += 1
+        await self._q.put(record)
+        self.enqueued += 1
+        depth = self._q.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    async def close(self) -> None:
+        """Дописывает всё, что осталось в очереди (вызывать при остановке бота)."""
+        if self._task is None:
+            return
+        await self._q.put(_STOP)
+        try:
+            await self._task
+        finally:
+            self._task = None
+        log.info(f"history writer closed: {self.stats()}")
+
+    def stats(self) -> dict:
+        return {
+            "queue": self._q.qsize(),
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "batches": self.batches,
+            "failed_rows": self.failed_rows,
+            "blocked_puts": self.blocked_puts,
+            "last_flush_ms": self.last_flush_ms,
+        }
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            rec = await self._q.get()
+            if rec is _STOP:
+                break
+
+            batch = [rec]
+            deadline = loop.time() + self._flush_sec
+            while len(batch) < self._batch_rows:
+                try:
+                    rec = self._q.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        rec = await asyncio.wait_for(self._q.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if rec is _STOP:
+                    stopping = True
+                    break
+                batch.append(rec)
+
+            await self._flush(batch)
+
+            now = time.time()
+            if now - self._last_report >= 300:
+                self._last_report = now
+                log.info(f"history writer: {self.stats()}")
+
+        # при остановке дописываем хвост, если кто-то успел положить после _STOP
+        tail = []
+        while not self._q.empty():
+            rec = self._q.get_nowait()
+            if rec is not _STOP:
+                tail.append(rec)
+        if tail:
+            await self._flush(tail)
+
+    async def _flush(self, batch: list[tuple]) -> None:
+        t0 = time.time()
+        for attempt in range(2):
+            try:
+                async with self._pool.acquire() as conn:
+                    n = await copy_merge_history(conn, batch)
+                self.inserted += n
+                self.duplicates += len(batch) - n
+                self.batches += 1
+                self.last_flush_ms = int((time.time() - t0) * 1000)
+                return
+            except Exception as e:
+                log.warning(f"history writer flush error (rows={len(batch)}, attempt={attempt + 1}): {e}")
+                if attempt == 0:
+                    await asyncio.sleep(1.0)
+        self.failed_rows += len(batch)
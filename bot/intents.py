@@ -0,0 +1,155 @@
+"""Все ключевые слова сообщения за один проход.
+
+Раньше каждое сообщение по несколько раз приводилось к lower() и прогонялось
+через `any(w in t for w in ...)`: реакции, голос, картинка, хендлы владельца,
+упоминание бота. Здесь из всех списков один раз строится автомат Ахо-Корасик
+и результат — битовая маска интентов. Семантика та же, что у подстрок:
+«ок» ловится и внутри «около».
+
+Если установлен pyahocorasick — автомат на C. Без него — свой DFA на питоне
+(переход — один dict.get): он даёт тот же результат, но на коротких
+сообщениях не быстрее старых циклов (см. scripts/bench_intents.py).
+"""
+from __future__ import annotations
+
+from collections import deque
+from functools import lru_cache
+from typing import Iterable
+
+from .settings import settings
+
+try:
+    import ahocorasick  # pyahocorasick
+except ImportError:  # необязательная зависимость
+    ahocorasick = None
+
+LAUGH = 1 << 0
+CRINGE = 1 << 1
+AGREE = 1 << 2
+QUESTION = 1 << 3
+VOICE = 1 << 4
+IMAGE = 1 << 5
+OWNER = 1 << 6
+BOT = 1 << 7
+
+LAUGH_WORDS = ["ахаха", "лол", "ору", "смеш", "😂", "🤣", "хаха"]
+CRINGE_WORDS = ["бред", "чушь", "ерунда", "кринж", "стыд", "🤡", "пиздец"]
+AGREE_WORDS = ["ок", "пон", "ладно", "ясно", "норм", "база"]
+QUESTION_WORDS = ["что", "чего", "серьёзно", "реально", "wtf", "почему", "?"]
+
+VOICE_WORDS = ["голосом", "озвуч", "озвучь", "войсом", "войс", "запиши войс", "voice"]
+IMAGE_WORDS = [
+    "нарисуй", "сгенерируй", "создай картинку", "сделай картинку",
+    "сделай изображение", "создай изображение", "нарисуешь",
+    "draw", "generate an image", "make an image",
+]
+
+
+class IntentMatcher:
+    """Ахо-Корасик по набору (слово -> бит). match() возвращает OR всех бит,
+    чьи слова встретились в тексте (без учёта регистра)."""
+
+    __slots__ = ("_delta", "_out", "_ac", "states", "backend")
+
+    def __init__(self, patterns: Iterable[tuple[str, int]], *, use_c: bool = True) -> None:
+        bits: dict[str, int] = {}
+        for word, bit in patterns:
+            word = (word or "").lower()
+            if word:
+                bits[word] = bits.get(word, 0) | bit
+
+        self._ac = None
+        self._delta: list[dict[str, int]] = []
+        self._out: list[int] = []
+        if use_c and ahocorasick is not None:
+            ac = ahocorasick.Automaton()
+            for word, bit in bits.items():
+                ac.add_word(word, bit)
+            ac.make_automaton()
+            self._ac = ac
+            self.backend = "pyahocorasick"
+            self.states = int(ac.get_stats().get("nodes_count", 0))
+        else:
+            self.backend = "python"
+            self._build_dfa(bits)
+
+    def _build_dfa(self, bits: dict[str, int]) -> None:
+        goto: list[dict[str, int]] = [{}]
+        out: list[int] = [0]
+        for word, bit in bits.items():
+            s = 0
+            for ch in word:
+                nxt = goto[s].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto.append({})
+                    out.append(0)
+                    goto[s][ch] = nxt
+                s = nxt
+            out[s] |= bit
+
+        # BFS по глубине: fail-ссылки + сразу полные переходы (DFA), выходы
+        # копим по fail-цепочке. delta[fail] к этому моменту уже посчитан.
+        delta: list[dict[str, int]] = [dict() for _ in goto]
+        fail = [0] * len(goto)
+        delta[0] = dict(goto[0])
+        q = deque(goto[0].values())
+        while q:
+            s = q.popleft()
+            f = fail[s]
+            out[s] |= out[f]
+            row = dict(delta[f])
+            for ch, nxt in goto[s].items():
+                fail[nxt] = delta[f].get(ch, 0)
+                row[ch] = nxt
+                q.append(nxt)
+            delta[s] = row
+
+        self._delta = delta
+        self._out = out
+        self.states = len(goto)
+
+    def match(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._ac is not None:
+            found = 0
+            for _, bit in self._ac.iter(text.lower()):
+                found |= bit
+            return found
+        delta = self._delta
+        out = self._out
+        s = 0
+        found = 0
+        for ch in text.lower():
+            s = delta[s].get(ch, 0)
+            found |= out[s]
+        return found
+
+
+def _base_patterns() -> list[tuple[str, int]]:
+    pats: list[tuple[str, int]] = []
+    for words, bit in (
+        (LAUGH_WORDS, LAUGH),
+        (CRINGE_WORDS, CRINGE),
+        (AGREE_WORDS, AGREE),
+        (QUESTION_WORDS, QUESTION),
+        (VOICE_WORDS, VOICE),
+        (IMAGE_WORDS, IMAGE),
+        (getattr(settings, "OWNER_HANDLES", []), OWNER),
+    ):
+        pats.extend((w, bit) for w in words)
+    return pats
+
+
+@lru_cache(maxsize=4)
+def get_matcher(bot_username_lower: str = "") -> IntentMatcher:
+    """Автомат на все списки + "@botname" (юзернейм известен только после get_me)."""
+    pats = _base_patterns()
+    if bot_username_lower:
+        pats.append(("@" + bot_username_lower, BOT))
+    return IntentMatcher(pats)
+
+
+def detect_intents(text: str, bot_username_lower: str = "") -> int:
+    return get_matcher(bot_username_lower).match(text)
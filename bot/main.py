@@ -12,54 +12,63 @@ from datetime import datetime, timezone
 from aiogram import Bot, Dispatcher, F
 from aiogram.types import Message, ReactionTypeEmoji
 from aiogram.types import BufferedInputFile
+from aiogram.utils.chat_action import ChatActionSender
 
 from .settings import settings
-from .ai import generate_reply, analyze_image, clean_llm_output, is_garbage_text
+from .ai import generate_reply, analyze_image, save_router_stats, text_models
+from .sanitize import clean_llm_output, is_garbage_text, strip_self_mention
 from .reactions import pick_reaction, should_react_only
+from .intents import BOT, IMAGE, OWNER, VOICE, detect_intents
 from .services.giphy import search_gif
 from .services.tts import tts_to_ogg_opus_random
 from .services.image_gen import generate_image_bytes
+from .history import HistoryBuffer
+from .ingest import HistoryWriter
+from .aggregator import LongMessageAggregator
+from .state import TTLStore
+from .progressive import ProgressiveReply
+from .response_cache import ResponseCache
+from .rag import close_client as close_qdrant, has_collection, retrieve
+from .tokens import preload as preload_tokenizers
+from .style_online import OnlineStyleProfile, StyleProfileUpdater
+from .style_profile import parse_swear_ratio
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
 _pg_pool: asyncpg.Pool | None = None
-
-_last_reply_ts: dict[int, float] = {}
-_last_gif_ts: dict[int, float] = {}
-_dialog_state: dict[tuple[int, int], tuple[float, int]] = {}
-
-_last_spontaneous_ts: dict[int, float] = {}
-_last_seen_chat_activity_ts: dict[int, float] = {}
-
-_bigbuf: dict[tuple[int,int], dict] = {}
-
-async def collect_big_message(chat_id: int, user_id: int, piece: str, wait_sec: int = 35) -> str:
-    key = (chat_id, user_id)
-    now = time.time()
-    st = _bigbuf.get(key)
-
-    if not st:
-        st = {"parts": [], "deadline": now + wait_sec}
-        _bigbuf[key] = st
-
-    st["parts"].append(piece)
-
-    # ждём пока пользователь докидывает куски
-    while True:
-        await asyncio.sleep(1.0)
-        if time.time() >= st["deadline"]:
-            break
-
-    out = "\n".join(st["parts"]).strip()
-    _bigbuf.pop(key, None)
-    return out
+_history_writer: HistoryWriter | None = None
+_style_online: OnlineStyleProfile | None = None
+_style_updater: StyleProfileUpdater | None = None
+
+history = HistoryBuffer(
+    capacity=int(getattr(settings, "HISTORY_BUFFER_SIZE", 256)),
+    user_capacity=18,
+)
+
+# состояние с TTL: записи сами истекают, память не растёт неделями
+_STATE_MAX_KEYS = int(getattr(settings, "STATE_MAX_KEYS", 50000))
+
+_last_reply_ts = TTLStore(lambda: float(getattr(settings, "REPLY_COOLDOWN_SEC", 8)), max_items=_STATE_MAX_KEYS)
+_last_gif_ts = TTLStore(lambda: float(getattr(settings, "GIPHY_COOLDOWN_SEC", 300)), max_items=_STATE_MAX_KEYS)
+_dialog_state = TTLStore(220.0, max_items=_STATE_MAX_KEYS)  # (chat_id, user_id) -> streak
+
+_last_spontaneous_ts = TTLStore(lambda: float(getattr(settings, "SPONTANEOUS_COOLDOWN_SEC", 3600)), max_items=_STATE_MAX_KEYS)
+_last_seen_chat_activity_ts = TTLStore(lambda: float(getattr(settings, "SPONTANEOUS_ONLY_IF_SILENT_SEC", 600)), max_items=_STATE_MAX_KEYS)
+
+# повторяющиеся вопросы отвечаем из кэша, без похода в LLM
+_RESPONSE_CACHE_ENABLED = bool(getattr(settings, "RESPONSE_CACHE_ENABLED", True))
+_response_cache = ResponseCache(
+    ttl_sec=float(getattr(settings, "RESPONSE_CACHE_TTL_SEC", 1800)),
+    max_items=int(getattr(settings, "RESPONSE_CACHE_MAX_ITEMS", 2000)),
+    similarity=float(getattr(settings, "RESPONSE_CACHE_SIMILARITY", 0.8)),
+    context_similarity=float(getattr(settings, "RESPONSE_CACHE_CONTEXT_SIMILARITY", 0.3)),
+    no_repeat_sec=float(getattr(settings, "RESPONSE_CACHE_NO_REPEAT_SEC", 600)),
+    max_variants=int(getattr(settings, "RESPONSE_CACHE_MAX_VARIANTS", 4)),
+    min_chars=int(getattr(settings, "RESPONSE_CACHE_MIN_CHARS", 4)),
+)
 
 async def save_and_index(message: Message) -> None:
-    global _pg_pool
-    if _pg_pool is None:
-        return
-
     try:
         chat_id = int(message.chat.id)
         msg_id = int(message.message_id)
@@ -77,6 +86,7 @@ async def save_and_index(message: Message) -> None:
         text = (message.text or "").strip()
         if not text and getattr(message, "caption", None):
             text = (message.caption or "").strip()
+        has_text = bool(text)
 
         if not text:
             if getattr(message, "photo", None):
@@ -90,124 +100,46 @@ async def save_and_index(message: Message) -> None:
             else:
                 return
 
-        await _pg_pool.execute(
-            """
-            INSERT INTO tg_history (chat_id, msg_id, dt, from_name, from_id, text)
-            VALUES ($1,$2,$3,$4,$5,$6)
-            ON CONFLICT (chat_id, msg_id) DO NOTHING
-            """,
-            chat_id, msg_id, dt, from_name, from_id, text
-        )
-    except Exception as e:
-        log.debug(f"save_and_index error: {e}")
-
+        ts = dt.timestamp() if isinstance(dt, datetime) else time.time()
+        history.add(chat_id, ts, from_id, from_name, text)
 
-async def build_context_24h(chat_id: int) -> str:
-    global _pg_pool
-    if _pg_pool is None:
-        return ""
+        # онлайн-профиль стиля: только настоящий текст целевого чата, без "[photo]" и т.п.
+        if _style_online is not None and has_text and chat_id == int(settings.TARGET_GROUP_ID or chat_id):
+            _style_online.add(from_name, text)
 
-    try:
-        rows = await _pg_pool.fetch(
-            """
-            SELECT dt, from_name, text
-            FROM tg_history
-            WHERE chat_id = $1
-              AND dt >= (NOW() - INTERVAL '24 hours')
-            ORDER BY dt DESC
-            LIMIT $2
-            """,
-            int(chat_id),
-            int(getattr(settings, "MEMORY_24H_LIMIT", 70)),
-        )
-    except Exception as e:
-        log.debug(f"build_context_24h db error: {e}")
-        return ""
-
-    if not rows:
-        return ""
-
-    rows = list(reversed(rows))
-    max_chars = int(getattr(settings, "MEMORY_24H_MAX_CHARS", 6500))
-
-    parts: list[str] = []
-    cur = 0
-    for r in rows:
-        frm = (r["from_name"] or "кто-то").strip()
-        txt = (r["text"] or "").strip().replace("\n", " ")
-        if not txt:
-            continue
-        line = f"{frm}: {txt}"
-        if cur + len(line) + 1 > max_chars:
-            break
-        parts.append(line)
-        cur += len(line) + 1
-
-    return "\n".join(parts)
-
-
-async def build_user_context_24h(chat_id: int, user_id: int) -> str:
-    global _pg_pool
-    if _pg_pool is None:
-        return ""
-
-    try:
-        rows = await _pg_pool.fetch(
-            """
-            SELECT dt, from_name, text
-            FROM tg_history
-            WHERE chat_id = $1
-              AND from_id = $2
-              AND dt >= (NOW() - INTERVAL '24 hours')
-            ORDER BY dt DESC
-            LIMIT 18
-            """,
-            int(chat_id),
-            str(user_id),
-        )
+        # запись в БД — пачками в фоне, не на пути ответа
+        if _history_writer is None:
+            return
+        await _history_writer.submit((chat_id, msg_id, dt, from_name, from_id, text))
     except Exception as e:
-        log.debug(f"build_user_context_24h db error: {e}")
-        return ""
+        log.debug(f"save_and_index error: {e}")
 
-    if not rows:
-        return ""
 
-    rows = list(reversed(rows))
-    max_chars = int(getattr(settings, "USER_MEMORY_MAX_CHARS", 300))
+def build_context_24h(chat_id: int) -> str:
+    return history.context(
+        int(chat_id),
+        limit=int(getattr(settings, "MEMORY_24H_LIMIT", 70)),
+        max_chars=int(getattr(settings, "MEMORY_24H_MAX_CHARS", 6500)),
+    )
 
-    parts: list[str] = []
-    cur = 0
-    for r in rows:
-        frm = (r["from_name"] or "кто-то").strip()
-        txt = (r["text"] or "").strip().replace("\n", " ")
-        if not txt:
-            continue
-        line = f"{frm}: {txt}"
-        if cur + len(line) + 1 > max_chars:
-            break
-        parts.append(line)
-        cur += len(line) + 1
 
-    return "\n".join(parts)
+def build_user_context_24h(chat_id: int, user_id: int) -> str:
+    return history.user_context(
+        int(chat_id),
+        user_id,
+        limit=18,
+        max_chars=int(getattr(settings, "USER_MEMORY_MAX_CHARS", 300)),
+    )
 
 
 def _dialog_is_active(chat_id: int, user_id: int) -> bool:
-    key = (chat_id, user_id)
-    v = _dialog_state.get(key)
-    if not v:
-        return False
-    until_ts, _ = v
-    if time.time() > until_ts:
-        _dialog_state.pop(key, None)
-        return False
-    return True
+    return (chat_id, user_id) in _dialog_state
 
 
 def _dialog_touch(chat_id: int, user_id: int, *, extend_sec: int = 220, max_turns: int = 6) -> None:
     key = (chat_id, user_id)
-    until_ts, streak = _dialog_state.get(key, (0.0, 0))
-    streak = min(max_turns, streak + 1)
-    _dialog_state[key] = (time.time() + extend_sec, streak)
+    streak = min(max_turns, _dialog_state.get(key, 0) + 1)
+    _dialog_state.set(key, streak, ttl_sec=extend_sec)
 
 
 async def react(bot: Bot, message: Message, emoji: str) -> None:
@@ -221,12 +153,12 @@ async def react(bot: Bot, message: Message, emoji: str) -> None:
         log.debug(f"reaction error: {e}")
 
 
-def _owner_defense_mode_for_text(text: str, message: Message) -> str:
-    text_l = (text or "").lower()
-
+def _owner_defense_mode_for_text(text: str, message: Message, intents: int | None = None) -> str:
     owner_mentioned = False
     if settings.OWNER_DEFENSE_MODE and settings.DEFEND_ON_MENTION:
-        owner_mentioned = any(h.lower() in text_l for h in getattr(settings, "OWNER_HANDLES", []))
+        if intents is None:
+            intents = detect_intents(text)
+        owner_mentioned = bool(intents & OWNER)
 
     reply_to_owner = False
     if settings.OWNER_DEFENSE_MODE and settings.DEFEND_ON_REPLY_TO_OWNER:
@@ -236,30 +168,21 @@ def _owner_defense_mode_for_text(text: str, message: Message) -> str:
     return "defend_owner" if (owner_mentioned or reply_to_owner) else "normal"
 
 
-async def _compute_is_mention(bot: Bot, message: Message, text: str) -> tuple[bool, int, str]:
+async def _compute_is_mention(bot: Bot, message: Message, text: str) -> tuple[bool, int, str, int]:
+    """(позвали ли бота, bot_id, юзернейм бота, маска интентов текста)."""
     me = await bot.get_me()
     bot_username = (me.username or "").lower()
     bot_id = me.id
 
-    text_l = (text or "").lower()
-    mention_bot = bool(bot_username) and (f"@{bot_username}" in text_l)
+    # один проход по тексту: упоминание бота + все остальные ключевые слова
+    intents = detect_intents(text, bot_username)
+    mention_bot = bool(intents & BOT)
     reply_to_bot = bool(
         message.reply_to_message
         and message.reply_to_message.from_user
         and message.reply_to_message.from_user.id == bot_id
     )
-    return (mention_bot or reply_to_bot), bot_id, bot_username
-
-
-def _strip_self_mention(text: str, bot_username_lower: str) -> str:
-    if not text or not bot_username_lower:
-        return text
-    handle = "@" + bot_username_lower
-    out = text.replace(handle, "")
-    while handle in out.lower():
-        i = out.lower().find(handle)
-        out = out[:i] + out[i + len(handle):]
-    return " ".join(out.split()).strip()
+    return (mention_bot or reply_to_bot), bot_id, bot_username, intents
 
 
 def _soft_address_prefix(message: Message) -> str:
@@ -323,19 +246,16 @@ async def _gate_reply(
     return True
 
 
-def wants_voice(user_text: str) -> bool:
-    t = (user_text or "").lower()
-    return any(k in t for k in ["голосом", "озвуч", "озвучь", "войсом", "войс", "запиши войс", "voice"])
+def wants_voice(user_text: str, intents: int | None = None) -> bool:
+    if intents is None:
+        intents = detect_intents(user_text)
+    return bool(intents & VOICE)
 
 
-def wants_image(user_text: str) -> bool:
-    t = (user_text or "").lower()
-    keys = [
-        "нарисуй", "сгенерируй", "создай картинку", "сделай картинку",
-        "сделай изображение", "создай изображение", "нарисуешь",
-        "draw", "generate an image", "make an image",
-    ]
-    return any(k in t for k in keys)
+def wants_image(user_text: str, intents: int | None = None) -> bool:
+    if intents is None:
+        intents = detect_intents(user_text)
+    return bool(intents & IMAGE)
 
 
 async def on_text(message: Message, bot: Bot) -> None:
@@ -345,22 +265,43 @@ async def on_text(message: Message, bot: Bot) -> None:
     _last_seen_chat_activity_ts[int(message.chat.id)] = time.time()
 
     text = (message.text or "").strip()
-    if len(text) > 3500:  # простыня
-        uid = message.from_user.id if message.from_user else 0
-        text = await collect_big_message(int(message.chat.id), uid, text, wait_sec=35)
     if not text:
         return
 
     await save_and_index(message)
 
-    is_mention, bot_id, bot_username_lower = await _compute_is_mention(bot, message, text)
+    # простыня: копим куски и отвечаем один раз на склеенный текст
+    key = (int(message.chat.id), message.from_user.id if message.from_user else 0)
+    if len(text) > 3500 or _bigmsg.active(key):
+        _bigmsg.add(key, text, (message, bot))
+        return
+
+    await _handle_text(message, bot, text)
+
+
+async def _on_big_message(key: tuple[int, int], text: str, payload: tuple[Message, Bot]) -> None:
+    message, bot = payload
+    await _handle_text(message, bot, text)
+
+
+_bigmsg = LongMessageAggregator(
+    _on_big_message,
+    debounce_sec=float(getattr(settings, "BIGMSG_DEBOUNCE_SEC", 5)),
+    max_wait_sec=float(getattr(settings, "BIGMSG_MAX_WAIT_SEC", 35)),
+    max_chars=int(getattr(settings, "BIGMSG_MAX_CHARS", 40000)),
+    max_total_chars=int(getattr(settings, "BIGMSG_MEMORY_CHARS", 400000)),
+)
+
+
+async def _handle_text(message: Message, bot: Bot, text: str) -> None:
+    is_mention, bot_id, bot_username_lower, intents = await _compute_is_mention(bot, message, text)
 
     uid = message.from_user.id if message.from_user else None
     if uid is not None and uid == bot_id:
         return
 
-    mode = _owner_defense_mode_for_text(text, message)
-    emoji = pick_reaction(text)
+    mode = _owner_defense_mode_for_text(text, message, intents)
+    emoji = pick_reaction(text, intents)
 
     should = await _gate_reply(
         bot=bot,
@@ -375,15 +316,16 @@ async def on_text(message: Message, bot: Bot) -> None:
 
     _last_reply_ts[int(message.chat.id)] = time.time()
 
-    ctx = await build_context_24h(int(message.chat.id))
+    ctx = build_context_24h(int(message.chat.id))
+    chat_ctx = ctx  # кэшу ответов — только история чата, без личного контекста спрашивающего
     user_ctx = ""
     if uid is not None:
-        user_ctx = await build_user_context_24h(int(message.chat.id), uid)
+        user_ctx = build_user_context_24h(int(message.chat.id), uid)
     if user_ctx:
         ctx = ctx + "\n\n[ЛИЧНЫЙ КОНТЕКСТ ЭТОГО УЧАСТНИКА ЗА 24Ч]\n" + user_ctx
 
     # ✅ картинка по запросу
-    if wants_image(text):
+    if wants_image(text, intents):
         prompt = text.replace("@" + bot_username_lower, "").strip()
         
         img = await asyncio.to_thread(generate_image_bytes, prompt)
@@ -438,39 +380,73 @@ async def on_text(message: Message, bot: Bot) -> None:
     max_in = int(getattr(settings, "MAX_INPUT_CHARS", 20000))
     text_for_model = text[:max_in]
 
-    try:
-        raw = generate_reply(user_text=text_for_model, context_snippets=ctx, mode=mode).get("_raw", "").strip()
-    except Exception as e:
-        log.error(f"generate_reply error: {e}")
-        raw = ""
-
-    raw = clean_llm_output(raw)
-    raw = _strip_self_mention(raw, bot_username_lower)
-
-    # если мусор — один ретрай “без мусора”
-    if (not raw) or is_garbage_text(raw):
-        try:
-            raw2 = generate_reply(
-                user_text=f"{text_for_model}\n\n(Ответь по-человечески, без мусорных слов и без латиницы внутри русских слов.)",
-                context_snippets=ctx,
-                mode=mode,
-            ).get("_raw", "").strip()
-        except Exception as e:
-            log.error(f"generate_reply retry error: {e}")
-            raw2 = ""
-
-        raw2 = clean_llm_output(raw2)
-        raw2 = _strip_self_mention(raw2, bot_username_lower)
-        if (not raw2) or is_garbage_text(raw2):
-            if random.random() < 0.45:
-                await react(bot, message, emoji)
-            return
-        raw = raw2# ✅ voice по запросу (или редко “сам”)
-    do_voice = wants_voice(text)
+    # ✅ voice по запросу (или редко “сам”)
+    do_voice = wants_voice(text, intents)
     if (not do_voice) and _dialog_is_active(int(message.chat.id), uid or -1):
         if random.random() < float(getattr(settings, "AUTO_VOICE_PROB", 0.03)):
             do_voice = True
 
+    prefix = _soft_address_prefix(message)
+
+    # текст показываем по мере стрима (для голоса — нет смысла)
+    progressive = None
+    if (not do_voice) and bool(getattr(settings, "STREAM_PROGRESSIVE_EDIT", False)):
+        progressive = ProgressiveReply(
+            bot,
+            int(message.chat.id),
+            prefix=prefix,
+            transform=lambda t: strip_self_mention(t, bot_username_lower),
+        )
+    on_delta = progressive.on_delta if progressive else None
+
+    raw = ""
+    if _RESPONSE_CACHE_ENABLED:
+        raw = _response_cache.lookup(int(message.chat.id), mode, text_for_model, chat_ctx) or ""
+        if raw:
+            log.info(f"response cache hit chat={message.chat.id} {_response_cache.stats()}")
+
+    if not raw:
+        async with ChatActionSender.typing(bot=bot, chat_id=message.chat.id):
+            # давняя память чата; не уложились в RAG_TIMEOUT_MS — отвечаем без неё
+            memory = await retrieve(int(message.chat.id), text_for_model)
+            try:
+                raw = (await generate_reply(
+                    user_text=text_for_model, context_snippets=ctx, mode=mode, memory_snippets=memory, on_delta=on_delta
+                )).get("_raw", "").strip()
+            except Exception as e:
+                log.error(f"generate_reply error: {e}")
+                raw = ""
+
+            raw = clean_llm_output(raw)
+            raw = strip_self_mention(raw, bot_username_lower)
+
+            # если мусор — один ретрай “без мусора”
+            if (not raw) or is_garbage_text(raw):
+                try:
+                    raw2 = (await generate_reply(
+                        user_text=f"{text_for_model}\n\n(Ответь по-человечески, без мусорных слов и без латиницы внутри русских слов.)",
+                        context_snippets=ctx,
+                        mode=mode,
+                        memory_snippets=memory,
+                        on_delta=on_delta,
+                    )).get("_raw", "").strip()
+                except Exception as e:
+                    log.error(f"generate_reply retry error: {e}")
+                    raw2 = ""
+
+                raw2 = clean_llm_output(raw2)
+                raw2 = strip_self_mention(raw2, bot_username_lower)
+                if (not raw2) or is_garbage_text(raw2):
+                    if progressive:
+                        await progressive.abort()
+                    if random.random() < 0.45:
+                        await react(bot, message, emoji)
+                    return
+                raw = raw2
+
+        if _RESPONSE_CACHE_ENABLED:
+            _response_cache.store(int(message.chat.id), mode, text_for_model, chat_ctx, raw)
+
     if do_voice:
         try:
             ogg_bytes, preset, voice = await tts_to_ogg_opus_random(raw)
@@ -483,9 +459,9 @@ async def on_text(message: Message, bot: Bot) -> None:
             log.debug(f"tts error: {e}")
             # если tts упал — просто текстом
 
-    prefix = _soft_address_prefix(message)
     try:
-        await bot.send_message(chat_id=message.chat.id, text=(prefix + raw).strip())
+        if not (progressive and await progressive.finish(raw)):
+            await bot.send_message(chat_id=message.chat.id, text=(prefix + raw).strip())
         if uid is not None:
             _dialog_touch(int(message.chat.id), uid)
     except Exception as e:
@@ -503,7 +479,7 @@ async def on_photo(message: Message, bot: Bot) -> None:
     await save_and_index(message)
 
     caption = (message.caption or "").strip()
-    is_mention, bot_id, bot_username_lower = await _compute_is_mention(bot, message, caption or "")
+    is_mention, bot_id, bot_username_lower, intents = await _compute_is_mention(bot, message, caption or "")
 
     uid = message.from_user.id if message.from_user else None
     if uid is not None and uid == bot_id:
@@ -512,17 +488,17 @@ async def on_photo(message: Message, bot: Bot) -> None:
     if uid == settings.OWNER_USER_ID and not bool(getattr(settings, "REPLY_TO_OWNER", False)) and not is_mention:
         return
 
-    mode = _owner_defense_mode_for_text(caption, message) if caption else "normal"
+    mode = _owner_defense_mode_for_text(caption, message, intents) if caption else "normal"
     if uid == settings.OWNER_USER_ID and is_mention:
         mode = "defend_owner"
 
-    emoji = pick_reaction(caption or "photo")
+    emoji = pick_reaction(caption or "photo", intents)
     _last_reply_ts[int(message.chat.id)] = time.time()
 
-    ctx = await build_context_24h(int(message.chat.id))
+    ctx = build_context_24h(int(message.chat.id))
     user_ctx = ""
     if uid is not None:
-        user_ctx = await build_user_context_24h(int(message.chat.id), uid)
+        user_ctx = build_user_context_24h(int(message.chat.id), uid)
     if user_ctx:
         ctx = ctx + "\n\n[ЛИЧНЫЙ КОНТЕКСТ ЭТОГО УЧАСТНИКА ЗА 24Ч]\n" + user_ctx
 
@@ -537,18 +513,19 @@ async def on_photo(message: Message, bot: Bot) -> None:
         return
 
     try:
-        raw = analyze_image(
-            image_bytes=image_bytes,
-            caption_text=caption,
-            context_snippets=ctx,
-            mode=mode,
-        ).get("_raw", "").strip()
+        async with ChatActionSender.typing(bot=bot, chat_id=message.chat.id):
+            raw = (await analyze_image(
+                image_bytes=image_bytes,
+                caption_text=caption,
+                context_snippets=ctx,
+                mode=mode,
+            )).get("_raw", "").strip()
     except Exception as e:
         log.debug(f"vision error: {e}")
         raw = ""
 
     raw = clean_llm_output(raw)
-    raw = _strip_self_mention(raw, bot_username_lower)
+    raw = strip_self_mention(raw, bot_username_lower)
 
     if (not raw) or is_garbage_text(raw):
         await react(bot, message, emoji)
@@ -587,14 +564,14 @@ async def spontaneous_loop(bot: Bot) -> None:
             continue
 
         try:
-            ctx = await build_context_24h(chat_id)
-            text = generate_reply(user_text="", context_snippets=ctx, mode="normal").get("_raw", "").strip()
+            ctx = build_context_24h(chat_id)
+            text = (await generate_reply(user_text="", context_snippets=ctx, mode="normal")).get("_raw", "").strip()
 
             me = await bot.get_me()
             bot_username_lower = (me.username or "").lower()
 
             text = clean_llm_output(text)
-            text = _strip_self_mention(text, bot_username_lower)
+            text = strip_self_mention(text, bot_username_lower)
 
             if (not text) or is_garbage_text(text):
                 continue
@@ -621,6 +598,16 @@ async def main() -> None:
 
     bot = Bot(token=settings.BOT_TOKEN)
 
+    # tiktoken при первой загрузке качает кодировку — делаем это до первого ответа и не в event loop
+    await preload_tokenizers(text_models())
+
+    # коллекцию памяти проверяем один раз здесь, а не на пути ответа (создают её скрипты импорта)
+    if bool(getattr(settings, "RAG_ENABLED", True)):
+        try:
+            await has_collection()
+        except Exception as e:
+            log.warning(f"rag: collection check failed: {e}")
+
     global _pg_pool
     _pg_pool = await asyncpg.create_pool(
         host=settings.DB_HOST,
@@ -631,6 +618,34 @@ async def main() -> None:
         min_size=1,
         max_size=5,
     )
+    await history.warm_start(_pg_pool, [int(settings.TARGET_GROUP_ID)])  # бот отвечает только в целевой группе
+
+    global _history_writer
+    _history_writer = HistoryWriter(
+        _pg_pool,
+        max_queue=int(getattr(settings, "INGEST_QUEUE_MAX", 5000)),
+        batch_rows=int(getattr(settings, "INGEST_BATCH_ROWS", 200)),
+        flush_ms=int(getattr(settings, "INGEST_FLUSH_MS", 500)),
+    )
+    _history_writer.start()
+
+    global _style_online, _style_updater
+    if bool(getattr(settings, "STYLE_ONLINE_ENABLED", True)):
+        state_path = str(getattr(settings, "STYLE_ONLINE_STATE_PATH", "artifacts/style_online.json"))
+        _style_online = OnlineStyleProfile.load(
+            state_path,
+            capacity=int(getattr(settings, "STYLE_ONLINE_CAPACITY", 5000)),
+            small_capacity=int(getattr(settings, "STYLE_ONLINE_SMALL_CAPACITY", 200)),
+        )
+        _style_updater = StyleProfileUpdater(
+            _style_online,
+            state_path=state_path,
+            every_sec=float(getattr(settings, "STYLE_ONLINE_PERSIST_SEC", 300)),
+            min_messages=int(getattr(settings, "STYLE_ONLINE_MIN_MESSAGES", 500)),
+            force_swear_ratio=parse_swear_ratio(getattr(settings, "FORCE_SWEAR_RATIO_PERCENT", "")),
+        )
+        _style_updater.start()
+        log.info(f"style online: {_style_online.messages} messages in profile")
 
     dp = Dispatcher()
     dp.message.register(on_text, F.text)
@@ -639,7 +654,15 @@ async def main() -> None:
     log.info("Balbes автономный стартанул")
 
     asyncio.create_task(spontaneous_loop(bot))
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        save_router_stats()
+        await _history_writer.close()
+        if _style_updater is not None:
+            await _style_updater.close()
+        await _pg_pool.close()
+        await close_qdrant()
 
 
 if __name__ == "__main__":
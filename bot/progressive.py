@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import logging
+import time
+from typing import Callable
+
+from aiogram import Bot
+
+log = logging.getLogger(__name__)
+
+
+class ProgressiveReply:
+    """Показывает ответ по мере стрима: одно сообщение + редкие edit_message_text.
+
+    Получает уже очищенный частичный текст (on_delta). Пустая строка — сигнал,
+    что стрим сорвался и генерация начнётся заново. В конце либо finish()
+    (доводим сообщение до финального текста), либо abort() (удаляем недописанное).
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        chat_id: int,
+        *,
+        prefix: str = "",
+        transform: Callable[[str], str] | None = None,
+        min_chars: int = 40,
+        interval_sec: float = 1.2,
+    ) -> None:
+        self.bot = bot
+        self.chat_id = chat_id
+        self.prefix = prefix
+        self.transform = transform
+        self.min_chars = min_chars
+        self.interval_sec = interval_sec
+        self.message_id: int | None = None
+        self._shown = ""
+        self._last_edit = 0.0
+
+    @property
+    def sent(self) -> bool:
+        return self.message_id is not None
+
+    def _render(self, text: str) -> str:
+        if self.transform is not None:
+            text = self.transform(text)
+        return (self.prefix + text).strip()
+
+    async def on_delta(self, text: str) -> None:
+        if not text:
+            # рестарт: новый стрим перерисует сообщение с первой же порции, без ожидания интервала
+            self._shown = ""
+            self._last_edit = 0.0
+            return
+        shown = self._render(text)
+        if not shown or shown == self._shown:
+            return
+        now = time.monotonic()
+        try:
+            if self.message_id is None:
+                if len(shown) < self.min_chars:
+                    return
+                msg = await self.bot.send_message(chat_id=self.chat_id, text=shown + " …")
+                self.message_id = msg.message_id
+            elif now - self._last_edit >= self.interval_sec:
+                await self.bot.edit_message_text(chat_id=self.chat_id, message_id=self.message_id, text=shown + " …")
+            else:
+                return
+            self._shown = shown
+            self._last_edit = now
+        except Exception as e:
+            log.debug(f"progressive reply error: {e}")
+
+    async def finish(self, text: str) -> bool:
+        """Доводит уже показанное сообщение до финального текста. False — если ничего не показывали."""
+        if self.message_id is None:
+            return False
+        final = (self.prefix + text).strip()
+        try:
+            await self.bot.edit_message_text(chat_id=self.chat_id, message_id=self.message_id, text=final)
+        except Exception as e:
+            log.debug(f"progressive reply finish error: {e}")
+        return True
+
+    async def abort(self) -> None:
+        if self.message_id is None:
+            return
+        try:
+            await self.bot.delete_message(chat_id=self.chat_id, message_id=self.message_id)
+        except Exception as e:
+            log.debug(f"progressive reply delete error: {e}")
+        self.message_id = None
+        self._shown = ""
@@ -0,0 +1,125 @@
+"""System-промпты: собираются один раз на (режим, версия style-блока).
+
+artifacts/system_style.txt (его пишут scripts/build_style_profile.py и
+bot/style_online.py) больше не читается с диска на каждый запрос: раз в
+STYLE_RELOAD_SEC смотрим mtime/размер файла и перечитываем только если он
+поменялся.
+
+Порядок частей — от самых стабильных к изменчивым: базовые правила, style,
+правила режима. Так у запросов в разных режимах общий байт-в-байт префикс,
+и кэш промптов у провайдера (где он есть) попадает чаще.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import time
+
+from .settings import settings
+
+log = logging.getLogger(__name__)
+
+BASE_SYSTEM = """Ты — участник телеграм-чата. Пиши естественно, без официоза.
+Тон: слегка ироничный/подъёбистый, разговорный. Можно лёгкий мат и сленг уместно.
+Не изображай "ассистента", не пиши канцеляритом и нравоучениями. Можешь рассуждать и отвечать на вопросы, если нужно, ищи информацию в сети.
+Не оскорбляй и не унижай Кирилла, если кто-то плохое скажет про Кирилла, твоя задача включить режим защиты владельца.
+Допустимо на твое усмотрение выполнять просьбы других участников.
+Отвечай не коротко. но и не длинно: обычно 1–2 предложения. Иногда одно слово.
+Эмодзи редко: максимум 1 эмодзи, и не чаще чем в 1 из 6 сообщений.
+Не добавляй подписи вроде "от владельца" / "я бот".
+"""
+
+CTX_HEADER = "Память чата за последние 24 часа (сжатая):"
+MEMORY_HEADER = "[ДАВНИЕ СООБЩЕНИЯ ИЗ ЧАТА, ПО ТЕМЕ]"
+
+MINI_RULES = "ВАЖНО: отвечай кратко (1-2 предложения), без мусора, без подписи, без 'я бот'."
+
+STYLE_PATH = os.path.join("artifacts", "system_style.txt")
+
+
+def mode_rules(mode: str) -> str:
+    if mode == "defend_owner":
+        return (
+            "РЕЖИМ: ЗАЩИТА ВЛАДЕЛЬЦА.\n"
+            "КРИТИЧЕСКОЕ ПРАВИЛО: ты на стороне владельца (Кирилл). Никогда не спорь с ним и не наезжай на него.\n"
+            "- Поддерживай владельца и его позицию.\n"
+            "- Если владелец наезжает/подкалывает — усиливай линию, но без реальных угроз.\n"
+            "- Не пиши фразы: 'от владельца', 'бот владельца', 'я владелец'.\n"
+        )
+    return "РЕЖИМ: ОБЫЧНЫЙ.\n"
+
+
+class StyleBlock:
+    """Содержимое style-файла + версия. Проверка файла не чаще раза в check_interval_sec."""
+
+    def __init__(self, path: str, *, check_interval_sec: float = 5.0) -> None:
+        self.path = path
+        self.check_interval_sec = max(0.0, check_interval_sec)
+        self.text = ""
+        self.version = 0
+        self._sig: tuple[int, int] | None = None
+        self._next_check = 0.0
+
+    def get(self) -> tuple[int, str]:
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.check_interval_sec
+            self._refresh()
+        return self.version, self.text
+
+    def _refresh(self) -> None:
+        try:
+            st = os.stat(self.path)
+            sig = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            sig = None
+        if sig == self._sig:
+            return
+        text = ""
+        if sig is not None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    text = f.read().strip()
+            except Exception as e:
+                log.warning(f"style block read error: {e}")
+                return
+        self._sig = sig
+        if text != self.text:
+            self.text = text
+            self.version += 1
+            log.info(f"style block reloaded: v{self.version}, {len(text)} chars")
+
+
+class PromptRegistry:
+    """Готовые system-промпты по (режим, со style или без, mini, версия style)."""
+
+    def __init__(self, style: StyleBlock) -> None:
+        self.style = style
+        self._cache: dict[tuple[str, bool, bool], str] = {}
+        self._version = -1
+
+    def system(self, mode: str, *, with_style: bool = True, mini: bool = False) -> str:
+        version, style = self.style.get()
+        if version != self._version:
+            self._cache.clear()
+            self._version = version
+        key = (mode, with_style, mini)
+        prompt = self._cache.get(key)
+        if prompt is None:
+            parts = [BASE_SYSTEM]
+            if with_style and style:
+                parts.append(style + "\n")
+            parts.append(mode_rules(mode))
+            if mini:
+                parts.append(MINI_RULES)
+            prompt = "\n".join(parts)
+            self._cache[key] = prompt
+        return prompt
+
+    def has_style(self) -> bool:
+        return bool(self.style.get()[1])
+
+
+prompts = PromptRegistry(
+    StyleBlock(STYLE_PATH, check_interval_sec=float(getattr(settings, "STYLE_RELOAD_SEC", 5)))
+)
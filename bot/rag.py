@@ -1,37 +1,352 @@
-from qdrant_client import QdrantClient
+"""Доступ к Qdrant из asyncio-хендлеров.
+
+Один долгоживущий AsyncQdrantClient на процесс (соединения переиспользуются,
+gRPC — если включён QDRANT_PREFER_GRPC), существование коллекции проверяем
+один раз и запоминаем, upsert принимает сразу много точек и шлёт пачками.
+
+retrieve() — давняя память чата для ответа: эмбеддинг запроса (с кэшем),
+поиск по чату за пределами свежих 24ч, MMR против повторов. Эмбеддинг —
+удалённый вызов, у него свой бюджет RAG_EMBED_TIMEOUT_MS; поиск — под жёстким
+RAG_TIMEOUT_MS. Не успели — отвечаем без памяти. Коллекцию retrieve() не
+создаёт (это делают писатели): нет её — памяти нет.
+
+VECTOR_BACKEND=local — то же самое без сервера: bot/vecstore.py в VECSTORE_DIR
+(вызовы уходят в поток, чтобы не держать event loop).
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Iterable
+
+from qdrant_client import AsyncQdrantClient
 from qdrant_client.http import models as qm
+
+from .ai import embed_texts, embeddings_available
+from .response_cache import normalize
 from .settings import settings
+from .state import TTLStore
+from .vecstore import LocalVectorStore
+
+log = logging.getLogger(__name__)
+
+_client: AsyncQdrantClient | None = None
+_known_collections: set[str] = set()
+_missing_until: dict[str, float] = {}  # коллекции нет — не перепроверяем до этого момента (monotonic)
+_ensure_lock = asyncio.Lock()
+_local_store: LocalVectorStore | None = None
+
+
+def _collection(name: str | None) -> str:
+    return name or str(getattr(settings, "QDRANT_COLLECTION", "tg_messages"))
+
+
+def _is_local() -> bool:
+    return str(getattr(settings, "VECTOR_BACKEND", "qdrant")).lower() == "local"
+
+
+def get_local_store() -> LocalVectorStore:
+    global _local_store
+    if _local_store is None:
+        _local_store = LocalVectorStore(
+            str(getattr(settings, "VECSTORE_DIR", "artifacts/vecstore")),
+            segment_rows=int(getattr(settings, "VECSTORE_SEGMENT_ROWS", 50000)),
+            max_segments=int(getattr(settings, "VECSTORE_MAX_SEGMENTS", 8)),
+            ivf_min_rows=int(getattr(settings, "VECSTORE_IVF_MIN_ROWS", 20000)),
+            nprobe=int(getattr(settings, "VECSTORE_NPROBE", 16)),
+        )
+    return _local_store
 
-def qc() -> QdrantClient:
-    return QdrantClient(url=settings.QDRANT_URL)
 
-def ensure_collection(vector_size: int) -> None:
-    client = qc()
-    names = [c.name for c in client.get_collections().collections]
-    if settings.QDRANT_COLLECTION in names:
+def get_client() -> AsyncQdrantClient:
+    global _client
+    if _client is None:
+        _client = AsyncQdrantClient(
+            url=str(getattr(settings, "QDRANT_URL", "http://127.0.0.1:6333")),
+            api_key=(getattr(settings, "QDRANT_API_KEY", "") or None),
+            prefer_grpc=bool(getattr(settings, "QDRANT_PREFER_GRPC", True)),
+            grpc_port=int(getattr(settings, "QDRANT_GRPC_PORT", 6334)),
+            timeout=int(getattr(settings, "QDRANT_TIMEOUT_SEC", 10)),
+        )
+    return _client
+
+
+async def close_client() -> None:
+    global _client, _local_store
+    if _local_store is not None:
+        try:
+            await asyncio.to_thread(_local_store.flush)
+        except Exception as e:
+            log.warning(f"vecstore flush error: {e}")
+        _local_store = None
+        _known_collections.clear()
+    if _client is None:
         return
-    client.create_collection(
-        collection_name=settings.QDRANT_COLLECTION,
-        vectors_config=qm.VectorParams(size=vector_size, distance=qm.Distance.COSINE),
-    )
+    try:
+        await _client.close()
+    except Exception as e:
+        log.debug(f"qdrant close error: {e}")
+    _client = None
+    _known_collections.clear()
 
-def upsert(point_id: int, vector: list[float], payload: dict) -> None:
-    client = qc()
-    client.upsert(
-        collection_name=settings.QDRANT_COLLECTION,
-        points=[qm.PointStruct(id=point_id, vector=vector, payload=payload)],
-    )
 
-def search(query_vector: list[float], limit: int) -> list[dict]:
-    client = qc()
-    res = client.search(
-        collection_name=settings.QDRANT_COLLECTION,
-        query_vector=query_vector,
-        limit=limit,
-        with_payload=True,
-    )
+async def ensure_collection(vector_size: int, collection: str | None = None) -> None:
+    name = _collection(collection)
+    if name in _known_collections:
+        return
+    async with _ensure_lock:
+        if name in _known_collections:
+            return
+        if _is_local():
+            await asyncio.to_thread(get_local_store().ensure_collection, name, vector_size)
+            _known_collections.add(name)
+            _missing_until.pop(name, None)
+            return
+        client = get_client()
+        if not await client.collection_exists(name):
+            await client.create_collection(
+                collection_name=name,
+                vectors_config=qm.VectorParams(size=vector_size, distance=qm.Distance.COSINE),
+            )
+            log.info(f"qdrant collection created: {name} dim={vector_size}")
+        _known_collections.add(name)
+        _missing_until.pop(name, None)
+
+
+async def has_collection(collection: str | None = None) -> bool:
+    """Для чтения: есть ли коллекция (ничего не создаёт). Наличие запоминаем навсегда,
+    отсутствие — на RAG_MISSING_RECHECK_SEC, чтобы не ходить в базу на каждый ответ."""
+    name = _collection(collection)
+    if name in _known_collections:
+        return True
+    now = time.monotonic()
+    if _missing_until.get(name, 0.0) > now:
+        return False
+    if _is_local():
+        ok = await asyncio.to_thread(get_local_store().collection_exists, name)
+    else:
+        ok = await get_client().collection_exists(name)
+    if ok:
+        _known_collections.add(name)
+        _missing_until.pop(name, None)
+    else:
+        _missing_until[name] = now + float(getattr(settings, "RAG_MISSING_RECHECK_SEC", 60))
+        log.info(f"rag: collection {name} not found, answering without memory")
+    return ok
+
+
+async def upsert_points(
+    points: Iterable[qm.PointStruct],
+    *,
+    collection: str | None = None,
+    batch_size: int | None = None,
+    wait: bool = False,
+) -> int:
+    """Пишет точки пачками по batch_size. wait=False — не ждём индексации на сервере."""
+    name = _collection(collection)
+    size = max(1, int(batch_size or getattr(settings, "QDRANT_UPSERT_BATCH", 256)))
+    if _is_local():
+        col = get_local_store().get(name)
+        write = lambda b: asyncio.to_thread(col.upsert, b)
+    else:
+        client = get_client()
+        write = lambda b: client.upsert(collection_name=name, points=b, wait=wait)
+    total = 0
+    batch: list[qm.PointStruct] = []
+    for p in points:
+        batch.append(p)
+        if len(batch) >= size:
+            await write(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        await write(batch)
+        total += len(batch)
+    return total
+
+
+def unflushed_points(collection: str | None = None) -> int:
+    """Сколько последних записанных точек ещё только в памяти (local: буфер до записи сегмента).
+
+    Qdrant с wait=True подтверждает запись сразу — там всегда 0."""
+    if not _is_local():
+        return 0
+    return get_local_store().get(_collection(collection)).buffered
+
+
+async def flush(collection: str | None = None) -> None:
+    """Сбросить буфер local-хранилища на диск (для Qdrant — ничего)."""
+    if _is_local():
+        await asyncio.to_thread(get_local_store().get(_collection(collection)).flush)
+
+
+async def upsert(point_id: int | str, vector: list[float], payload: dict) -> None:
+    await upsert_points([qm.PointStruct(id=point_id, vector=vector, payload=payload)])
+
+
+async def search(
+    query_vector: list[float],
+    limit: int,
+    *,
+    query_filter: qm.Filter | None = None,
+    score_threshold: float | None = None,
+    collection: str | None = None,
+) -> list[dict[str, Any]]:
+    if _is_local():
+        col = get_local_store().get(_collection(collection))
+        res = await asyncio.to_thread(
+            col.search, query_vector, limit, query_filter=query_filter, score_threshold=score_threshold,
+        )
+    else:
+        res = await get_client().search(
+            collection_name=_collection(collection),
+            query_vector=query_vector,
+            query_filter=query_filter,
+            limit=limit,
+            score_threshold=score_threshold,
+            with_payload=True,
+        )
     out = []
     for r in res:
         p = r.payload or {}
-        out.append({"score": r.score, "text": p.get("text",""), "username": p.get("username"), "user_id": p.get("user_id")})
+        out.append({
+            "id": r.id,
+            "score": r.score,
+            "text": p.get("text", ""),
+            "username": p.get("username") or p.get("from"),
+            "user_id": p.get("user_id"),
+            "chat_id": p.get("chat_id"),
+            "ts": p.get("ts"),
+            "date": p.get("date"),
+        })
     return out
+
+
+# ---------- живая выборка для ответа ----------
+
+_query_vectors = TTLStore(
+    float(getattr(settings, "RAG_QUERY_CACHE_TTL_SEC", 3600)),
+    max_items=int(getattr(settings, "RAG_QUERY_CACHE_SIZE", 2000)),
+)
+_inflight: dict[str, asyncio.Task] = {}
+_rag_stats = {"calls": 0, "timeouts": 0, "errors": 0, "embed_cache_hits": 0, "snippets": 0}
+
+
+def rag_stats() -> dict[str, int]:
+    return dict(_rag_stats)
+
+
+async def _query_vector(query: str) -> list[float]:
+    key = hashlib.blake2b(normalize(query).encode("utf-8"), digest_size=16).hexdigest()
+    vec = _query_vectors.get(key)
+    if vec is not None:
+        _rag_stats["embed_cache_hits"] += 1
+        return vec
+    # одинаковые запросы параллельно — один поход за эмбеддингом
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(embed_texts([query]))
+        _inflight[key] = task
+
+        def _done(t: asyncio.Task) -> None:
+            _inflight.pop(key, None)
+            if not t.cancelled() and t.exception() is None:
+                _query_vectors[key] = t.result()[0]
+
+        task.add_done_callback(_done)
+    # shield: при таймауте ответа эмбеддинг всё равно досчитается и ляжет в кэш
+    return (await asyncio.shield(task))[0]
+
+
+def _chat_filter(chat_id: int, before_ts: float) -> qm.Filter:
+    own = qm.Filter(must=[
+        qm.FieldCondition(key="chat_id", match=qm.MatchValue(value=int(chat_id))),
+        qm.FieldCondition(key="ts", range=qm.Range(lt=before_ts)),
+    ])
+    should: list[Any] = [own]
+    # старый индекс экспорта без chat_id/ts — это история целевой группы
+    if int(chat_id) == int(getattr(settings, "TARGET_GROUP_ID", 0)):
+        should.append(qm.IsEmptyCondition(is_empty=qm.PayloadField(key="chat_id")))
+    return qm.Filter(should=should)
+
+
+def _mmr(hits: list[dict[str, Any]], k: int, lam: float) -> list[dict[str, Any]]:
+    """Maximal marginal relevance: релевантность (score Qdrant) минус похожесть
+    на уже выбранное (Жаккар по словам — без векторов, это дёшево)."""
+    pool: list[tuple[dict[str, Any], set[str]]] = []
+    seen: set[str] = set()
+    for h in hits:
+        norm = normalize(h.get("text") or "")
+        if norm and norm not in seen:  # дословные повторы (копипаста, пересылки) — сразу мимо
+            seen.add(norm)
+            pool.append((h, set(norm.split())))
+    chosen: list[tuple[dict[str, Any], set[str]]] = []
+    while pool and len(chosen) < k:
+        best_i, best = 0, float("-inf")
+        for i, (h, w) in enumerate(pool):
+            red = 0.0
+            for _, cw in chosen:
+                if w and cw:
+                    red = max(red, len(w & cw) / len(w | cw))
+            val = lam * float(h["score"]) - (1.0 - lam) * red
+            if val > best:
+                best_i, best = i, val
+        chosen.append(pool.pop(best_i))
+    return [h for h, _ in chosen]
+
+
+def _format_hit(h: dict[str, Any], max_chars: int) -> str:
+    day = ""
+    if h.get("ts"):
+        day = datetime.fromtimestamp(float(h["ts"]), tz=timezone.utc).strftime("%Y-%m-%d")
+    elif isinstance(h.get("date"), str):
+        day = h["date"][:10]
+    who = (h.get("username") or "").strip() or "?"
+    text = " ".join(str(h.get("text") or "").split())
+    if len(text) > max_chars:
+        text = text[:max_chars].rstrip() + "…"
+    return f"[{day}] {who}: {text}" if day else f"{who}: {text}"
+
+
+async def _search_memory(chat_id: int, vec: list[float], now: float) -> str:
+    hits = await search(
+        vec,
+        int(getattr(settings, "RAG_CANDIDATES", 16)),
+        query_filter=_chat_filter(chat_id, now - float(getattr(settings, "RAG_EXCLUDE_RECENT_SEC", 86400))),
+        score_threshold=float(getattr(settings, "RAG_MIN_SCORE", 0.35)),
+    )
+    picked = _mmr(hits, int(getattr(settings, "RAG_TOP_K", 4)), float(getattr(settings, "RAG_MMR_LAMBDA", 0.7)))
+    max_chars = int(getattr(settings, "RAG_SNIPPET_CHARS", 300))
+    _rag_stats["snippets"] += len(picked)
+    return "\n".join(_format_hit(h, max_chars) for h in picked)
+
+
+async def retrieve(chat_id: int, query: str, *, now: float | None = None) -> str:
+    """Давние сообщения чата по теме запроса (лучшие первыми) или "" — при
+    отключённом RAG, коротком запросе, отсутствии коллекции, ошибке или таймауте."""
+    if not bool(getattr(settings, "RAG_ENABLED", True)) or not embeddings_available():
+        return ""
+    query = (query or "").strip()
+    if len(normalize(query)) < int(getattr(settings, "RAG_MIN_QUERY_CHARS", 8)):
+        return ""
+    _rag_stats["calls"] += 1
+    embed_timeout = float(getattr(settings, "RAG_EMBED_TIMEOUT_MS", 2000)) / 1000.0
+    timeout = float(getattr(settings, "RAG_TIMEOUT_MS", 350)) / 1000.0
+    stage = "embed"
+    t0 = time.perf_counter()
+    try:
+        if not await has_collection():
+            return ""
+        vec = await asyncio.wait_for(_query_vector(query[:2000]), embed_timeout)
+        stage = "search"
+        return await asyncio.wait_for(_search_memory(chat_id, vec, now or time.time()), timeout)
+    except asyncio.TimeoutError:
+        _rag_stats["timeouts"] += 1
+        log.info(f"rag {stage} timeout after {int((time.perf_counter() - t0) * 1000)}ms, answering without memory")
+    except Exception as e:
+        _rag_stats["errors"] += 1
+        log.warning(f"rag error: {e}")
+    return ""
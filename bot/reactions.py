@@ -1,17 +1,21 @@
 import random
 
+from .intents import AGREE, CRINGE, LAUGH, QUESTION, detect_intents
+
 DEFAULT_REACTIONS = ["😂", "💀", "🤡", "😐", "👍", "👀", "🔥", "🤝"]
 
-def pick_reaction(text: str) -> str:
-    t = (text or "").lower()
+def pick_reaction(text: str, intents: int | None = None) -> str:
+    # intents — маска из detect_intents(), если её уже посчитали для этого сообщения
+    if intents is None:
+        intents = detect_intents(text)
 
-    if any(w in t for w in ["ахаха", "лол", "ору", "смеш", "😂", "🤣", "хаха"]):
+    if intents & LAUGH:
         return random.choice(["😂", "💀"])
-    if any(w in t for w in ["бред", "чушь", "ерунда", "кринж", "стыд", "🤡", "пиздец"]):
+    if intents & CRINGE:
         return random.choice(["🤡", "💀"])
-    if any(w in t for w in ["ок", "пон", "ладно", "ясно", "норм", "база"]):
+    if intents & AGREE:
         return random.choice(["👍", "🤝"])
-    if any(w in t for w in ["что", "чего", "серьёзно", "реально", "wtf", "почему", "?"]):
+    if intents & QUESTION:
         return random.choice(["😐", "👀"])
 
     return random.choice(DEFAULT_REACTIONS)
@@ -0,0 +1,250 @@
+"""Кэш ответов на повторяющиеся вопросы.
+
+Ключ — нормализованный текст вопроса + отпечаток свежего контекста чата
+(последние строки истории чата, без личного контекста спрашивающего).
+Вопросы, от которых после нормализации почти ничего не осталось («?»,
+«)))», эмодзи), не кэшируются: у них у всех один ключ. Поиск:
+  1. точное совпадение нормализованного текста;
+  2. почти-дубликат: MinHash по символьным 3-граммам + LSH-корзины,
+     кандидат проверяется оценкой Жаккара.
+В обоих случаях контекст должен быть похож (тоже MinHash), иначе ответ
+может быть уже не в тему.
+
+На ключ храним несколько вариантов ответа. Прозвучавший в чате вариант —
+сгенерированный или отданный из кэша — там же не повторяем дословно
+NO_REPEAT секунд: если все варианты уже звучали — промах, модель генерирует
+новый, и он добавляется к вариантам. NO_REPEAT должен быть меньше TTL,
+иначе вариант истечёт раньше, чем его можно будет отдать.
+Записи живут TTL и вытесняются по LRU.
+"""
+from __future__ import annotations
+
+import hashlib
+import random
+import re
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from .state import TTLStore
+
+_P = (1 << 61) - 1  # простое Мерсенна для универсального хэширования
+_NORM_DROP_RX = re.compile(r"@\w+|[^\w\s]+")
+
+Key = tuple[int, str]  # (chat_id, mode)
+
+
+def normalize(text: str) -> str:
+    t = (text or "").lower().replace("ё", "е")
+    t = _NORM_DROP_RX.sub(" ", t)
+    return " ".join(t.split())
+
+
+def _shingles(text: str, n: int = 3) -> set[str]:
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def _h64(s: str) -> int:
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class MinHasher:
+    def __init__(self, num_perm: int, seed: int = 1) -> None:
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self._perms = [(rng.randrange(1, _P), rng.randrange(0, _P)) for _ in range(num_perm)]
+
+    def signature(self, items: set[str]) -> tuple[int, ...]:
+        if not items:
+            return ()
+        hs = [_h64(x) for x in items]
+        return tuple(min((a * h + b) % _P for h in hs) for a, b in self._perms)
+
+
+def similarity(a: tuple[int, ...], b: tuple[int, ...]) -> float:
+    """Оценка Жаккара по двум MinHash-подписям. Две пустые подписи — совпадение."""
+    if not a or not b:
+        return 1.0 if a == b else 0.0
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+class _Entry:
+    __slots__ = ("key", "norm", "sig", "ctx_sig", "variants", "expires_at")
+
+    def __init__(self, key: Key, norm: str, sig: tuple[int, ...], ctx_sig: tuple[int, ...], expires_at: float) -> None:
+        self.key = key
+        self.norm = norm
+        self.sig = sig
+        self.ctx_sig = ctx_sig
+        self.variants: list[str] = []
+        self.expires_at = expires_at
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        *,
+        ttl_sec: float = 1800.0,
+        max_items: int = 2000,
+        similarity: float = 0.8,
+        context_similarity: float = 0.3,
+        context_lines: int = 8,
+        no_repeat_sec: float = 600.0,
+        max_variants: int = 4,
+        min_fuzzy_chars: int = 12,
+        min_chars: int = 4,
+        num_perm: int = 32,
+        bands: int = 8,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        if no_repeat_sec >= ttl_sec:
+            raise ValueError(f"response cache: no_repeat_sec ({no_repeat_sec}) must be < ttl_sec ({ttl_sec})")
+        self.ttl_sec = ttl_sec
+        self.max_items = max(1, max_items)
+        self.similarity = similarity
+        self.context_similarity = context_similarity
+        self.context_lines = context_lines
+        self.max_variants = max(1, max_variants)
+        self.min_fuzzy_chars = min_fuzzy_chars
+        self.min_chars = max(1, min_chars)
+        self.bands = bands
+        self.rows = max(1, num_perm // bands)
+        self._clock = clock
+        self._mh = MinHasher(self.bands * self.rows)
+
+        self._entries: OrderedDict[tuple[Key, str], _Entry] = OrderedDict()  # порядок = LRU
+        self._buckets: dict[tuple, set[tuple[Key, str]]] = {}
+        # (chat_id, хэш ответа) -> когда прозвучал в чате; живёт no_repeat_sec
+        self._sent = TTLStore(no_repeat_sec, max_items=max(1000, self.max_items * self.max_variants), clock=clock)
+
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self.repeats_avoided = 0
+
+    # ---------- отпечатки ----------
+
+    def _ctx_sig(self, context: str) -> tuple[int, ...]:
+        # context — только история чата: личный контекст спрашивающего сюда не передают
+        lines = [ln for ln in (context or "").splitlines() if ln.strip()]
+        words = set(normalize("\n".join(lines[-self.context_lines:])).split())
+        return self._mh.signature(words)
+
+    def _band_keys(self, key: Key, sig: tuple[int, ...]) -> list[tuple]:
+        r = self.rows
+        return [(key, b, sig[b * r:(b + 1) * r]) for b in range(self.bands)] if sig else []
+
+    # ---------- служебное ----------
+
+    def _drop(self, ek: tuple[Key, str]) -> None:
+        e = self._entries.pop(ek, None)
+        if e is None:
+            return
+        for bk in self._band_keys(e.key, e.sig):
+            ids = self._buckets.get(bk)
+            if ids is not None:
+                ids.discard(ek)
+                if not ids:
+                    del self._buckets[bk]
+
+    def _alive(self, ek: tuple[Key, str], now: float) -> _Entry | None:
+        e = self._entries.get(ek)
+        if e is None:
+            return None
+        if e.expires_at <= now:
+            self._drop(ek)
+            return None
+        return e
+
+    @staticmethod
+    def _reply_id(reply: str) -> str:
+        return hashlib.blake2b(normalize(reply).encode("utf-8"), digest_size=8).hexdigest()
+
+    # ---------- API ----------
+
+    def lookup(self, chat_id: int, mode: str, user_text: str, context: str) -> str | None:
+        """Готовый ответ из кэша (и помечает его отправленным) или None."""
+        norm = normalize(user_text)
+        if len(norm) < self.min_chars:
+            return None
+        now = self._clock()
+        key: Key = (int(chat_id), mode)
+        ctx_sig = self._ctx_sig(context)
+
+        candidates: list[_Entry] = []
+        e = self._alive((key, norm), now)
+        if e is not None and similarity(e.ctx_sig, ctx_sig) >= self.context_similarity:
+            candidates.append(e)
+        elif len(norm) >= self.min_fuzzy_chars:
+            sig = self._mh.signature(_shingles(norm))
+            seen: set[tuple[Key, str]] = set()
+            for bk in self._band_keys(key, sig):
+                for ek in list(self._buckets.get(bk, ())):
+                    if ek in seen:
+                        continue
+                    seen.add(ek)
+                    c = self._alive(ek, now)
+                    if c is None:
+                        continue
+                    if similarity(c.sig, sig) >= self.similarity and similarity(c.ctx_sig, ctx_sig) >= self.context_similarity:
+                        candidates.append(c)
+
+        for c in candidates:
+            fresh = [v for v in c.variants if (key[0], self._reply_id(v)) not in self._sent]
+            if not fresh:
+                self.repeats_avoided += 1
+                continue
+            self._entries.move_to_end((c.key, c.norm))
+            reply = random.choice(fresh)
+            self._sent[(key[0], self._reply_id(reply))] = now
+            if c.norm == norm:
+                self.hits += 1
+            else:
+                self.fuzzy_hits += 1
+            return reply
+
+        self.misses += 1
+        return None
+
+    def store(self, chat_id: int, mode: str, user_text: str, context: str, reply: str) -> None:
+        """Сгенерированный и отправленный ответ: в варианты и в «прозвучавшие» этого чата."""
+        reply = (reply or "").strip()
+        norm = normalize(user_text)
+        if not reply or len(norm) < self.min_chars:
+            return
+        now = self._clock()
+        key: Key = (int(chat_id), mode)
+        ek = (key, norm)
+        self._sent[(key[0], self._reply_id(reply))] = now
+
+        e = self._alive(ek, now)
+        if e is None:
+            sig = self._mh.signature(_shingles(norm)) if len(norm) >= self.min_fuzzy_chars else ()
+            e = _Entry(key, norm, sig, self._ctx_sig(context), now + self.ttl_sec)
+            self._entries[ek] = e
+            for bk in self._band_keys(key, sig):
+                self._buckets.setdefault(bk, set()).add(ek)
+        else:
+            e.ctx_sig = self._ctx_sig(context)
+            e.expires_at = now + self.ttl_sec
+            self._entries.move_to_end(ek)
+
+        if reply not in e.variants:
+            e.variants.append(reply)
+            if len(e.variants) > self.max_variants:
+                e.variants.pop(0)
+
+        while len(self._entries) > self.max_items:
+            self._drop(next(iter(self._entries)))
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "items": len(self._entries),
+            "buckets": len(self._buckets),
+            "hits": self.hits,
+            "fuzzy_hits": self.fuzzy_hits,
+            "misses": self.misses,
+            "repeats_avoided": self.repeats_avoided,
+        }
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import random
+import time
+
+log = logging.getLogger(__name__)
+
+
+class ModelStats:
+    __slots__ = ("latency_ms", "error_rate", "garbage_rate", "calls", "updated_ts")
+
+    def __init__(self, latency_ms: float, error_rate: float = 0.0, garbage_rate: float = 0.0, calls: int = 0, updated_ts: float = 0.0) -> None:
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.garbage_rate = garbage_rate
+        self.calls = calls
+        self.updated_ts = updated_ts
+
+    def to_dict(self) -> dict:
+        return {s: getattr(self, s) for s in self.__slots__}
+
+
+class ModelRouter:
+    """Адаптивный порядок моделей по реальным вызовам.
+
+    По каждой модели держим EWMA латентности, доли ошибок и доли мусора
+    (is_garbage_text). Чем быстрее и здоровее модель — тем раньше её пробуем.
+    Плохая статистика со временем «остывает» (half-life), плюс иногда пробуем
+    не-лучшую модель первой, чтобы заметить, что она ожила. Статистика
+    переживает рестарт — сохраняется в json.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        alpha: float = 0.2,
+        explore_prob: float = 0.05,
+        half_life_sec: float = 3600.0,
+        prior_latency_ms: float = 3000.0,
+        persist_every_sec: float = 60.0,
+    ) -> None:
+        self.path = path
+        self.alpha = alpha
+        self.explore_prob = explore_prob
+        self.half_life_sec = max(1.0, half_life_sec)
+        self.prior_latency_ms = prior_latency_ms
+        self.persist_every_sec = persist_every_sec
+        self._stats: dict[str, ModelStats] = {}
+        self._dirty = False
+        self._last_save = time.time()
+        self.load()
+
+    def _get(self, model: str) -> ModelStats:
+        st = self._stats.get(model)
+        if st is None:
+            st = ModelStats(self.prior_latency_ms)
+            self._stats[model] = st
+        return st
+
+    def _score(self, model: str, now: float) -> float:
+        """Ожидаемое время до нормального ответа (мс): латентность / доля успехов."""
+        st = self._stats.get(model)
+        if st is None:
+            return self.prior_latency_ms
+        decay = 0.5 ** (max(0.0, now - st.updated_ts) / self.half_life_sec)
+        fail = min(0.95, (st.error_rate + st.garbage_rate) * decay)
+        latency = self.prior_latency_ms + (st.latency_ms - self.prior_latency_ms) * decay
+        return latency / (1.0 - fail)
+
+    def order(self, models: list[str]) -> list[str]:
+        if len(models) < 2:
+            return list(models)
+        now = time.time()
+        ranked = sorted(range(len(models)), key=lambda i: (self._score(models[i], now), i))
+        out = [models[i] for i in ranked]
+        if random.random() < self.explore_prob:
+            j = random.randrange(1, len(out))
+            out.insert(0, out.pop(j))
+        return out
+
+    def record(self, model: str, *, ms: int | None = None, error: bool = False, garbage: bool = False) -> None:
+        st = self._get(model)
+        a = self.alpha
+        if ms is not None:
+            st.latency_ms += a * (ms - st.latency_ms)
+        st.error_rate += a * ((1.0 if error else 0.0) - st.error_rate)
+        st.garbage_rate += a * ((1.0 if garbage else 0.0) - st.garbage_rate)
+        st.calls += 1
+        st.updated_ts = time.time()
+        self._dirty = True
+
+        if st.updated_ts - self._last_save >= self.persist_every_sec:
+            self.save()
+
+    def snapshot(self) -> dict[str, dict]:
+        return {m: st.to_dict() for m, st in self._stats.items()}
+
+    def load(self) -> None:
+        try:
+            if not os.path.exists(self.path):
+                return
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for model, d in (data or {}).items():
+                self._stats[model] = ModelStats(
+                    float(d.get("latency_ms", self.prior_latency_ms)),
+                    float(d.get("error_rate", 0.0)),
+                    float(d.get("garbage_rate", 0.0)),
+                    int(d.get("calls", 0)),
+                    float(d.get("updated_ts", 0.0)),
+                )
+        except Exception as e:
+            log.warning(f"router stats load error: {e}")
+
+    def save(self) -> None:
+        self._last_save = time.time()
+        if not self._dirty:
+            return
+        try:
+            d = os.path.dirname(self.path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+            self._dirty = False
+        except Exception as e:
+            log.warning(f"router stats save error: {e}")
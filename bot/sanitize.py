@@ -0,0 +1,104 @@
+"""Очистка и браковка ответов LLM.
+
+Все регулярки собраны один раз при импорте. Классификация мусора — одна
+объединённая регулярка плюс подсчёт латиницы на уровне C (encode/translate),
+без посимвольных циклов в Python. Вердикты совпадают со старой реализацией
+(см. scripts/bench_sanitize.py — там эталон, корпус и замеры).
+"""
+from __future__ import annotations
+
+import re
+import string
+from functools import lru_cache
+
+# [a-z] и [а-яё] в режиме re.I — ровно эти символы (включая редкие юникодные
+# варианты регистра), чтобы вердикты совпадали со старой регуляркой один в один
+_LAT = "A-Za-z\u0130\u0131\u017f\u212a"
+_CYR = "\u0410-\u042f\u0430-\u044f\u0401\u0451\u1c80-\u1c86"
+
+_TAG_RX = re.compile(r"<\|.*?\|>")
+_HEADER_RX = re.compile(r"<start_header_id>|<end_header_id>", re.I)
+_ROLE_RX = re.compile(r"\b(system|assistant|user)\b", re.I)
+
+# Все признаки мусора в одной регулярке. Смешение латиницы и кириллицы
+# в одной строке проверяется один раз от начала строки (а не от каждой буквы,
+# как раньше — там выходило O(n^2) на длинных строках). Оно же покрывает
+# «слово из смеси алфавитов», так что отдельная проверка слов не нужна.
+_GARBAGE_RX = re.compile(
+    r"<\|.*?\|>"
+    r"|<start_header_id>|<end_header_id>"
+    r"|\b(?:system|assistant|user)\b"
+    r"|@protocol"
+    r"|presentdecoded|eventz|decode|latent|pipeline"
+    r"|instanceof|prototype|undefined|null|function\(|var\s|let\s|const\s"
+    r"|(?-i:[A-Za-z_]{24,})"
+    rf"|(?-i:(?m:^(?=[^\n]*[{_LAT}])(?=[^\n]*[{_CYR}])))",
+    re.I,
+)
+
+_ASCII_LETTERS = string.ascii_letters.encode("ascii")
+
+
+def clean_llm_output(text: str) -> str:
+    if not text:
+        return ""
+    out = text
+    if "<" in out:
+        out = _TAG_RX.sub("", out)
+        out = _HEADER_RX.sub("", out)
+    out = _ROLE_RX.sub("", out)
+    out = out.replace("<<", "").replace(">>", "")
+    return " ".join(out.split()).strip()
+
+
+def _latin_letters(t: str) -> int:
+    # ascii-буквы: выкидываем всё не-ascii, потом считаем, сколько удалит translate
+    b = t.encode("ascii", "ignore")
+    return len(b) - len(b.translate(None, _ASCII_LETTERS))
+
+
+def is_garbage_text(text: str) -> bool:
+    if not text:
+        return True
+    t = text.strip()
+
+    if len(t) > 420 and t.count(" ") < 12:
+        return True
+
+    if _latin_letters(t) / max(1, len(t)) > 0.35:
+        return True
+
+    return _GARBAGE_RX.search(t) is not None
+
+
+def is_garbage_prefix(text: str) -> bool:
+    """Проверка недописанного (стримящегося) ответа.
+
+    Только правила, которые продолжение текста уже не «исправит»: маркеры,
+    кодовые слова, смесь латиницы и кириллицы. Доли/длины проверяются на полном тексте.
+    """
+    if not text:
+        return False
+    return _GARBAGE_RX.search(text.strip()) is not None
+
+
+def sanitize(text: str) -> tuple[str, bool]:
+    """clean_llm_output + is_garbage_text за один вызов: (чистый текст, мусор ли)."""
+    out = clean_llm_output(text)
+    return out, is_garbage_text(out)
+
+
+@lru_cache(maxsize=8)
+def _mention_rx(bot_username_lower: str) -> re.Pattern:
+    return re.compile(re.escape("@" + bot_username_lower), re.I)
+
+
+def strip_self_mention(text: str, bot_username_lower: str) -> str:
+    if not text or not bot_username_lower:
+        return text
+    rx = _mention_rx(bot_username_lower)
+    out, n = rx.subn("", text)
+    # удаление могло склеить новое упоминание ("@bo@botxt") — добиваем
+    while n:
+        out, n = rx.subn("", out)
+    return " ".join(out.split()).strip()
@@ -1,3 +1,5 @@
+from urllib.parse import quote
+
 from pydantic_settings import BaseSettings
 
 
@@ -24,6 +26,22 @@ class Settings(BaseSettings):
     DB_USER: str = "balbes"
     DB_PASSWORD: str = "balbes"
 
+    # Qdrant (векторная память)
+    QDRANT_URL: str = "http://127.0.0.1:6333"
+    QDRANT_COLLECTION: str = "tg_messages"
+    QDRANT_API_KEY: str = ""
+    QDRANT_PREFER_GRPC: bool = True   # gRPC на QDRANT_GRPC_PORT, если сервер его отдаёт
+    QDRANT_GRPC_PORT: int = 6334
+    QDRANT_TIMEOUT_SEC: int = 10
+    QDRANT_UPSERT_BATCH: int = 256
+    # "qdrant" — сервер по QDRANT_URL; "local" — встроенное хранилище bot/vecstore.py в VECSTORE_DIR
+    VECTOR_BACKEND: str = "qdrant"
+    VECSTORE_DIR: str = "artifacts/vecstore"
+    VECSTORE_SEGMENT_ROWS: int = 50000   # столько точек копится в памяти до записи сегмента
+    VECSTORE_MAX_SEGMENTS: int = 8       # больше сегментов — compact() в один
+    VECSTORE_IVF_MIN_ROWS: int = 20000   # с такого размера сегмент получает IVF (иначе полный перебор)
+    VECSTORE_NPROBE: int = 16            # сколько списков IVF смотрим на запрос
+
     # OpenAI (оставляем как запасной вариант, но можно не использовать)
     OPENAI_API_KEY: str = ""
     OPENAI_TEXT_MODEL: str = "gpt-4o-mini"
@@ -34,11 +52,55 @@ class Settings(BaseSettings):
     OPENROUTER_BASE_URL: str = "https://openrouter.ai/api/v1"
     OPENROUTER_APP_NAME: str = "ai-balbes-bot"
     OPENROUTER_SITE_URL: str = ""
+    OPENROUTER_TIMEOUT_SEC: float = 60.0  # таймаут одного запроса к модели
 
     # модели
     OPENROUTER_TEXT_MODEL: str = "meta-llama/llama-3.1-70b-instruct"
     OPENROUTER_TEXT_FALLBACKS: str = "meta-llama/llama-3.1-8b-instruct,mistralai/mixtral-8x7b-instruct"
 
+    # Хеджирование: если модель тормозит дольше p-квантиля своей латентности,
+    # параллельно запускаем следующую и берём первый нормальный ответ
+    OPENROUTER_HEDGE_ENABLED: bool = False
+    OPENROUTER_HEDGE_QUANTILE: float = 0.9
+    OPENROUTER_HEDGE_DELAY_MS: int = 4000      # пока нет статистики по модели
+    OPENROUTER_HEDGE_MIN_DELAY_MS: int = 800
+
+    # Адаптивный порядок моделей (EWMA латентности/ошибок/мусора, artifacts/model_router.json)
+    OPENROUTER_ROUTER_ENABLED: bool = True
+    OPENROUTER_ROUTER_EXPLORE_PROB: float = 0.05
+    OPENROUTER_ROUTER_HALF_LIFE_SEC: int = 3600
+
+    # Circuit breaker на модель: после N сбоев подряд (или 429 с Retry-After) модель пропускаем
+    OPENROUTER_BREAKER_FAILURES: int = 3
+    OPENROUTER_BREAKER_COOLDOWN_SEC: int = 30
+    OPENROUTER_BREAKER_MAX_COOLDOWN_SEC: int = 300
+    # Бюджет ретраев/фоллбеков: не больше ratio от числа запросов (+ небольшой приток в секунду)
+    OPENROUTER_RETRY_BUDGET_RATIO: float = 0.5
+    OPENROUTER_RETRY_BUDGET_MIN_PER_SEC: float = 0.1
+
+    STYLE_RELOAD_SEC: float = 5.0  # как часто проверять mtime artifacts/system_style.txt
+    # Онлайн-профиль стиля (bot/style_online.py): бот сам ведёт счётчики по сообщениям целевого
+    # чата и раз в STYLE_ONLINE_PERSIST_SEC перерисовывает artifacts/system_style.txt
+    STYLE_ONLINE_ENABLED: bool = True
+    STYLE_ONLINE_STATE_PATH: str = "artifacts/style_online.json"
+    STYLE_ONLINE_CAPACITY: int = 5000        # слов и биграмм в скетче (Space-Saving)
+    STYLE_ONLINE_SMALL_CAPACITY: int = 200   # эмодзи и авторов
+    STYLE_ONLINE_PERSIST_SEC: int = 300
+    STYLE_ONLINE_MIN_MESSAGES: int = 500     # меньше — style-файл не трогаем (не затираем полный проход)
+    FORCE_SWEAR_RATIO_PERCENT: str = ""      # как в scripts/build_style_profile.py: цель в style вместо реальной доли
+
+    # Бюджет prompt tokens на запрос; считаем настоящим токенайзером модели (bot/tokens.py)
+    OPENROUTER_PROMPT_BUDGET_TOKENS: int = 520
+    TOKENIZER_BACKEND: str = "auto"              # auto | hf | tiktoken | heuristic
+    TOKENIZER_DIR: str = "artifacts/tokenizers"  # HF tokenizer.json: <vendor>__<model>.json
+    TOKENIZER_TIKTOKEN_ENCODING: str = "cl100k_base"  # для не-openai моделей, когда нет HF файла
+    TOKENIZER_SAFETY_MARGIN: float = 1.15        # запас для неточных (приближённых) токенайзеров
+    TOKEN_CACHE_SIZE: int = 20000                # LRU: число токенов по строке контекста
+
+    # Стрим: мусор ловим по мере генерации и сразу переключаемся на следующую модель
+    OPENROUTER_STREAM_ENABLED: bool = True
+    STREAM_PROGRESSIVE_EDIT: bool = False  # показывать ответ по мере стрима (send + edit_message_text)
+
     # Image generation (OpenRouter)
     OPENROUTER_IMAGE_MODEL: str = "google/gemini-2.5-flash-image"
 
@@ -57,6 +119,53 @@ class Settings(BaseSettings):
     MEMORY_24H_LIMIT: int = 20
     MEMORY_24H_MAX_CHARS: int = 1200
     USER_MEMORY_MAX_CHARS: int = 300  # личный контекст автора за 24ч
+    HISTORY_BUFFER_SIZE: int = 256    # сообщений на чат в памяти (кольцевой буфер)
+
+    # Запись истории в tg_history (write-behind пачками)
+    INGEST_QUEUE_MAX: int = 5000      # размер очереди; при переполнении — backpressure
+    INGEST_BATCH_ROWS: int = 200      # сброс по числу строк
+    INGEST_FLUSH_MS: int = 500        # или по времени
+
+    # RAG: давняя память чата из Qdrant в контекст ответа
+    EMBED_MODEL: str = "text-embedding-3-small"  # как у индекса (OPENAI_API_KEY)
+    # индексация истории (scripts/index_tg_export_to_qdrant.py): пачки и темп;
+    # RPM/TPM — стартовые лимиты, дальше подстраиваемся под x-ratelimit-* заголовки
+    EMBED_BATCH_MAX_INPUTS: int = 256
+    EMBED_BATCH_MAX_TOKENS: int = 64000
+    EMBED_CONCURRENCY: int = 4
+    EMBED_RPM: int = 500
+    EMBED_TPM: int = 1000000
+    # постоянный кэш эмбеддингов по тексту (bot/embed_cache.py): и для индексации, и для живого RAG
+    EMBED_CACHE_ENABLED: bool = True
+    EMBED_CACHE_PATH: str = "artifacts/embed_cache.sqlite3"
+    EMBED_CACHE_MAX_MB: int = 2048
+    # scripts/ingest_tg_export.py: сообщений в пачке между стадиями и пачек в каждой очереди
+    EXPORT_BATCH_ROWS: int = 500
+    EXPORT_QUEUE_BATCHES: int = 8
+    RAG_ENABLED: bool = True
+    RAG_EMBED_TIMEOUT_MS: int = 2000     # эмбеддинг запроса (удалённый вызов; повторы — из кэша)
+    RAG_TIMEOUT_MS: int = 350            # жёсткий потолок на поиск; дольше — отвечаем без памяти
+    RAG_MISSING_RECHECK_SEC: int = 60    # коллекции нет — перепроверяем не чаще
+    RAG_MIN_QUERY_CHARS: int = 8
+    RAG_CANDIDATES: int = 16             # сколько берём из Qdrant до MMR
+    RAG_TOP_K: int = 4
+    RAG_MIN_SCORE: float = 0.35
+    RAG_MMR_LAMBDA: float = 0.7          # 1.0 — только релевантность, меньше — больше разнообразия
+    RAG_MAX_TOKENS: int = 150            # доля бюджета промпта под память
+    RAG_SNIPPET_CHARS: int = 300
+    RAG_EXCLUDE_RECENT_SEC: int = 86400  # свежее и так в контексте 24ч
+    RAG_QUERY_CACHE_SIZE: int = 2000
+    RAG_QUERY_CACHE_TTL_SEC: int = 3600
+
+    # Кэш ответов: повторяющиеся вопросы без похода в LLM
+    RESPONSE_CACHE_ENABLED: bool = True
+    RESPONSE_CACHE_TTL_SEC: int = 1800
+    RESPONSE_CACHE_MAX_ITEMS: int = 2000
+    RESPONSE_CACHE_SIMILARITY: float = 0.8          # оценка Жаккара вопросов (MinHash по 3-граммам)
+    RESPONSE_CACHE_CONTEXT_SIMILARITY: float = 0.3  # похожесть последних строк контекста
+    RESPONSE_CACHE_NO_REPEAT_SEC: int = 600         # прозвучавший в чате ответ там же не повторяем дословно (< TTL)
+    RESPONSE_CACHE_MAX_VARIANTS: int = 4
+    RESPONSE_CACHE_MIN_CHARS: int = 4               # короче после нормализации («?», «)))», эмодзи) — не кэшируем
 
     # Reply behavior
     REPLY_TO_OWNER: bool = False          # владелец -> вообще не отвечать
@@ -64,6 +173,15 @@ class Settings(BaseSettings):
     REPLY_COOLDOWN_SEC: int = 8           # антиспам на чат
     REACT_PROB_WHEN_SILENT: float = 0.35  # если решили молчать — часто реакция
 
+    # Длинные сообщения (телега режет простыню на куски)
+    BIGMSG_DEBOUNCE_SEC: float = 5.0      # ждём следующий кусок столько после последнего
+    BIGMSG_MAX_WAIT_SEC: float = 35.0     # но не дольше этого от первого куска
+    BIGMSG_MAX_CHARS: int = 40000         # склеенный текст больше — отдаём сразу
+    BIGMSG_MEMORY_CHARS: int = 400000     # общий лимит буферов по всем чатам
+
+    # Состояние (кулдауны, диалог-окна): лимит ключей на каждое хранилище
+    STATE_MAX_KEYS: int = 50000
+
     # Spontaneous
     SPONTANEOUS_PROB: float = 0.12
     SPONTANEOUS_MIN_SEC: int = 180
@@ -71,6 +189,11 @@ class Settings(BaseSettings):
     SPONTANEOUS_COOLDOWN_SEC: int = 3600
     SPONTANEOUS_ONLY_IF_SILENT_SEC: int = 600
 
+    @property
+    def db_dsn(self) -> str:
+        # для SQLAlchemy (bot/db.py)
+        return f"postgresql+asyncpg://{quote(self.DB_USER, safe='')}:{quote(self.DB_PASSWORD, safe='')}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
+
     class Config:
         env_file = ".env"
         extra = "ignore"
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+def _approx_size(key: Hashable, value: Any) -> int:
+    # грубо: ключ + значение + запись в словаре/куче
+    size = sys.getsizeof(key) + sys.getsizeof(value) + 96
+    if isinstance(value, tuple):
+        size += sum(sys.getsizeof(v) for v in value)
+    return size
+
+
+class TTLStore:
+    """Словарь с TTL на ключ и лимитом размера.
+
+    Просроченные записи снимаются с вершины min-кучи дедлайнов при каждом
+    обращении — без обхода всего словаря. При переполнении `max_items` уходят
+    самые давно обновлённые ключи. Память считается приблизительно.
+    """
+
+    def __init__(
+        self,
+        ttl_sec: float | Callable[[], float],
+        *,
+        max_items: int = 100_000,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self._ttl = ttl_sec
+        self._max_items = max(1, max_items)
+        self._clock = clock
+        # key -> (expires_at, value, size); порядок = порядок обновления
+        self._data: OrderedDict[Hashable, tuple[float, Any, int]] = OrderedDict()
+        self._heap: list[tuple[float, int, Hashable]] = []
+        self._seq = itertools.count()
+        self.bytes = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def _default_ttl(self) -> float:
+        return float(self._ttl() if callable(self._ttl) else self._ttl)
+
+    def _expire(self, now: float) -> None:
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            exp, _, key = heapq.heappop(heap)
+            cur = self._data.get(key)
+            # в куче могут лежать устаревшие дедлайны — удаляем только актуальный
+            if cur is not None and cur[0] == exp:
+                del self._data[key]
+                self.bytes -= cur[2]
+                self.expired += 1
+        # куча разрастается устаревшими записями при частых set одного ключа
+        if len(heap) > 2 * len(self._data) + 64:
+            self._heap = [(v[0], next(self._seq), k) for k, v in self._data.items()]
+            heapq.heapify(self._heap)
+
+    def set(self, key: Hashable, value: Any, ttl_sec: float | None = None) -> None:
+        now = self._clock()
+        self._expire(now)
+        exp = now + (self._default_ttl() if ttl_sec is None else float(ttl_sec))
+
+        old = self._data.pop(key, None)
+        if old is not None:
+            self.bytes -= old[2]
+        size = _approx_size(key, value)
+        self._data[key] = (exp, value, size)
+        self.bytes += size
+        heapq.heappush(self._heap, (exp, next(self._seq), key))
+
+        while len(self._data) > self._max_items:
+            _, (_, _, sz) = self._data.popitem(last=False)
+            self.bytes -= sz
+            self.evicted += 1
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        self.set(key, value)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = self._clock()
+        self._expire(now)
+        cur = self._data.get(key)
+        if cur is None:
+            return default
+        return cur[1]
+
+    def expires_at(self, key: Hashable) -> float | None:
+        self._expire(self._clock())
+        cur = self._data.get(key)
+        return cur[0] if cur is not None else None
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        cur = self._data.pop(key, None)
+        if cur is None:
+            return default
+        self.bytes -= cur[2]
+        return cur[1]
+
+    def __contains__(self, key: Hashable) -> bool:
+        self._expire(self._clock())
+        return key in self._data
+
+    def __len__(self) -> int:
+        self._expire(self._clock())
+        return len(self._data)
+
+    def stats(self) -> dict:
+        self._expire(self._clock())
+        return {
+            "items": len(self._data),
+            "bytes": self.bytes,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,334 @@
+"""Профиль стиля, который бот обновляет сам по мере переписки.
+
+scripts/build_style_profile.py считает профиль полным проходом по
+tg_history — запускать его руками после каждой недели переписки дорого.
+Здесь те же метрики ведутся инкрементально: save_and_index отдаёт каждое
+сообщение целевого чата в OnlineStyleProfile.add() — O(1) на сообщение
+(амортизированно), память ограничена ёмкостью скетчей, а не размером истории.
+
+Частоты слов/биграмм/эмодзи/авторов — Space-Saving (top-k «тяжёлых»
+элементов с ограниченной ошибкой), длины — гистограмма, остальное —
+суммы. Раз в STYLE_ONLINE_PERSIST_SEC состояние пишется в
+STYLE_ONLINE_STATE_PATH, а style_profile.json / system_style.txt
+перерисовываются; prompts.StyleBlock подхватывает новый файл по mtime.
+Скрипт полного прохода засевает то же состояние, и бот продолжает с него.
+Не засеянное состояние (seeded_messages == 0) style-файлы из полного
+прохода не перезаписывает: профиль по паре сотен живых сообщений хуже.
+"""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import json
+import logging
+import os
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Iterable
+
+from .style_profile import (
+    EMOJI_RE,
+    PUNCT_RE,
+    STYLE_PATH,
+    SWEAR_RE,
+    WORD_RE,
+    make_profile,
+    median_from_hist,
+    write_artifacts,
+    write_json_atomic,
+)
+
+log = logging.getLogger(__name__)
+
+STATE_VERSION = 1
+MAX_LEN_BUCKET = 4096  # длиннее — в одну корзину: медиане не мешает, гистограмма ограничена
+
+
+class SpaceSaving:
+    """Top-k частых элементов потока в памяти O(capacity).
+
+    Вариант с отложенным вытеснением: таблица растёт до 2*capacity, затем
+    остаются capacity самых частых (сортировка раз на capacity вставок —
+    амортизированно O(1) на элемент). floor — максимальный вытесненный счёт:
+    новый элемент стартует с floor, так что оценка завышена не больше чем на
+    floor <= N/capacity, а всё, что встречалось чаще, гарантированно в таблице.
+    """
+
+    __slots__ = ("capacity", "counts", "floor")
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = max(1, capacity)
+        self.counts: dict[str, int] = {}
+        self.floor = 0
+
+    def add(self, item: str, n: int = 1) -> None:
+        c = self.counts.get(item)
+        if c is not None:
+            self.counts[item] = c + n
+            return
+        self.counts[item] = self.floor + n
+        if len(self.counts) >= 2 * self.capacity:
+            self._prune()
+
+    def update(self, items: Iterable[str]) -> None:
+        counts = self.counts
+        for x in items:
+            c = counts.get(x)
+            if c is not None:
+                counts[x] = c + 1
+            else:
+                self.add(x)
+                counts = self.counts  # _prune мог заменить словарь
+
+    def _prune(self) -> None:
+        keep = heapq.nlargest(self.capacity, self.counts.items(), key=lambda kv: kv[1])
+        if len(keep) < len(self.counts):
+            self.floor = max(self.floor, keep[-1][1])
+        self.counts = dict(keep)
+
+    def most_common(self, n: int | None = None) -> list[tuple[str, int]]:
+        if n is None:
+            return sorted(self.counts.items(), key=lambda kv: kv[1], reverse=True)
+        return heapq.nlargest(n, self.counts.items(), key=lambda kv: kv[1])
+
+    def to_state(self) -> dict[str, Any]:
+        if len(self.counts) > self.capacity:
+            self._prune()  # иначе floor не учтёт то, что не попадёт в файл
+        return {"floor": self.floor, "items": self.most_common()}
+
+    @classmethod
+    def from_state(cls, capacity: int, state: dict[str, Any] | None) -> "SpaceSaving":
+        sk = cls(capacity)
+        if state:
+            sk.floor = int(state.get("floor", 0))
+            sk.counts = {str(k): int(v) for k, v in state.get("items", [])}
+            if len(sk.counts) > sk.capacity:
+                sk._prune()  # ёмкость в настройках уменьшили
+        return sk
+
+    @classmethod
+    def from_counter(cls, capacity: int, counter: Counter) -> "SpaceSaving":
+        """Сжатие точных счётчиков полного прохода до capacity."""
+        sk = cls(capacity)
+        sk.counts = dict(counter)
+        sk._prune()
+        return sk
+
+    def resized(self, capacity: int) -> "SpaceSaving":
+        sk = SpaceSaving.from_counter(capacity, self.counts)
+        sk.floor = max(sk.floor, self.floor)
+        return sk
+
+    def merge(self, other: "SpaceSaving") -> None:
+        """Слияние скетчей двух частей потока: чего нет в одном, оценивается его floor
+        (оценка сверху, как у самого Space-Saving); ошибки складываются."""
+        counts = self.counts
+        for k in counts.keys() - other.counts.keys():
+            counts[k] += other.floor
+        for k, c in other.counts.items():
+            counts[k] = counts.get(k, self.floor) + c
+        self.floor += other.floor
+        if len(counts) > self.capacity:
+            self._prune()
+
+
+@lru_cache(maxsize=65536)
+def _is_swear(word: str) -> bool:
+    # словарь чата маленький: регулярка — один раз на слово, дальше из кэша
+    return SWEAR_RE.search(word) is not None
+
+
+class OnlineStyleProfile:
+    def __init__(self, *, capacity: int = 5000, small_capacity: int = 200) -> None:
+        self.capacity = capacity
+        self.small_capacity = small_capacity
+        self.messages = 0
+        self.chars = 0
+        self.n_words = 0
+        self.n_emoji = 0
+        self.swear_tokens = 0
+        self.swear_messages = 0
+        self.lengths: Counter = Counter()
+        self.punct: Counter = Counter()
+        self.words = SpaceSaving(capacity)
+        self.bigrams = SpaceSaving(capacity)
+        self.emoji = SpaceSaving(small_capacity)
+        self.authors = SpaceSaving(small_capacity)
+        self.seeded_messages = 0  # сколько сообщений пришло из полного прохода (build_style_profile.py)
+        self.dirty = False
+
+    def add(self, author: str | None, text: str) -> None:
+        t = " ".join((text or "").split())
+        if not t:
+            return
+        self.messages += 1
+        self.chars += len(t)
+        self.lengths[min(len(t), MAX_LEN_BUCKET)] += 1
+        self.authors.add(author or "кто-то")
+
+        ws = WORD_RE.findall(t.lower())
+        self.n_words += len(ws)
+        self.words.update(ws)
+        self.bigrams.update(map(" ".join, zip(ws, ws[1:])))
+        self.swear_tokens += sum(1 for w in ws if _is_swear(w))
+
+        ems = EMOJI_RE.findall(t)
+        self.n_emoji += len(ems)
+        self.emoji.update(ems)
+
+        if SWEAR_RE.search(t):
+            self.swear_messages += 1
+
+        self.punct.update(PUNCT_RE.findall(t))
+        self.dirty = True
+
+    def profile(self, *, force_swear_ratio: float | None = None) -> dict[str, Any]:
+        return make_profile(
+            messages=self.messages,
+            chars=self.chars,
+            median_chars=median_from_hist(self.lengths, self.messages) if self.messages else 0,
+            n_words=self.n_words,
+            n_emoji=self.n_emoji,
+            swear_tokens=self.swear_tokens,
+            swear_messages=self.swear_messages,
+            by_author=self.authors.most_common(6),
+            words=self.words.most_common(80),
+            bigrams=self.bigrams.most_common(20),
+            emoji=self.emoji.most_common(15),
+            punct=self.punct.most_common(10),
+            force_swear_ratio=force_swear_ratio,
+        )
+
+    # ---------- состояние ----------
+
+    def to_state(self) -> dict[str, Any]:
+        return {
+            "version": STATE_VERSION,
+            "messages": self.messages,
+            "chars": self.chars,
+            "n_words": self.n_words,
+            "n_emoji": self.n_emoji,
+            "swear_tokens": self.swear_tokens,
+            "swear_messages": self.swear_messages,
+            "seeded_messages": self.seeded_messages,
+            # ключи JSON — строки
+            "lengths": {str(k): v for k, v in self.lengths.items()},
+            "punct": dict(self.punct),
+            "words": self.words.to_state(),
+            "bigrams": self.bigrams.to_state(),
+            "emoji": self.emoji.to_state(),
+            "authors": self.authors.to_state(),
+        }
+
+    @classmethod
+    def from_state(cls, state: dict[str, Any], *, capacity: int = 5000, small_capacity: int = 200) -> "OnlineStyleProfile":
+        p = cls(capacity=capacity, small_capacity=small_capacity)
+        if state.get("version") != STATE_VERSION:
+            log.warning(f"style online: state version {state.get('version')} != {STATE_VERSION}, starting empty")
+            return p
+        for k in ("messages", "chars", "n_words", "n_emoji", "swear_tokens", "swear_messages", "seeded_messages"):
+            setattr(p, k, int(state.get(k, 0)))
+        p.lengths = Counter({int(k): int(v) for k, v in state.get("lengths", {}).items()})
+        p.punct = Counter({str(k): int(v) for k, v in state.get("punct", {}).items()})
+        p.words = SpaceSaving.from_state(capacity, state.get("words"))
+        p.bigrams = SpaceSaving.from_state(capacity, state.get("bigrams"))
+        p.emoji = SpaceSaving.from_state(small_capacity, state.get("emoji"))
+        p.authors = SpaceSaving.from_state(small_capacity, state.get("authors"))
+        return p
+
+    @classmethod
+    def load(cls, path: str, **kw) -> "OnlineStyleProfile":
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return cls(**kw)
+        except Exception as e:
+            log.warning(f"style online: can't read {path}: {e}, starting empty")
+            return cls(**kw)
+        return cls.from_state(state, **kw)
+
+
+def save_state(path: str, state: dict[str, Any]) -> None:
+    write_json_atomic(path, state)
+
+
+class StyleProfileUpdater:
+    """Фоновая задача: раз в every_sec сохраняет состояние и перерисовывает style-блок."""
+
+    def __init__(
+        self,
+        profile: OnlineStyleProfile,
+        *,
+        state_path: str,
+        every_sec: float = 300.0,
+        min_messages: int = 500,
+        force_swear_ratio: float | None = None,
+        style_path: str = STYLE_PATH,
+    ) -> None:
+        self.profile = profile
+        self.state_path = state_path
+        self.style_path = style_path
+        self.every_sec = max(1.0, every_sec)
+        self.min_messages = min_messages
+        self.force_swear_ratio = force_swear_ratio
+        self._task: asyncio.Task | None = None
+        self._warned_unseeded = False
+
+    def _may_render(self) -> bool:
+        p = self.profile
+        if p.messages < self.min_messages:
+            return False
+        if p.seeded_messages or not os.path.exists(self.style_path):
+            return True
+        # style из полного прохода есть, а онлайн-профиль начат с нуля — не затираем
+        if not self._warned_unseeded:
+            self._warned_unseeded = True
+            log.warning(
+                f"style online: {self.state_path} is not seeded from the full history, keeping {self.style_path}; "
+                f"run scripts/build_style_profile.py once to seed it and enable live updates"
+            )
+        return False
+
+    async def flush(self) -> None:
+        p = self.profile
+        if not p.dirty:
+            return
+        # снимок — в потоке цикла (add() идёт там же), запись файлов — в отдельном потоке
+        state = p.to_state()
+        profile = p.profile(force_swear_ratio=self.force_swear_ratio) if self._may_render() else None
+        # сброс — до записи: add() во время записи снова пометит профиль;
+        # запись упала — возвращаем флаг, следующий тик повторит её и без новых сообщений
+        p.dirty = False
+        try:
+            await asyncio.to_thread(self._write, state, profile)
+        except BaseException:
+            p.dirty = True
+            raise
+
+    def _write(self, state: dict[str, Any], profile: dict[str, Any] | None) -> None:
+        save_state(self.state_path, state)
+        if profile is not None:
+            write_artifacts(profile, style_path=self.style_path)
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.every_sec)
+            try:
+                await self.flush()
+            except Exception as e:
+                log.warning(f"style online flush error: {e}")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            log.warning(f"style online flush error: {e}")
+
@@ -1,13 +1,40 @@
-import orjson
+"""Чтение экспорта Telegram (result.json) потоком.
+
+Экспорт большого чата — гигабайты, а json.load/orjson.loads требуют в
+памяти весь файл и ещё в разы больше на объекты. Здесь файл читается
+кусками по chunk_size, и из каждого куска разбираются orjson только целые
+сообщения массива "messages". В памяти — текущий кусок плюс недочитанное
+сообщение, первые сообщения отдаются до того, как файл дочитан.
+"""
+import re
 from dataclasses import dataclass
+from typing import Iterator
+
+import orjson
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+# шапка: строка JSON целиком (group 1 — закрывающая кавычка; нет её — строка оборвана концом куска) или скобка
+_TOKEN_RX = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*(")?|[{}\[\]]')
+# внутри messages нужны только скобки: всё до следующей (включая целые строки) пропускается
+# одним match; group 1 — скобка или кавычка недочитанной строки
+_SKIP_RX = re.compile(rb'[^"{}\[\]]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"{}\[\]]*)*([{}\[\]"])')
+# граница между сообщениями-кандидат: "}," перед "{"
+_BOUNDARY_RX = re.compile(rb'\}\s*,\s*(?=\{)')
+_LEAD = b", \t\r\n"
 
-@dataclass
+
+@dataclass(slots=True)
 class ExportedMsg:
     chat_title: str | None
     user_id: int | None
     username: str | None
     text: str
     created_at: str | None
+    msg_id: int | None = None
+    from_id: str | None = None
+    ts: float | None = None  # date_unixtime
+
 
 def _text_field_to_str(text_field) -> str:
     # Telegram export JSON: text может быть string или массивом частей
@@ -18,42 +45,146 @@ def _text_field_to_str(text_field) -> str:
         for p in text_field:
             if isinstance(p, str):
                 parts.append(p)
-            elif isinstance(p, dict) and "text" in p:
-                parts.append(str(p["text"]))
+            elif isinstance(p, dict):
+                # бывает {"type":"text","text":"..."} или {"type":"custom_emoji","text":"..."}
+                parts.append(str(p.get("text") or p.get("content") or ""))
         return "".join(parts)
     return ""
 
+
+def _last_boundary(buf: bytes) -> re.Match | None:
+    # ищем с конца: сначала в хвосте, при неудаче — во всём буфере
+    for start in (max(0, len(buf) - 65536), 0):
+        last = None
+        for last in _BOUNDARY_RX.finditer(buf, start):
+            pass
+        if last is not None or start == 0:
+            return last
+    return None
+
+
+def iter_tg_export_raw(path: str, *, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[tuple[dict, dict]]:
+    """(шапка экспорта без messages, сырой dict сообщения) — по одному, не читая файл целиком.
+
+    Быстрый путь: всё до последней границы "},{" в буфере разбирается одним
+    orjson.loads как массив. Если граница ложная (внутри строки или вложенного
+    объекта), такой кусок гарантированно не валиден — тогда по скобкам."""
+    header: dict | None = None
+    buf = b""
+    depth = 0
+    last_key = b""     # последняя строка на уровне корня: ищем ключ "messages"
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            buf += chunk
+
+            if header is None:
+                pos = 0
+                for m in _TOKEN_RX.finditer(buf):
+                    tok = m.group()
+                    if tok[:1] == b'"':
+                        if m.group(1) is None:
+                            break  # строка оборвана концом куска — дочитаем
+                        if depth == 1:
+                            last_key = tok
+                    elif tok in b"{[":
+                        depth += 1
+                        if tok == b"[" and depth == 2 and last_key == b'"messages"':
+                            # всё до "[" плюс "]}" — валидный JSON корня без сообщений
+                            header = orjson.loads(buf[:m.end()] + b"]}")
+                            pos = m.end()
+                            break
+                    else:
+                        depth -= 1
+                if header is None:
+                    if not chunk:
+                        return
+                    depth, last_key = 0, b""  # шапка маленькая: перечитаем её целиком с новым куском
+                    continue
+                buf = buf[pos:]
+
+            # buf начинается на границе сообщений (глубина 2)
+            if chunk:
+                cut = _last_boundary(buf)
+                if cut is not None:
+                    try:
+                        items = orjson.loads(b"[" + buf[:cut.start() + 1].lstrip(_LEAD) + b"]")
+                    except orjson.JSONDecodeError:
+                        items = None
+                    if items is not None:
+                        for m in items:
+                            yield header, m
+                        buf = buf[cut.end():]
+                        continue
+
+            # медленный путь: по скобкам
+            depth, pos, obj_start = 2, 0, -1
+            while True:
+                m = _SKIP_RX.match(buf, pos)
+                if m is None or m.group(1) == b'"':
+                    break  # кусок кончился (или посреди строки) — дочитываем
+                c = m.group(1)
+                if c in b"{[":
+                    depth += 1
+                    if depth == 3 and c == b"{":
+                        obj_start = m.end() - 1
+                else:
+                    depth -= 1
+                    if depth == 2 and obj_start >= 0:
+                        yield header, orjson.loads(buf[obj_start:m.end()])
+                        obj_start = -1
+                    elif depth == 1:
+                        return  # массив messages закончился, остальное не нужно
+                pos = m.end()
+            if not chunk:
+                return
+            # в памяти остаётся только недочитанное сообщение
+            buf = buf[obj_start if obj_start >= 0 else pos:]
+
+
+def iter_tg_export(path: str, *, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[ExportedMsg]:
+    """Сообщения с текстом (type == "message") в порядке экспорта."""
+    for header, m in iter_tg_export_raw(path, chunk_size=chunk_size):
+        msg = exported_msg(m, header.get("name"))
+        if msg is not None:
+            yield msg
+
+
+def exported_msg(m: dict, chat_title: str | None) -> ExportedMsg | None:
+    if m.get("type") != "message":
+        return None
+    text = _text_field_to_str(m.get("text", ""))
+    text = (text or "").strip()
+    if not text:
+        return None
+
+    # from_id часто "user123456", либо None
+    uid = None
+    from_id = m.get("from_id")
+    if isinstance(from_id, str) and from_id.startswith("user"):
+        try:
+            uid = int(from_id.replace("user", ""))
+        except Exception:
+            uid = None
+
+    ts = None
+    if m.get("date_unixtime"):
+        try:
+            ts = float(m["date_unixtime"])
+        except (TypeError, ValueError):
+            ts = None
+
+    return ExportedMsg(
+        chat_title=chat_title,
+        user_id=uid,
+        username=m.get("from"),
+        text=text,
+        created_at=m.get("date"),
+        msg_id=m.get("id"),
+        from_id=from_id if isinstance(from_id, str) else None,
+        ts=ts,
+    )
+
+
 def parse_tg_export_json(path: str) -> list[ExportedMsg]:
-    raw = open(path, "rb").read()
-    data = orjson.loads(raw)
-
-    chat_title = data.get("name")
-    messages = data.get("messages", [])
-    out: list[ExportedMsg] = []
-
-    for m in messages:
-        if m.get("type") != "message":
-            continue
-        text = _text_field_to_str(m.get("text", ""))
-        text = (text or "").strip()
-        if not text:
-            continue
-
-        # from_id часто "user123456", либо None
-        uid = None
-        from_id = m.get("from_id")
-        if isinstance(from_id, str) and from_id.startswith("user"):
-            try:
-                uid = int(from_id.replace("user", ""))
-            except Exception:
-                uid = None
-
-        out.append(ExportedMsg(
-            chat_title=chat_title,
-            user_id=uid,
-            username=m.get("from"),
-            text=text,
-            created_at=m.get("date"),
-        ))
-
-    return out
+    return list(iter_tg_export(path))
@@ -0,0 +1,315 @@
+"""Подсчёт токенов промпта под конкретную модель.
+
+Старая оценка «4 символа = токен» для кириллицы врёт в 1.5–2 раза, из-за
+этого промпт не влезал в OPENROUTER_PROMPT_BUDGET_TOKENS и ловили 402.
+
+Токенайзер выбирается по модели (TOKENIZER_BACKEND=auto):
+  1. HF tokenizer.json из TOKENIZER_DIR (`meta-llama__llama-3.1-70b-instruct.json`,
+     нужен пакет tokenizers) — точный подсчёт;
+  2. tiktoken — точный для openai/*, для остальных близкая оценка с запасом
+     TOKENIZER_SAFETY_MARGIN;
+  3. эвристика по алфавитам (тоже с запасом), если ничего нет.
+
+Контекст чата — одни и те же строки из ответа в ответ, поэтому считаем
+построчно и кэшируем число токенов строки (LRU по хэшу строки).
+
+Первая загрузка tiktoken-кодировки идёт в сеть: в потоке event loop она не
+выполняется. Бот грузит токенайзеры при старте (preload), а если модель
+всё же спросили раньше — до конца фоновой загрузки считаем эвристикой.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Iterable, Sequence
+
+from .settings import settings
+
+log = logging.getLogger(__name__)
+
+# служебные токены чат-шаблона на одно сообщение (роль, разделители) и на ответ
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 3
+
+_CYR_RX = re.compile(r"[А-Яа-яЁё]")
+_WORD_RX = re.compile(r"[A-Za-z0-9]")
+
+
+class Tokenizer:
+    name = "base"
+    exact = False
+
+    def _count(self, text: str) -> int:
+        raise NotImplementedError
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        n = self._count(text)
+        if not self.exact:
+            n = math.ceil(n * float(getattr(settings, "TOKENIZER_SAFETY_MARGIN", 1.15)))
+        return n
+
+
+class HeuristicTokenizer(Tokenizer):
+    """Грубо, но с запасом: кириллица ~2.2 символа на токен, латиница/цифры ~3.5,
+    прочие непробельные (пунктуация, эмодзи) — по токену."""
+
+    name = "heuristic"
+
+    def _count(self, text: str) -> int:
+        cyr = len(_CYR_RX.findall(text))
+        lat = len(_WORD_RX.findall(text))
+        other = len(text) - cyr - lat - text.count(" ")
+        return max(1, math.ceil(cyr / 2.2) + math.ceil(lat / 3.5) + max(0, other))
+
+
+class TiktokenTokenizer(Tokenizer):
+    def __init__(self, enc, *, exact: bool) -> None:
+        self._enc = enc
+        self.name = f"tiktoken:{enc.name}"
+        self.exact = exact
+
+    def _count(self, text: str) -> int:
+        return len(self._enc.encode_ordinary(text))
+
+
+class HFTokenizer(Tokenizer):
+    exact = True
+
+    def __init__(self, tok, name: str) -> None:
+        self._tok = tok
+        self.name = f"hf:{name}"
+
+    def _count(self, text: str) -> int:
+        return len(self._tok.encode(text, add_special_tokens=False).ids)
+
+
+_heuristic = HeuristicTokenizer()
+
+
+def _hf_path(model: str) -> str | None:
+    d = str(getattr(settings, "TOKENIZER_DIR", os.path.join("artifacts", "tokenizers")))
+    if not model or not os.path.isdir(d):
+        return None
+    p = os.path.join(d, model.replace("/", "__").replace(":", "_") + ".json")
+    return p if os.path.exists(p) else None
+
+
+def _load_hf(model: str) -> Tokenizer | None:
+    p = _hf_path(model)
+    if not p:
+        return None
+    try:
+        from tokenizers import Tokenizer as _HFTok  # необязательная зависимость
+    except ImportError:
+        log.warning(f"tokenizer file {p} found, but 'tokenizers' is not installed")
+        return None
+    try:
+        return HFTokenizer(_HFTok.from_file(p), os.path.basename(p))
+    except Exception as e:
+        log.warning(f"hf tokenizer load error {p}: {e}")
+        return None
+
+
+def _load_tiktoken(model: str) -> Tokenizer | None:
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    # openai/gpt-4o-mini -> gpt-4o-mini; для прочих моделей — ближайшая кодировка
+    name = model.split("/", 1)[1] if model.startswith("openai/") else model
+    try:
+        if "/" not in model or model.startswith("openai/"):
+            try:
+                return TiktokenTokenizer(tiktoken.encoding_for_model(name), exact=True)
+            except KeyError:
+                pass
+        enc_name = str(getattr(settings, "TOKENIZER_TIKTOKEN_ENCODING", "cl100k_base"))
+        return TiktokenTokenizer(tiktoken.get_encoding(enc_name), exact=False)
+    except Exception as e:
+        # первая загрузка кодировки идёт в сеть; без неё — эвристика
+        log.warning(f"tiktoken load error for {model!r}: {e}")
+        return None
+
+
+_loaded: dict[str, Tokenizer] = {}
+_loading: set[str] = set()
+_load_lock = threading.Lock()
+
+
+def _load(model: str) -> Tokenizer:
+    backend = str(getattr(settings, "TOKENIZER_BACKEND", "auto")).lower()
+    tok: Tokenizer | None = None
+    if backend in ("auto", "hf"):
+        tok = _load_hf(model)
+    if tok is None and backend in ("auto", "tiktoken"):
+        tok = _load_tiktoken(model)
+    if tok is None:
+        tok = _heuristic
+    log.info(f"tokenizer for {model or 'default'!r}: {tok.name}{'' if tok.exact else ' (approx)'}")
+    return tok
+
+
+def _load_into_cache(model: str) -> Tokenizer:
+    tok = _load(model)
+    with _load_lock:
+        _loaded[model] = tok
+        _loading.discard(model)
+    return tok
+
+
+def _in_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def get_tokenizer(model: str = "") -> Tokenizer:
+    tok = _loaded.get(model)
+    if tok is not None:
+        return tok
+    if not _in_event_loop():
+        return _load_into_cache(model)
+    # в потоке event loop сеть не трогаем: грузим в фоне, пока — эвристика (она с запасом)
+    with _load_lock:
+        if model in _loaded:
+            return _loaded[model]
+        start = model not in _loading
+        _loading.add(model)
+    if start:
+        threading.Thread(target=_load_into_cache, args=(model,), name="tokenizer-load", daemon=True).start()
+    return _heuristic
+
+
+async def preload(models: Iterable[str]) -> None:
+    """Загрузить токенайзеры моделей заранее (при старте бота), не блокируя event loop."""
+    for m in dict.fromkeys(models):
+        if m not in _loaded:
+            await asyncio.to_thread(_load_into_cache, m)
+
+
+class _LineCountCache:
+    """LRU: (токенайзер, хэш строки, длина) -> число токенов."""
+
+    def __init__(self, max_items: int) -> None:
+        self.max_items = max(0, max_items)
+        self._d: OrderedDict[tuple[str, int, int], int] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, tok: Tokenizer, line: str) -> int:
+        if not line:
+            return 0
+        key = (tok.name, hash(line), len(line))
+        n = self._d.get(key)
+        if n is not None:
+            self._d.move_to_end(key)
+            self.hits += 1
+            return n
+        self.misses += 1
+        n = tok.count(line)
+        if self.max_items:
+            self._d[key] = n
+            if len(self._d) > self.max_items:
+                self._d.popitem(last=False)
+        return n
+
+    def stats(self) -> dict[str, int]:
+        return {"items": len(self._d), "hits": self.hits, "misses": self.misses}
+
+
+_cache = _LineCountCache(int(getattr(settings, "TOKEN_CACHE_SIZE", 20000)))
+
+
+def token_cache_stats() -> dict[str, int]:
+    return _cache.stats()
+
+
+def _tokenizers(models: str | Sequence[str]) -> list[Tokenizer]:
+    if isinstance(models, str):
+        models = [models]
+    seen: dict[str, Tokenizer] = {}
+    for m in models or [""]:
+        tok = get_tokenizer(m)
+        seen.setdefault(tok.name, tok)
+    return list(seen.values())
+
+
+def _line_tokens(toks: list[Tokenizer], line: str) -> int:
+    # промпт должен влезть в любую из моделей фоллбека — берём максимум
+    return max(_cache.count(t, line) for t in toks)
+
+
+def count_tokens(text: str, models: str | Sequence[str] = "") -> int:
+    """Токены текста: сумма по строкам + по токену на перевод строки (оценка сверху)."""
+    if not text:
+        return 0
+    toks = _tokenizers(models)
+    lines = text.split("\n")
+    return sum(_line_tokens(toks, ln) for ln in lines) + len(lines) - 1
+
+
+def messages_tokens(messages: Iterable[dict], models: str | Sequence[str] = "") -> int:
+    total = REPLY_PRIMING_TOKENS
+    for m in messages:
+        total += MESSAGE_OVERHEAD_TOKENS
+        content = m.get("content")
+        if isinstance(content, str):
+            total += count_tokens(content, models)
+        elif isinstance(content, list):
+            for part in content:
+                if isinstance(part, dict) and part.get("type") == "text":
+                    total += count_tokens(str(part.get("text", "")), models)
+    return total
+
+
+def truncate_by_tokens(text: str, max_tokens: int, models: str | Sequence[str] = "", *, keep: str = "tail") -> str:
+    """Обрезает текст до max_tokens целыми строками.
+
+    keep="tail" — оставляем последние (самые свежие) строки контекста,
+    keep="head" — начало (для длинного сообщения пользователя). Если не влезает
+    даже одна строка — режем её посимвольно (бинпоиск по длине).
+    """
+    if not text or max_tokens <= 0:
+        return ""
+    toks = _tokenizers(models)
+    lines = text.split("\n")
+    if keep == "tail":
+        lines.reverse()
+
+    kept: list[str] = []
+    used = 0
+    for ln in lines:
+        n = _line_tokens(toks, ln) + (1 if kept else 0)
+        if used + n > max_tokens:
+            if not kept:
+                kept.append(_cut_line(toks, ln, max_tokens, keep))
+            break
+        kept.append(ln)
+        used += n
+
+    if keep == "tail":
+        kept.reverse()
+    return "\n".join(kept).strip()
+
+
+def _cut_line(toks: list[Tokenizer], line: str, max_tokens: int, keep: str) -> str:
+    def piece(n: int) -> str:
+        return line[-n:] if keep == "tail" else line[:n]
+
+    lo, hi = 0, len(line)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if max(t.count(piece(mid)) for t in toks) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return piece(lo) if lo else ""
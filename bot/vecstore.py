@@ -0,0 +1,652 @@
+"""Встроенное векторное хранилище: альтернатива Qdrant для маленьких установок.
+
+Один чат — это сотни тысяч векторов, ради них не обязательно держать
+отдельный контейнер. Здесь всё в процессе:
+
+  <root>/<collection>/
+      manifest.json             размерность, список сегментов
+      seg_000001.vec.npy        int8, mmap: нормализованная строка / scale (cosine = dot * scale)
+      seg_000001.scale.npy      float32, масштаб строки
+      seg_000001.ids.json       id точек по строкам
+      seg_000001.cols.npz       числовые поля payload для фильтров (chat_id, ts), NaN = нет поля
+      seg_000001.payload.jsonl  payload построчно + .offsets.npy (читаем только найденные строки)
+      seg_000001.ivf.npz        центроиды IVF и границы списков (строки сегмента отсортированы по спискам)
+      seg_000001.del.npy        tombstones: удалённые строки и перезаписанные новым upsert
+
+Новые точки копятся в памяти и сбрасываются отдельным сегментом (append-only).
+compact() сливает сегменты в один, выкидывая удалённые строки, и заново
+строит IVF. Поиск — векторизованный перебор (по кускам) или IVF по nprobe
+ближайшим спискам; фильтр понимает подмножество qdrant Filter
+(must/should/must_not, MatchValue, Range, IsEmpty) по индексируемым полям.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+from typing import Any, Iterable
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+_CHUNK_ROWS = 4096
+
+
+class Hit:
+    __slots__ = ("id", "score", "payload")
+
+    def __init__(self, id: Any, score: float, payload: dict | None) -> None:
+        self.id = id
+        self.score = score
+        self.payload = payload
+
+
+def _normalize(m: np.ndarray) -> np.ndarray:
+    m = np.asarray(m, dtype=np.float32)
+    norms = np.linalg.norm(m, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return m / norms
+
+
+def _quantize(m: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Построчное int8-квантование: int8 в 2 раза меньше float16 и в разы быстрее
+    переводится во float32 на поиске (float16 у numpy конвертируется без SIMD)."""
+    amax = np.abs(m).max(axis=1)
+    amax[amax == 0] = 1.0
+    scale = (amax / 127.0).astype(np.float32)
+    return np.rint(m / scale[:, None]).astype(np.int8), scale
+
+
+def _write_json(path: str, data: Any) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _kmeans(sample: np.ndarray, k: int, iters: int = 8, seed: int = 0) -> np.ndarray:
+    """Сферический k-means (векторы нормализованы): центроиды тоже нормализуем."""
+    rng = np.random.default_rng(seed)
+    cent = sample[rng.choice(len(sample), size=k, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(sample @ cent.T, axis=1)
+        sums = np.zeros_like(cent)
+        np.add.at(sums, assign, sample)
+        empty = np.bincount(assign, minlength=k) == 0
+        # пустые списки пересеиваем случайными точками
+        sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+        cent = _normalize(sums)
+    return cent
+
+
+# ---------- фильтр ----------
+
+def _cond_mask(cond: Any, cols: dict[str, np.ndarray], n: int) -> np.ndarray:
+    # вложенный Filter
+    if hasattr(cond, "must") and hasattr(cond, "should"):
+        return _filter_mask(cond, cols, n)
+    is_empty = getattr(cond, "is_empty", None)
+    if is_empty is not None:
+        col = _column(cols, is_empty.key)
+        return np.isnan(col)
+    key = getattr(cond, "key", None)
+    if key is None:
+        raise NotImplementedError(f"vecstore filter: unsupported condition {type(cond).__name__}")
+    col = _column(cols, key)
+    match = getattr(cond, "match", None)
+    rng = getattr(cond, "range", None)
+    if match is not None:
+        value = getattr(match, "value", None)
+        if value is None or isinstance(value, str):
+            raise NotImplementedError("vecstore filter: only numeric MatchValue is supported")
+        return col == float(value)
+    if rng is not None:
+        m = ~np.isnan(col)
+        if rng.lt is not None:
+            m &= col < rng.lt
+        if rng.lte is not None:
+            m &= col <= rng.lte
+        if rng.gt is not None:
+            m &= col > rng.gt
+        if rng.gte is not None:
+            m &= col >= rng.gte
+        return m
+    raise NotImplementedError(f"vecstore filter: unsupported field condition on {key!r}")
+
+
+def _column(cols: dict[str, np.ndarray], key: str) -> np.ndarray:
+    col = cols.get(key)
+    if col is None:
+        raise NotImplementedError(f"vecstore filter: field {key!r} is not indexed")
+    return col
+
+
+def _filter_mask(flt: Any, cols: dict[str, np.ndarray], n: int) -> np.ndarray:
+    mask = np.ones(n, dtype=bool)
+    for c in flt.must or []:
+        mask &= _cond_mask(c, cols, n)
+    if flt.should:
+        any_m = np.zeros(n, dtype=bool)
+        for c in flt.should:
+            any_m |= _cond_mask(c, cols, n)
+        mask &= any_m
+    for c in flt.must_not or []:
+        mask &= ~_cond_mask(c, cols, n)
+    return mask
+
+
+# ---------- сегмент ----------
+
+class _Segment:
+    def __init__(self, base: str) -> None:
+        self.base = base
+        self.vecs: np.ndarray = np.load(base + ".vec.npy", mmap_mode="r")
+        self.scale: np.ndarray = np.load(base + ".scale.npy")
+        with open(base + ".ids.json", "r", encoding="utf-8") as f:
+            self.ids: list[Any] = json.load(f)
+        with np.load(base + ".cols.npz") as z:
+            self.cols = {k: z[k] for k in z.files}
+        self.offsets: np.ndarray = np.load(base + ".offsets.npy")
+        self.centroids: np.ndarray | None = None
+        self.bounds: np.ndarray | None = None
+        if os.path.exists(base + ".ivf.npz"):
+            with np.load(base + ".ivf.npz") as z:
+                self.centroids = z["centroids"]
+                self.bounds = z["bounds"]
+        self.deleted = np.zeros(len(self.ids), dtype=bool)
+        if os.path.exists(base + ".del.npy"):
+            self.deleted = np.load(base + ".del.npy").copy()
+        self.dirty = False
+        # search() читает payload после снятия блокировки коллекции: файлы сегмента,
+        # выведенного compact(), удаляет последний такой читатель (под блокировкой коллекции)
+        self.readers = 0
+        self.retired = False
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def live(self) -> int:
+        return len(self.ids) - int(self.deleted.sum())
+
+    def payloads(self, rows: Iterable[int]) -> list[dict]:
+        out = []
+        with open(self.base + ".payload.jsonl", "rb") as f:
+            for r in rows:
+                f.seek(int(self.offsets[r]))
+                out.append(json.loads(f.readline()))
+        return out
+
+    def raw_payloads(self, rows: np.ndarray, f=None) -> list[bytes]:
+        if f is None:
+            with open(self.base + ".payload.jsonl", "rb") as f:
+                return self.raw_payloads(rows, f)
+        out = []
+        for r in rows:
+            f.seek(int(self.offsets[r]))
+            out.append(f.readline())
+        return out
+
+    def save_deleted(self) -> None:
+        if self.dirty:
+            # через tmp + replace: упали посреди записи — остаётся прежний файл, а не битый
+            tmp = self.base + ".del.npy.tmp"
+            with open(tmp, "wb") as f:
+                np.save(f, self.deleted)
+            os.replace(tmp, self.base + ".del.npy")
+            self.dirty = False
+
+    def remove_files(self) -> None:
+        for ext in (".vec.npy", ".scale.npy", ".ids.json", ".cols.npz", ".offsets.npy", ".payload.jsonl", ".ivf.npz", ".del.npy", ".del.npy.tmp"):
+            try:
+                os.remove(self.base + ext)
+            except FileNotFoundError:
+                pass
+
+    def search(self, q: np.ndarray, nprobe: int, mask_fn) -> tuple[np.ndarray, np.ndarray]:
+        """(строки, скоры) кандидатов: живые, прошедшие фильтр."""
+        n = len(self.ids)
+        if self.centroids is not None and self.bounds is not None and nprobe < len(self.centroids):
+            lists = np.argpartition(-(self.centroids @ q), nprobe)[:nprobe]
+            spans = [(int(self.bounds[i]), int(self.bounds[i + 1])) for i in lists]
+        else:
+            spans = [(s, min(n, s + _CHUNK_ROWS)) for s in range(0, n, _CHUNK_ROWS)]
+        rows_l, scores_l = [], []
+        buf = np.empty((_CHUNK_ROWS, self.vecs.shape[1]), dtype=np.float32)
+        for a, b in spans:
+            # длинный список IVF режем на куски: int8 -> float32 в переиспользуемый буфер
+            for c in range(a, b, _CHUNK_ROWS):
+                d = min(b, c + _CHUNK_ROWS)
+                np.copyto(buf[:d - c], self.vecs[c:d], casting="unsafe")
+                rows_l.append(np.arange(c, d))
+                scores_l.append((buf[:d - c] @ q) * self.scale[c:d])
+        if not rows_l:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows = np.concatenate(rows_l)
+        scores = np.concatenate(scores_l)
+        keep = ~self.deleted[rows]
+        fmask = mask_fn(self.cols, n)
+        if fmask is not None:
+            keep &= fmask[rows]
+        return rows[keep], scores[keep]
+
+
+def _write_segment(
+    base: str,
+    *,
+    dim: int,
+    total: int,
+    take,
+    ids: list[Any],
+    payloads,
+    cols: dict[str, np.ndarray],
+    ivf_min_rows: int,
+) -> None:
+    """take(idx) -> float32 нормализованные строки по «глобальным» индексам источника,
+    payloads(idx) -> строки payload.jsonl по тем же индексам (читаются кусками, не все сразу)."""
+    order = np.arange(total)
+    centroids = bounds = None
+    if total >= ivf_min_rows:
+        nlist = max(8, int(np.sqrt(total)))
+        rng = np.random.default_rng(0)
+        sample_idx = np.sort(rng.choice(total, size=min(total, max(nlist * 40, 20000)), replace=False))
+        centroids = _kmeans(take(sample_idx), nlist)
+        assign = np.empty(total, dtype=np.int32)
+        for a in range(0, total, _CHUNK_ROWS):
+            idx = np.arange(a, min(total, a + _CHUNK_ROWS))
+            assign[a:a + len(idx)] = np.argmax(take(idx) @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(nlist + 1)).astype(np.int64)
+
+    vec = np.lib.format.open_memmap(base + ".vec.npy", mode="w+", dtype=np.int8, shape=(total, dim))
+    scale = np.empty(total, dtype=np.float32)
+    for a in range(0, total, _CHUNK_ROWS):
+        idx = order[a:a + _CHUNK_ROWS]
+        vec[a:a + len(idx)], scale[a:a + len(idx)] = _quantize(take(idx))
+    vec.flush()
+    del vec
+    np.save(base + ".scale.npy", scale)
+
+    _write_json(base + ".ids.json", [ids[i] for i in order])
+    np.savez(base + ".cols.npz", **{k: v[order] for k, v in cols.items()})
+    offsets = np.empty(total, dtype=np.int64)
+    with open(base + ".payload.jsonl", "wb") as f:
+        pos = 0
+        for a in range(0, total, _CHUNK_ROWS):
+            for j, line in enumerate(payloads(order[a:a + _CHUNK_ROWS]), a):
+                offsets[j] = pos
+                f.write(line)
+                pos += len(line)
+    np.save(base + ".offsets.npy", offsets)
+    if centroids is not None:
+        np.savez(base + ".ivf.npz", centroids=centroids.astype(np.float32), bounds=bounds)
+
+
+# ---------- коллекция ----------
+
+class VectorCollection:
+    def __init__(
+        self,
+        path: str,
+        dim: int,
+        *,
+        segment_rows: int = 50000,
+        ivf_min_rows: int = 20000,
+        nprobe: int = 16,
+        indexed_keys: tuple[str, ...] = ("chat_id", "ts"),
+        max_segments: int = 8,
+    ) -> None:
+        self.path = path
+        self.segment_rows = max(1, segment_rows)
+        self.ivf_min_rows = ivf_min_rows
+        self.nprobe = max(1, nprobe)
+        self.indexed_keys = indexed_keys
+        self.max_segments = max_segments
+        self._lock = threading.RLock()
+
+        os.makedirs(path, exist_ok=True)
+        mpath = os.path.join(path, "manifest.json")
+        manifest = {"dim": dim, "segments": [], "next": 1}
+        if os.path.exists(mpath):
+            with open(mpath, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if int(manifest["dim"]) != dim:
+                raise ValueError(f"vecstore {path}: dim {manifest['dim']} != {dim}")
+        self.dim = dim
+        self._next = int(manifest.get("next", 1))
+        self.segments: list[_Segment] = [_Segment(os.path.join(path, s)) for s in manifest["segments"]]
+
+        # id -> (сегмент | None для буфера, строка)
+        self._where: dict[Any, tuple[_Segment | None, int]] = {}
+        for seg in self.segments:
+            for row, pid in enumerate(seg.ids):
+                if not seg.deleted[row]:
+                    self._where[pid] = (seg, row)
+
+        self._buf_vecs: list[np.ndarray] = []
+        self._buf_ids: list[Any] = []
+        self._buf_payloads: list[dict] = []
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def _save_manifest(self) -> None:
+        _write_json(
+            os.path.join(self.path, "manifest.json"),
+            {"dim": self.dim, "segments": [os.path.basename(s.base) for s in self.segments], "next": self._next},
+        )
+
+    def _new_base(self) -> str:
+        base = os.path.join(self.path, f"seg_{self._next:06d}")
+        self._next += 1
+        return base
+
+    def _cols(self, payloads: list[dict]) -> dict[str, np.ndarray]:
+        cols = {}
+        for k in self.indexed_keys:
+            col = np.full(len(payloads), np.nan, dtype=np.float64)
+            for i, p in enumerate(payloads):
+                v = p.get(k) if p else None
+                if isinstance(v, (int, float)) and not isinstance(v, bool):
+                    col[i] = float(v)
+            cols[k] = col
+        return cols
+
+    # ---------- запись ----------
+
+    def upsert(self, points: Iterable[Any]) -> int:
+        """points: объекты с .id/.vector/.payload (qdrant PointStruct подходит) или такие же dict."""
+        n = 0
+        with self._lock:
+            for p in points:
+                pid = p["id"] if isinstance(p, dict) else p.id
+                vec = p["vector"] if isinstance(p, dict) else p.vector
+                payload = (p.get("payload") if isinstance(p, dict) else p.payload) or {}
+                v = _normalize(np.asarray(vec, dtype=np.float32).reshape(-1))
+                if v.shape[0] != self.dim:
+                    raise ValueError(f"vector dim {v.shape[0]} != {self.dim}")
+                prev = self._where.get(pid)
+                if prev is not None:
+                    seg, row = prev
+                    if seg is None:
+                        self._buf_vecs[row] = v
+                        self._buf_payloads[row] = payload
+                        n += 1
+                        continue
+                    seg.deleted[row] = True
+                    seg.dirty = True
+                self._where[pid] = (None, len(self._buf_ids))
+                self._buf_vecs.append(v)
+                self._buf_ids.append(pid)
+                self._buf_payloads.append(payload)
+                n += 1
+                if len(self._buf_ids) >= self.segment_rows:
+                    self._seal()
+        return n
+
+    def delete(self, ids: Iterable[Any]) -> int:
+        n = 0
+        touched: set[_Segment] = set()
+        with self._lock:
+            for pid in ids:
+                prev = self._where.pop(pid, None)
+                if prev is None:
+                    continue
+                seg, row = prev
+                if seg is None:
+                    # из буфера: строка остаётся, при сбросе её выкинем
+                    self._buf_ids[row] = None
+                else:
+                    seg.deleted[row] = True
+                    seg.dirty = True
+                    touched.add(seg)
+                n += 1
+            # удаление должно пережить падение: tombstones — на диск сразу, а не при flush()
+            for seg in touched:
+                seg.save_deleted()
+        return n
+
+    def _seal(self) -> None:
+        self._write_buffer()
+        if len(self.segments) > self.max_segments:
+            self.compact()
+
+    def _write_buffer(self) -> None:
+        keep = [i for i, pid in enumerate(self._buf_ids) if pid is not None]
+        if keep:
+            mat = np.stack([self._buf_vecs[i] for i in keep])
+            ids = [self._buf_ids[i] for i in keep]
+            payloads = [self._buf_payloads[i] for i in keep]
+            lines = [(json.dumps(p, ensure_ascii=False) + "\n").encode("utf-8") for p in payloads]
+            base = self._new_base()
+            _write_segment(
+                base,
+                dim=self.dim,
+                total=len(ids),
+                take=lambda idx: mat[idx],
+                ids=ids,
+                payloads=lambda idx: [lines[i] for i in idx],
+                cols=self._cols(payloads),
+                ivf_min_rows=self.ivf_min_rows,
+            )
+            seg = _Segment(base)
+            self.segments.append(seg)
+            for row, pid in enumerate(seg.ids):
+                self._where[pid] = (seg, row)
+            self._save_manifest()
+            # новые версии перезаписанных точек теперь на диске — фиксируем tombstones старых
+            for s in self.segments:
+                s.save_deleted()
+        self._buf_vecs, self._buf_ids, self._buf_payloads = [], [], []
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._buf_ids:
+                self._seal()
+            for seg in self.segments:
+                seg.save_deleted()
+
+    def compact(self) -> None:
+        """Сливает все сегменты в один без удалённых строк и перестраивает IVF."""
+        with self._lock:
+            if self._buf_ids:
+                self._write_buffer()
+            old = self.segments
+            live_rows = [np.flatnonzero(~s.deleted) for s in old]
+            starts = np.cumsum([0] + [len(r) for r in live_rows])
+            total = int(starts[-1])
+            if total == 0:
+                self.segments = []
+                self._save_manifest()
+                self._retire(old)
+                return
+
+            def take(idx: np.ndarray) -> np.ndarray:
+                out = np.empty((len(idx), self.dim), dtype=np.float32)
+                which = np.searchsorted(starts, idx, side="right") - 1
+                for si in np.unique(which):
+                    sel = which == si
+                    rows = live_rows[si][idx[sel] - starts[si]]
+                    order = np.argsort(rows)
+                    got = old[si].vecs[rows[order]] * old[si].scale[rows[order], None]
+                    out[np.flatnonzero(sel)[order]] = got
+                return out
+
+            files: dict[int, Any] = {}
+
+            def payloads(idx: np.ndarray) -> list[bytes]:
+                # payload читаем из старых сегментов кусками по мере записи, а не весь сразу
+                out: list[bytes] = [b""] * len(idx)
+                which = np.searchsorted(starts, idx, side="right") - 1
+                for si in np.unique(which):
+                    si = int(si)
+                    f = files.get(si)
+                    if f is None:
+                        f = files[si] = open(old[si].base + ".payload.jsonl", "rb")
+                    pos = np.flatnonzero(which == si)
+                    rows = live_rows[si][idx[pos] - starts[si]]
+                    for j, line in zip(pos, old[si].raw_payloads(rows, f)):
+                        out[j] = line
+                return out
+
+            ids: list[Any] = []
+            cols = {k: [] for k in self.indexed_keys}
+            for s, rows in zip(old, live_rows):
+                ids.extend(s.ids[r] for r in rows)
+                for k in self.indexed_keys:
+                    cols[k].append(s.cols[k][rows])
+            base = self._new_base()
+            try:
+                _write_segment(
+                    base,
+                    dim=self.dim,
+                    total=total,
+                    take=take,
+                    ids=ids,
+                    payloads=payloads,
+                    cols={k: np.concatenate(v) for k, v in cols.items()},
+                    ivf_min_rows=self.ivf_min_rows,
+                )
+            finally:
+                for f in files.values():
+                    f.close()
+            seg = _Segment(base)
+            self.segments = [seg]
+            self._where = {pid: (seg, row) for row, pid in enumerate(seg.ids)}
+            self._save_manifest()
+            self._retire(old)
+            log.info(f"vecstore compacted {self.path}: {len(old)} segments -> 1, {total} rows")
+
+    def _retire(self, segments: list[_Segment]) -> None:
+        for s in segments:
+            s.retired = True
+            if not s.readers:
+                s.remove_files()
+
+    # ---------- поиск ----------
+
+    def search(
+        self,
+        query_vector: Any,
+        limit: int,
+        *,
+        query_filter: Any = None,
+        score_threshold: float | None = None,
+        nprobe: int | None = None,
+    ) -> list[Hit]:
+        q = _normalize(np.asarray(query_vector, dtype=np.float32).reshape(-1))
+        probe = int(nprobe or self.nprobe)
+
+        def mask_fn(cols: dict[str, np.ndarray], n: int) -> np.ndarray | None:
+            return None if query_filter is None else _filter_mask(query_filter, cols, n)
+
+        with self._lock:
+            segments = list(self.segments)
+            for seg in segments:
+                seg.readers += 1
+            buf = [(i, pid) for i, pid in enumerate(self._buf_ids) if pid is not None]
+            buf_vecs = np.stack([self._buf_vecs[i] for i, _ in buf]) if buf else None
+            buf_payloads = [self._buf_payloads[i] for i, _ in buf]
+            buf_ids = [pid for _, pid in buf]
+
+        try:
+            cands: list[tuple[float, _Segment | None, int]] = []
+            for seg in segments:
+                rows, scores = seg.search(q, probe, mask_fn)
+                cands.extend(_topk(rows, scores, limit, score_threshold, seg))
+            if buf_vecs is not None:
+                scores = buf_vecs @ q
+                rows = np.arange(len(buf_ids))
+                if query_filter is not None:
+                    keep = _filter_mask(query_filter, self._cols(buf_payloads), len(buf_ids))
+                    rows, scores = rows[keep], scores[keep]
+                cands.extend(_topk(rows, scores, limit, score_threshold, None))
+
+            cands.sort(key=lambda c: -c[0])
+            cands = cands[:limit]
+            out: list[Hit] = []
+            by_seg: dict[int, list[int]] = {}
+            for i, (_, seg, _) in enumerate(cands):
+                if seg is not None:
+                    by_seg.setdefault(id(seg), []).append(i)
+            payloads: dict[int, dict] = {}
+            for idxs in by_seg.values():
+                seg = cands[idxs[0]][1]
+                for i, p in zip(idxs, seg.payloads([cands[i][2] for i in idxs])):
+                    payloads[i] = p
+            for i, (score, seg, row) in enumerate(cands):
+                if seg is None:
+                    out.append(Hit(buf_ids[row], score, buf_payloads[row]))
+                else:
+                    out.append(Hit(seg.ids[row], score, payloads[i]))
+            return out
+        finally:
+            with self._lock:
+                for seg in segments:
+                    seg.readers -= 1
+                    if seg.retired and not seg.readers:
+                        seg.remove_files()
+
+    @property
+    def buffered(self) -> int:
+        """Точки в памяти, ещё не записанные в сегмент (пропадут при падении процесса)."""
+        with self._lock:
+            return sum(1 for pid in self._buf_ids if pid is not None)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "points": len(self._where),
+                "segments": len(self.segments),
+                "deleted": int(sum(int(s.deleted.sum()) for s in self.segments)),
+                "buffered": self.buffered,
+            }
+
+
+def _topk(rows: np.ndarray, scores: np.ndarray, k: int, threshold: float | None, seg) -> list[tuple[float, Any, int]]:
+    if threshold is not None:
+        keep = scores >= threshold
+        rows, scores = rows[keep], scores[keep]
+    if len(rows) > k:
+        part = np.argpartition(-scores, k)[:k]
+        rows, scores = rows[part], scores[part]
+    return [(float(s), seg, int(r)) for r, s in zip(rows, scores)]
+
+
+class LocalVectorStore:
+    """Набор коллекций в одном каталоге — то, что rag.py зовёт при VECTOR_BACKEND=local."""
+
+    def __init__(self, root: str, **collection_kwargs: Any) -> None:
+        self.root = root
+        self._kw = collection_kwargs
+        self._cols: dict[str, VectorCollection] = {}
+        self._lock = threading.Lock()
+
+    def collection_exists(self, name: str) -> bool:
+        return name in self._cols or os.path.exists(os.path.join(self.root, name, "manifest.json"))
+
+    def ensure_collection(self, name: str, dim: int) -> VectorCollection:
+        with self._lock:
+            col = self._cols.get(name)
+            if col is None:
+                col = VectorCollection(os.path.join(self.root, name), dim, **self._kw)
+                col._save_manifest()
+                self._cols[name] = col
+            return col
+
+    def get(self, name: str) -> VectorCollection:
+        col = self._cols.get(name)
+        if col is not None:
+            return col
+        mpath = os.path.join(self.root, name, "manifest.json")
+        if not os.path.exists(mpath):
+            raise KeyError(f"vecstore collection {name!r} not found")
+        with open(mpath, "r", encoding="utf-8") as f:
+            dim = int(json.load(f)["dim"])
+        return self.ensure_collection(name, dim)
+
+    def flush(self) -> None:
+        for col in list(self._cols.values()):
+            col.flush()
@@ -0,0 +1,138 @@
+"""Сверка и бенчмарк bot/intents.py против старых any(w in t ...) циклов.
+
+    python scripts/bench_intents.py                 # синтетический корпус
+    python scripts/bench_intents.py result.json     # история чата из экспорта телеги
+
+Печатает стоимость на сообщение: старый путь (lower() + списки на каждую
+проверку) против одного прохода автомата — на C (pyahocorasick) и на питоне.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot import intents as I  # noqa: E402
+from bot.settings import settings  # noqa: E402
+
+BOT = "balbes_ai_bot"
+OWNER_HANDLES = list(getattr(settings, "OWNER_HANDLES", []))
+
+
+# ---------- эталон: как было в reactions.py / main.py ----------
+
+def legacy_reaction_class(text: str) -> int:
+    t = (text or "").lower()
+    if any(w in t for w in ["ахаха", "лол", "ору", "смеш", "😂", "🤣", "хаха"]):
+        return I.LAUGH
+    if any(w in t for w in ["бред", "чушь", "ерунда", "кринж", "стыд", "🤡", "пиздец"]):
+        return I.CRINGE
+    if any(w in t for w in ["ок", "пон", "ладно", "ясно", "норм", "база"]):
+        return I.AGREE
+    if any(w in t for w in ["что", "чего", "серьёзно", "реально", "wtf", "почему", "?"]):
+        return I.QUESTION
+    return 0
+
+
+def legacy_wants_voice(user_text: str) -> bool:
+    t = (user_text or "").lower()
+    return any(k in t for k in ["голосом", "озвуч", "озвучь", "войсом", "войс", "запиши войс", "voice"])
+
+
+def legacy_wants_image(user_text: str) -> bool:
+    t = (user_text or "").lower()
+    keys = [
+        "нарисуй", "сгенерируй", "создай картинку", "сделай картинку",
+        "сделай изображение", "создай изображение", "нарисуешь",
+        "draw", "generate an image", "make an image",
+    ]
+    return any(k in t for k in keys)
+
+
+def legacy_owner(text: str) -> bool:
+    text_l = (text or "").lower()
+    return any(h.lower() in text_l for h in OWNER_HANDLES)
+
+
+def legacy_bot(text: str) -> bool:
+    return f"@{BOT}" in (text or "").lower()
+
+
+def legacy_all(text: str) -> tuple:
+    return (legacy_reaction_class(text), legacy_wants_voice(text), legacy_wants_image(text), legacy_owner(text), legacy_bot(text))
+
+
+def new_all(text: str) -> tuple:
+    m = I.detect_intents(text, BOT)
+    for bit in (I.LAUGH, I.CRINGE, I.AGREE, I.QUESTION):
+        if m & bit:
+            cls = bit
+            break
+    else:
+        cls = 0
+    return (cls, bool(m & I.VOICE), bool(m & I.IMAGE), bool(m & I.OWNER), bool(m & I.BOT))
+
+
+# ---------- корпус ----------
+
+def _synthetic(n: int) -> list[str]:
+    rng = random.Random(7)
+    vocab = (
+        I.LAUGH_WORDS + I.CRINGE_WORDS + I.AGREE_WORDS + I.QUESTION_WORDS + I.VOICE_WORDS + I.IMAGE_WORDS
+        + OWNER_HANDLES + [f"@{BOT}", f"@{BOT.upper()}", "около", "понятно", "ХАХА", "Нарисуй"]
+        + "ну да нет короче типа вообще просто кирилл бот чат сегодня завтра опять снова братан".split()
+    )
+    out = []
+    for _ in range(n):
+        words = [rng.choice(vocab) for _ in range(rng.randint(1, 25))]
+        out.append(" ".join(words))
+    return out
+
+
+def _export_texts(path: str) -> list[str]:
+    from bot.tg_export_import import parse_tg_export_json
+
+    return [m.text for m in parse_tg_export_json(path)]
+
+
+def _per_msg_us(fn, texts: list[str], repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for t in texts:
+            fn(t)
+        best = min(best, time.perf_counter() - t0)
+    return best / max(1, len(texts)) * 1e6
+
+
+def main() -> None:
+    texts = _export_texts(sys.argv[1]) if len(sys.argv) > 1 else _synthetic(20000)
+
+    bad = 0
+    for t in texts:
+        old, new = legacy_all(t), new_all(t)
+        if old != new:
+            bad += 1
+            if bad <= 20:
+                print(f"MISMATCH {t[:80]!r}: legacy={old} new={new}")
+    print(f"corpus: {len(texts)} messages, avg {sum(map(len, texts)) / max(1, len(texts)):.0f} chars, mismatches: {bad}")
+    if bad:
+        raise SystemExit(1)
+
+    old = _per_msg_us(legacy_all, texts)
+    print(f"{'legacy any(...)':<24} {old:7.2f} us/msg")
+    pats = I._base_patterns() + [("@" + BOT, I.BOT)]
+    for use_c in (True, False):
+        m = I.IntentMatcher(pats, use_c=use_c)
+        if use_c and m.backend != "pyahocorasick":
+            print("pyahocorasick not installed, skipping C backend")
+            continue
+        if any(m.match(t) != I.detect_intents(t, BOT) for t in texts[:2000]):
+            raise SystemExit(f"backend {m.backend} disagrees")
+        new = _per_msg_us(m.match, texts)
+        print(f"{m.backend + f' ({m.states} states)':<24} {new:7.2f} us/msg   x{old / max(new, 1e-9):.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""Сверка и микробенчмарк bot/sanitize.py против старой реализации.
+
+    python scripts/bench_sanitize.py                 # встроенный корпус + фаззинг
+    python scripts/bench_sanitize.py result.json     # + тексты из экспорта телеги
+
+Сначала сверяет вердикты/очистку на «золотом» корпусе (падает, если есть
+расхождения), потом меряет время на коротких и длинных ответах.
+"""
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.sanitize import clean_llm_output, is_garbage_text, strip_self_mention  # noqa: E402
+
+
+# ---------- эталон: старый код из bot/ai.py и bot/main.py как есть ----------
+
+_LEGACY_GARBAGE_REGEXES = [
+    re.compile(r"<\|.*?\|>", re.I),
+    re.compile(r"<start_header_id>|<end_header_id>", re.I),
+    re.compile(r"\b(system|assistant|user)\b", re.I),
+    re.compile(r"@protocol", re.I),
+    re.compile(r"presentdecoded|eventz|decode|latent|pipeline", re.I),
+    re.compile(r"[A-Za-z_]{24,}"),
+    re.compile(r"(?i)(?=.*[a-z])(?=.*[а-яё])[a-zа-яё]+"),
+    re.compile(r"instanceof|prototype|undefined|null|function\(|var\s|let\s|const\s", re.I),
+]
+
+
+def legacy_clean_llm_output(text: str) -> str:
+    if not text:
+        return ""
+    out = text
+    out = re.sub(r"<\|.*?\|>", "", out)
+    out = re.sub(r"<start_header_id>|<end_header_id>", "", out, flags=re.I)
+    out = re.sub(r"\b(system|assistant|user)\b", "", out, flags=re.I)
+    out = out.replace("<<", "").replace(">>", "")
+    out = " ".join(out.split()).strip()
+    return out
+
+
+def _legacy_has_mixed_script_word(t: str) -> bool:
+    for w in re.findall(r"[A-Za-zА-Яа-яЁё]{5,}", t):
+        has_lat = any("a" <= c.lower() <= "z" for c in w)
+        has_cyr = any(("а" <= c.lower() <= "я") or (c.lower() == "ё") for c in w)
+        if has_lat and has_cyr:
+            return True
+    return False
+
+
+def legacy_is_garbage_text(text: str) -> bool:
+    if not text:
+        return True
+    t = text.strip()
+
+    if _legacy_has_mixed_script_word(t):
+        return True
+
+    if len(t) > 420 and t.count(" ") < 12:
+        return True
+
+    latin_letters = sum((c.isascii() and c.isalpha()) for c in t)
+    latin_ratio = latin_letters / max(1, len(t))
+    if latin_ratio > 0.35:
+        return True
+
+    for rx in _LEGACY_GARBAGE_REGEXES:
+        if rx.search(t):
+            return True
+
+    return False
+
+
+def legacy_strip_self_mention(text: str, bot_username_lower: str) -> str:
+    if not text or not bot_username_lower:
+        return text
+    handle = "@" + bot_username_lower
+    out = text.replace(handle, "")
+    while handle in out.lower():
+        i = out.lower().find(handle)
+        out = out[:i] + out[i + len(handle):]
+    return " ".join(out.split()).strip()
+
+
+# ---------- корпус ----------
+
+BOT = "balbes_ai_bot"
+
+SAMPLES = [
+    "",
+    "   ",
+    "ну да, конечно, так и было",
+    "Кирилл прав, а ты опять несёшь чушь 😂",
+    "ахаха ору",
+    "ок",
+    "это вообще что такое?",
+    "го в CS вечером",
+    "assistant: ну привет",
+    "<|im_start|>assistant\nну привет<|im_end|>",
+    "<start_header_id>assistant<end_header_id> ага",
+    "<<цитата>> и всё",
+    "Ответ: undefined",
+    "let x = 5; const y = 6;",
+    "function(a) { return a }",
+    "presentdecoded eventz latent pipeline",
+    "привет @protocol",
+    "superlongidentifier_without_spaces_here",
+    "прuвет как дела",  # латиница внутри слова
+    "Дaвай",
+    "hello how are you doing today my friend",
+    "ну ок\nа вот тут English words",
+    "строка одна\nline two\nстрока три",
+    f"@{BOT} ну чё",
+    f"@{BOT.upper()} и ещё @{BOT} раз",
+    "ſ и K — редкие буквы",
+    "ᲀ старая кириллица",
+    "İstanbul и Стамбул",
+    "null",
+    "а " * 300,
+    "ааааа" * 120,
+    "var\tx",
+]
+
+_WORDS_RU = "ну да нет короче типа вообще просто ладно кирилл бот чат сегодня завтра опять снова братан база кринж ору".split()
+_WORDS_EN = "ok lol wtf user system cs go pipeline null let var decode".split()
+_CHARS = "абвгдеёжзabcxyzİıſKᲀ <|>_@\n\t.,!?😂"
+
+
+def _fuzz(rng: random.Random, n: int) -> list[str]:
+    out = []
+    for _ in range(n):
+        kind = rng.random()
+        if kind < 0.4:
+            words = [rng.choice(_WORDS_RU) for _ in range(rng.randint(1, 40))]
+            if rng.random() < 0.3:
+                words.insert(rng.randrange(len(words) + 1), rng.choice(_WORDS_EN))
+            out.append(" ".join(words))
+        elif kind < 0.7:
+            out.append("".join(rng.choice(_CHARS) for _ in range(rng.randint(1, 80))))
+        else:
+            parts = [rng.choice(SAMPLES) for _ in range(rng.randint(1, 4))]
+            out.append(rng.choice([" ", "\n", "<|x|>", f"@{BOT}"]).join(parts))
+    return out
+
+
+def _long_outputs() -> list[str]:
+    ru = " ".join(_WORDS_RU * 25)
+    return [
+        ru,                                   # длинный нормальный ответ
+        ru + " ok",                           # латиница в самом конце
+        ("ну " * 400) + "<|eot_id|>",
+        "\n".join(ru.split(" ")),             # много строк
+    ]
+
+
+def _export_texts(path: str) -> list[str]:
+    from bot.tg_export_import import parse_tg_export_json
+
+    return [m.text for m in parse_tg_export_json(path)]
+
+
+def check(corpus: list[str]) -> int:
+    bad = 0
+    skipped = 0
+    for t in corpus:
+        pairs = [
+            ("clean", legacy_clean_llm_output(t), clean_llm_output(t)),
+            ("garbage(raw)", legacy_is_garbage_text(t), is_garbage_text(t)),
+            ("garbage(clean)", legacy_is_garbage_text(legacy_clean_llm_output(t)), is_garbage_text(clean_llm_output(t))),
+        ]
+        # старый strip_self_mention искал индекс в out.lower(), а у "İ" lower() длиннее
+        # на символ — индексы уезжали и резалось не то. Такие строки не сверяем.
+        if len(t.lower()) == len(t):
+            pairs.append(("strip_mention", legacy_strip_self_mention(t, BOT), strip_self_mention(t, BOT)))
+        else:
+            skipped += 1
+        for name, old, new in pairs:
+            if old != new:
+                bad += 1
+                print(f"MISMATCH {name}: {t[:80]!r}: legacy={old!r} new={new!r}")
+    if skipped:
+        print(f"strip_mention: {skipped} texts skipped (lower() changes length, legacy bug)")
+    return bad
+
+
+def bench(label: str, texts: list[str], number: int) -> None:
+    def run_old():
+        for t in texts:
+            legacy_is_garbage_text(legacy_clean_llm_output(t))
+
+    def run_new():
+        for t in texts:
+            is_garbage_text(clean_llm_output(t))
+
+    old = min(timeit.repeat(run_old, number=number, repeat=3)) / (number * len(texts))
+    new = min(timeit.repeat(run_new, number=number, repeat=3)) / (number * len(texts))
+    print(f"{label:<28} legacy {old * 1e6:9.1f} us   new {new * 1e6:9.1f} us   x{old / max(new, 1e-12):.1f}")
+
+
+def main() -> None:
+    rng = random.Random(42)
+    corpus = SAMPLES + _long_outputs() + _fuzz(rng, 5000)
+    if len(sys.argv) > 1:
+        corpus += _export_texts(sys.argv[1])
+
+    bad = check(corpus)
+    print(f"golden corpus: {len(corpus)} texts, mismatches: {bad}")
+    if bad:
+        raise SystemExit(1)
+
+    short = [t for t in SAMPLES if 0 < len(t) < 200]
+    bench("short replies", short, 200)
+    bench("long replies (~2-3k chars)", _long_outputs(), 20)
+    if len(sys.argv) > 1:
+        bench("export texts", corpus[-2000:], 3)
+
+
+if __name__ == "__main__":
+    main()
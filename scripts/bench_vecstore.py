@@ -0,0 +1,110 @@
+"""Recall и задержка bot/vecstore.py (перебор и IVF), опционально — против Qdrant.
+
+    python scripts/bench_vecstore.py                       # 100k x 1536, синтетика
+    python scripts/bench_vecstore.py 300000 1536           # свой размер
+    QDRANT_URL=http://127.0.0.1:6333 python scripts/bench_vecstore.py --qdrant
+
+Векторы — кластерная синтетика (как у эмбеддингов переписки: темы + шум),
+эталон — точный top-k по float32. Печатает recall@10 и p50/p95 на запрос.
+С --qdrant те же точки льются во временную коллекцию, после замера она удаляется.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from bot.vecstore import VectorCollection  # noqa: E402
+
+K = 10
+QUERIES = 200
+
+
+def make_data(n: int, dim: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(max(16, n // 500), dim)).astype(np.float32)
+    x = topics[rng.integers(0, len(topics), size=n)] + 1.5 * rng.normal(size=(n, dim)).astype(np.float32)
+    q = topics[rng.integers(0, len(topics), size=QUERIES)] + 1.5 * rng.normal(size=(QUERIES, dim)).astype(np.float32)
+    return x, q
+
+
+def ground_truth(x: np.ndarray, q: np.ndarray) -> list[set[int]]:
+    xn = x / np.linalg.norm(x, axis=1, keepdims=True)
+    out = []
+    for qq in q:
+        s = xn @ (qq / np.linalg.norm(qq))
+        out.append(set(np.argpartition(-s, K)[:K].tolist()))
+    return out
+
+
+def measure(name: str, fn, q: np.ndarray, gt: list[set[int]]) -> None:
+    fn(q[0])  # прогрев (page cache, BLAS)
+    lat, rec = [], []
+    for qq, g in zip(q, gt):
+        t0 = time.perf_counter()
+        ids = fn(qq)
+        lat.append((time.perf_counter() - t0) * 1000)
+        rec.append(len(g & set(ids)) / K)
+    p50, p95 = np.percentile(lat, [50, 95])
+    print(f"{name:<22} recall@{K}={np.mean(rec):.3f}  p50={p50:7.2f}ms  p95={p95:7.2f}ms")
+
+
+def bench_local(x: np.ndarray, q: np.ndarray, gt: list[set[int]]) -> None:
+    root = tempfile.mkdtemp(prefix="vecstore_bench_")
+    try:
+        n, dim = x.shape
+        t0 = time.perf_counter()
+        col = VectorCollection(os.path.join(root, "flat"), dim, segment_rows=n, ivf_min_rows=n + 1)
+        col.upsert({"id": i, "vector": x[i], "payload": {"ts": float(i)}} for i in range(n))
+        col.flush()
+        print(f"local flat: build {time.perf_counter() - t0:.1f}s")
+        measure("local flat", lambda v: [h.id for h in col.search(v, K)], q, gt)
+
+        t0 = time.perf_counter()
+        ivf = VectorCollection(os.path.join(root, "ivf"), dim, segment_rows=n, ivf_min_rows=1)
+        ivf.upsert({"id": i, "vector": x[i], "payload": {"ts": float(i)}} for i in range(n))
+        ivf.flush()
+        print(f"local ivf: build {time.perf_counter() - t0:.1f}s, lists={len(ivf.segments[0].centroids)}")
+        for nprobe in (4, 16, 64):
+            measure(f"local ivf nprobe={nprobe}", lambda v, p=nprobe: [h.id for h in ivf.search(v, K, nprobe=p)], q, gt)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def bench_qdrant(x: np.ndarray, q: np.ndarray, gt: list[set[int]]) -> None:
+    from qdrant_client import QdrantClient
+    from qdrant_client.http import models as qm
+
+    client = QdrantClient(url=os.environ.get("QDRANT_URL", "http://127.0.0.1:6333"))
+    name = f"bench_vecstore_{int(time.time())}"
+    client.create_collection(name, vectors_config=qm.VectorParams(size=x.shape[1], distance=qm.Distance.COSINE))
+    try:
+        t0 = time.perf_counter()
+        for a in range(0, len(x), 512):
+            client.upsert(name, points=qm.Batch(ids=list(range(a, min(len(x), a + 512))), vectors=x[a:a + 512].tolist()))
+        while client.get_collection(name).status != qm.CollectionStatus.GREEN:
+            time.sleep(0.5)
+        print(f"qdrant: build {time.perf_counter() - t0:.1f}s")
+        measure("qdrant", lambda v: [h.id for h in client.search(name, query_vector=v.tolist(), limit=K)], q, gt)
+    finally:
+        client.delete_collection(name)
+
+
+def main() -> None:
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    n = int(args[0]) if args else 100000
+    dim = int(args[1]) if len(args) > 1 else 1536
+    x, q = make_data(n, dim)
+    print(f"{n} vectors x {dim} dims, {QUERIES} queries")
+    gt = ground_truth(x, q)
+    bench_local(x, q, gt)
+    if "--qdrant" in sys.argv:
+        bench_qdrant(x, q, gt)
+
+
+if __name__ == "__main__":
+    main()
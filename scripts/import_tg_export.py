@@ -1,75 +1,106 @@
+"""Импорт экспорта Telegram в таблицу messages (SQLAlchemy) и векторную базу.
+
+    python scripts/import_tg_export.py /path/to/result.json
+
+Строки вставляются пачками по CHUNK_ROWS одним INSERT — без flush на каждое
+сообщение; эмбеддинги считаются пачками и параллельно (bot/embedder.py), пока
+вставляется следующая пачка. Точки — те же, что пишет bot/export_pipeline.py:
+ID uuid5(chat_id:msg_id), payload с chat_id/ts (по ним фильтрует живой RAG),
+так что повторный импорт или импорт другим скриптом перезаписывает их, а не дублирует.
+"""
 import asyncio
+import os
 import sys
-from sqlalchemy import text as sql_text
-from qdrant_client.http import models as qm
 
-from bot.settings import settings
-from bot.db import SessionLocal, engine
-from bot.models import Base, MessageRow
-from bot.tg_export_import import parse_tg_export_json
-from bot.ai import embed
-from bot.rag import qdrant_client, ensure_collection, upsert_points
-from bot.utils import clamp_text
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openai import AsyncOpenAI  # noqa: E402
+from qdrant_client.http import models as qm  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+from sqlalchemy import text as sql_text  # noqa: E402
+
+from bot import rag  # noqa: E402
+from bot.db import SessionLocal, engine  # noqa: E402
+from bot.embedder import embedder_from_settings  # noqa: E402
+from bot.export_pipeline import Record, normalize_msg, point_id  # noqa: E402
+from bot.models import Base, MessageRow  # noqa: E402
+from bot.settings import settings  # noqa: E402
+from bot.tg_export_import import iter_tg_export  # noqa: E402
+from bot.utils import clamp_text  # noqa: E402
+
+CHUNK_ROWS = 2000
+TEXT_CHARS = 2000  # как ExportPipeline(text_chars=...) по умолчанию
+
 
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
         await conn.execute(sql_text("CREATE INDEX IF NOT EXISTS idx_messages_chat_id ON messages(chat_id);"))
 
-async def main(export_path: str):
-    await init_db()
 
-    msgs = parse_tg_export_json(export_path)
-    if not msgs:
-        print("Нет сообщений для импорта.")
-        return
+async def insert_chunks(path: str, stats: dict):
+    """(запись экспорта, текст для эмбеддинга) — по мере вставки пачек в messages."""
+    stmt = insert(MessageRow)
 
-    qc = qdrant_client()
+    async def flush(session, rows, records):
+        await session.execute(stmt, rows)
+        await session.commit()
+        stats["inserted"] += len(rows)
+        print(f"Импортировано: {stats['inserted']}")
+        return [(r, r.text[:TEXT_CHARS]) for r in records]
 
-    # узнаем размер эмбеддинга один раз
-    test_vec = embed("ping")
-    await ensure_collection(qc, vector_size=len(test_vec))
+    rows: list[dict] = []
+    records: list[Record] = []
+    async with SessionLocal() as session:
+        for m in iter_tg_export(path):
+            r = normalize_msg(m, settings.TARGET_GROUP_ID)  # привязываем к целевой группе
+            if r is None:
+                continue
+            rows.append({
+                "chat_id": r.chat_id,
+                "user_id": m.user_id or 0,
+                "username": m.username,
+                "text": clamp_text(m.text, 8000),
+            })
+            records.append(r)
+            if len(rows) >= CHUNK_ROWS:
+                for item in await flush(session, rows, records):
+                    yield item
+                rows, records = [], []
+        if rows:
+            for item in await flush(session, rows, records):
+                yield item
 
-    points: list[qm.PointStruct] = []
-    inserted = 0
 
-    async with SessionLocal() as session:
-        for i, m in enumerate(msgs, start=1):
-            row = MessageRow(
-                chat_id=settings.TARGET_GROUP_ID,  # привязываем к целевой группе
-                user_id=m.user_id or 0,
-                username=m.username,
-                text=clamp_text(m.text, 8000),
-            )
-            session.add(row)
-            await session.flush()  # получаем row.id
-
-            vec = embed(row.text)
-            points.append(qm.PointStruct(
-                id=row.id,
-                vector=vec,
-                payload={
-                    "text": row.text,
-                    "user_id": row.user_id,
-                    "username": row.username,
-                    "created_at": m.created_at,
-                }
-            ))
-
-            inserted += 1
-            if len(points) >= 64:
-                upsert_points(qc, points)
-                points = []
-
-            if i % 500 == 0:
-                print(f"Импортировано: {i}")
+async def main(export_path: str):
+    if not settings.OPENAI_API_KEY:
+        print("OPENAI_API_KEY не задан")
+        raise SystemExit(2)
+    await init_db()
 
-        await session.commit()
+    embedder = embedder_from_settings(AsyncOpenAI(api_key=settings.OPENAI_API_KEY))
+    stats = {"inserted": 0}
+
+    async def sink(records: list[Record], vectors: list[list[float]]) -> None:
+        await rag.ensure_collection(len(vectors[0]))
+        await rag.upsert_points(
+            [
+                qm.PointStruct(id=point_id(r.chat_id, r.msg_id), vector=v, payload=r.payload(TEXT_CHARS))
+                for r, v in zip(records, vectors)
+            ]
+        )
+
+    try:
+        await embedder.run(insert_chunks(export_path, stats), sink)
+    finally:
+        await rag.close_client()
+        await engine.dispose()
 
-    if points:
-        upsert_points(qc, points)
+    if not stats["inserted"]:
+        print("Нет сообщений для импорта.")
+        return
+    print(f"✅ Готово. Сообщений импортировано: {stats['inserted']}")
 
-    print(f"✅ Готово. Сообщений импортировано: {inserted}")
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
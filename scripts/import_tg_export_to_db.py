@@ -1,12 +1,25 @@
+"""Экспорт Telegram -> tg_history (только БД).
+
+    python scripts/import_tg_export_to_db.py /root/tg_export/result.json
+    python scripts/import_tg_export_to_db.py result.json --bulk   # миллионы строк
+
+Обёртка над bot/export_pipeline.py: записи (dt из date_unixtime, UTC) те же,
+что пишет scripts/ingest_tg_export.py. Обычный режим — конвейер без векторной
+стадии; --bulk — один COPY в staging и один merge (bot.ingest.bulk_load_history).
+"""
 import os
-import json
-import re
+import sys
 import asyncio
-from datetime import datetime, timezone
+import argparse
 
 import asyncpg
 from dotenv import load_dotenv
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.export_pipeline import ExportPipeline, iter_records  # noqa: E402
+from bot.ingest import bulk_load_history  # noqa: E402
+
 load_dotenv()
 
 DB_HOST = os.getenv("DB_HOST", "localhost")
@@ -18,102 +31,42 @@ DB_PASSWORD = os.getenv("DB_PASSWORD", "balbes")
 TARGET_CHAT_ID = int(os.getenv("TARGET_GROUP_ID", "0"))  # используем твой ID группы
 
 
-def flatten_text(t):
-    # Telegram export: text может быть строкой или списком (кусочки/emoji/entities)
-    if isinstance(t, str):
-        return t.strip()
-    if isinstance(t, list):
-        parts = []
-        for x in t:
-            if isinstance(x, str):
-                parts.append(x)
-            elif isinstance(x, dict):
-                parts.append(x.get("text") or x.get("content") or "")
-        return "".join(parts).strip()
-    return ""
-
-
-def parse_dt(s: str | None):
-    if not s:
-        return None
-    # обычно формат "2026-01-16T..." или "2026-01-16 18:08:00"
-    try:
-        # поддержка ISO
-        return datetime.fromisoformat(s.replace("Z", "+00:00"))
-    except Exception:
-        return None
-
-
-async def main(path: str):
-    conn = await asyncpg.connect(
-        host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASSWORD, database=DB_NAME
-    )
-
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    msgs = data.get("messages", [])
-    total = 0
-    inserted = 0
-
-    batch = []
-    BATCH_SIZE = 500
-
-    for m in msgs:
-        if m.get("type") != "message":
-            continue
-
-        text = flatten_text(m.get("text"))
-        if not text:
-            continue
-
-        msg_id = m.get("id")
-        if msg_id is None:
-            continue
-
-        dt = parse_dt(m.get("date"))
-        frm = m.get("from")
-        frm_id = m.get("from_id")
-
-        # чуть чистим мусор
-        text = re.sub(r"\s+", " ", text).strip()
-
-        batch.append((TARGET_CHAT_ID, int(msg_id), dt, frm, frm_id, text))
-        total += 1
-
-        if len(batch) >= BATCH_SIZE:
-            res = await conn.executemany(
-                """
-                INSERT INTO tg_history (chat_id, msg_id, dt, from_name, from_id, text)
-                VALUES ($1,$2,$3,$4,$5,$6)
-                ON CONFLICT (chat_id, msg_id) DO NOTHING
-                """,
-                batch,
+async def main(path: str, bulk: bool, rebuild_indexes: str):
+    if bulk:
+        conn = await asyncpg.connect(
+            host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASSWORD, database=DB_NAME
+        )
+        try:
+            # один COPY всего экспорта в staging и один merge
+            stats = await bulk_load_history(
+                conn, (r.db_row() for r in iter_records(path, TARGET_CHAT_ID)), rebuild_indexes=rebuild_indexes
             )
-            inserted += len(batch)
-            print(f"loaded: {inserted}")
-            batch = []
+        finally:
+            await conn.close()
+        print("DONE.", stats)
+        return
 
-    if batch:
-        await conn.executemany(
-            """
-            INSERT INTO tg_history (chat_id, msg_id, dt, from_name, from_id, text)
-            VALUES ($1,$2,$3,$4,$5,$6)
-            ON CONFLICT (chat_id, msg_id) DO NOTHING
-            """,
-            batch,
+    pool = await asyncpg.create_pool(
+        host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASSWORD, database=DB_NAME, min_size=1, max_size=2
+    )
+    try:
+        pipeline = ExportPipeline(
+            chat_id=TARGET_CHAT_ID,
+            pool=pool,
+            progress=lambda st: print(f"loaded: {st['db']['items']} (new: {st['db'].get('inserted', 0)})"),
         )
-        inserted += len(batch)
-
-    await conn.close()
-    print("DONE. messages:", total)
+        stats = await pipeline.run(path)
+    finally:
+        await pool.close()
+    db = stats["db"]
+    print(f"DONE. messages: {db['items']}, inserted: {db['inserted']}, duplicates: {db['duplicates']}")
 
 
 if __name__ == "__main__":
-    import sys
-
-    if len(sys.argv) < 2:
-        print("Usage: python scripts/import_tg_export_to_db.py /root/tg_export/result.json")
-        raise SystemExit(2)
-
-    asyncio.run(main(sys.argv[1]))
+    ap = argparse.ArgumentParser(description="Load a Telegram export into tg_history")
+    ap.add_argument("path", help="/root/tg_export/result.json")
+    ap.add_argument("--bulk", action="store_true", help="one COPY into an unlogged staging table + one merge (millions of rows)")
+    ap.add_argument("--rebuild-indexes", choices=("auto", "always", "never"), default="auto",
+                    help="--bulk: drop secondary indexes for the merge and rebuild them (auto: large loads only)")
+    args = ap.parse_args()
+    asyncio.run(main(args.path, args.bulk, args.rebuild_indexes))
@@ -1,104 +1,123 @@
-import os, json, time, re
-from dotenv import load_dotenv
-from openai import OpenAI
-from qdrant_client import QdrantClient
-from qdrant_client.http import models as qm
-
-load_dotenv()
-
-OPENAI_API_KEY = os.environ["OPENAI_API_KEY"]
-QDRANT_URL = os.environ.get("QDRANT_URL", "http://127.0.0.1:6333")
-COLLECTION = os.environ.get("QDRANT_COLLECTION", "tg_messages")
-
-client = OpenAI(api_key=OPENAI_API_KEY)
-qdrant = QdrantClient(url=QDRANT_URL)
-
-def flatten_text(t):
-    # Telegram export: text может быть строкой или списком кусочков/emoji/entities
-    if isinstance(t, str):
-        return t.strip()
-    if isinstance(t, list):
-        parts = []
-        for x in t:
-            if isinstance(x, str):
-                parts.append(x)
-            elif isinstance(x, dict):
-                # бывает {"type":"text","text":"..."} или {"type":"custom_emoji","text":"..."}
-                parts.append(x.get("text") or x.get("content") or "")
-        return "".join(parts).strip()
-    return ""
-
-def ensure_collection():
-    exists = qdrant.collection_exists(COLLECTION)
-    if not exists:
-        qdrant.create_collection(
-            collection_name=COLLECTION,
-            vectors_config=qm.VectorParams(size=1536, distance=qm.Distance.COSINE),
-        )
-
-def embed(text: str):
-    # троттлинг: 1 запрос/сек, чтобы не ловить 429 на маленьких лимитах
-    time.sleep(1.05)
-    r = client.embeddings.create(
-        model="text-embedding-3-small",
-        input=text,
-    )
-    return r.data[0].embedding
-
-def main(path: str):
-    ensure_collection()
-
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    msgs = data.get("messages", [])
-    points = []
-    upserted = 0
-
-    for m in msgs:
-        if m.get("type") != "message":
+"""Индексация истории чата из экспорта Telegram в векторную базу.
+
+    python scripts/index_tg_export_to_qdrant.py /root/tg_export/result.json
+
+Эмбеддинги считаются пачками и параллельно (bot/embedder.py, темп — по
+заголовкам лимитов OpenAI). Какие сообщения уже в индексе, пишется в
+<result.json>.index.ckpt: упавший прогон при повторном запуске продолжает
+с того места, где остановился. Точки пишем с wait=True — отметка в
+чекпоинте появляется только после того, как база их приняла (для
+VECTOR_BACKEND=local — после записи сегмента на диск, не из буфера в памяти). Повторы
+текстов (и повторный прогон по свежему экспорту того же чата) берутся из
+кэша эмбеддингов (bot/embed_cache.py) и в API не уходят.
+
+Записи, payload и ID точек — из bot/export_pipeline.py: это та же векторная
+стадия, что у scripts/ingest_tg_export.py, только с чекпоинтом.
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openai import AsyncOpenAI  # noqa: E402
+from qdrant_client.http import models as qm  # noqa: E402
+
+from bot import rag  # noqa: E402
+from bot.embedder import embedder_from_settings  # noqa: E402
+from bot.export_pipeline import iter_records, point_id  # noqa: E402
+from bot.settings import settings  # noqa: E402
+
+CHAT_ID = int(getattr(settings, "TARGET_GROUP_ID", 0) or 0)
+TEXT_CHARS = 2000  # как ExportPipeline(text_chars=...) по умолчанию
+PROGRESS_EVERY_SEC = 10.0
+
+
+class Checkpoint:
+    """Append-only список проиндексированных msg_id: по строке на пачку."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.done: set[int] = set()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    # недописанная последняя строка (упали посреди записи) — просто пересчитаем её
+                    if line.endswith("\n"):
+                        self.done.update(int(x) for x in line.split())
+        self._f = open(path, "a", encoding="utf-8")
+
+    def mark(self, ids: list[int]) -> None:
+        self._f.write(" ".join(str(i) for i in ids) + "\n")
+        self._f.flush()
+
+    def close(self) -> None:
+        self._f.close()
+
+
+def iter_pending(path: str, done: set[int]):
+    # экспорт читается потоком: память не зависит от размера result.json;
+    # записи и payload — те же, что у bot/export_pipeline.py (ID точек совпадают)
+    for r in iter_records(path, CHAT_ID):
+        if r.msg_id in done:
             continue
+        yield r.payload(TEXT_CHARS), r.text[:TEXT_CHARS]
 
-        text = flatten_text(m.get("text"))
-        if not text:
-            continue
-
-        # можно ограничить слишком длинные
-        text = text[:2000]
-
-        msg_id = m.get("id")
-        date = m.get("date")
-        frm = m.get("from")
-        frm_id = m.get("from_id")
-
-        vec = embed(text)
 
-        payload = {
-            "msg_id": msg_id,
-            "date": date,
-            "from": frm,
-            "from_id": frm_id,
-            "text": text,
-        }
-
-        points.append(qm.PointStruct(id=int(msg_id), vector=vec, payload=payload))
-
-        if len(points) >= 64:
-            qdrant.upsert(collection_name=COLLECTION, points=points)
-            upserted += len(points)
-            points = []
-            print("upserted:", upserted)
+async def main(path: str) -> None:
+    if not settings.OPENAI_API_KEY:
+        print("OPENAI_API_KEY is not set")
+        raise SystemExit(2)
 
-    if points:
-        qdrant.upsert(collection_name=COLLECTION, points=points)
-        upserted += len(points)
-        print("upserted:", upserted)
+    ckpt = Checkpoint(path + ".index.ckpt")
+    if ckpt.done:
+        print(f"resume: {len(ckpt.done)} messages already indexed")
+
+    embedder = embedder_from_settings(AsyncOpenAI(api_key=settings.OPENAI_API_KEY))
+    next_report = time.perf_counter() + PROGRESS_EVERY_SEC
+    # записанные, но ещё не отмеченные msg_id — в порядке записи
+    pending: list[int] = []
+    # воркеры эмбеддера зовут sink параллельно: запись и pending — под замком, иначе порядок разъедется с буфером
+    write_lock = asyncio.Lock()
+
+    def mark_durable() -> None:
+        # последние unflushed точек ещё в памяти local-хранилища: их отметим после записи сегмента
+        n = len(pending) - rag.unflushed_points()
+        if n > 0:
+            ckpt.mark(pending[:n])
+            del pending[:n]
+
+    async def sink(payloads: list[dict], vectors: list[list[float]]) -> None:
+        nonlocal next_report
+        await rag.ensure_collection(len(vectors[0]))
+        async with write_lock:
+            await rag.upsert_points(
+                [qm.PointStruct(id=point_id(CHAT_ID, p["msg_id"]), vector=v, payload=p) for p, v in zip(payloads, vectors)],
+                wait=True,
+            )
+            pending.extend(int(p["msg_id"]) for p in payloads)
+            mark_durable()
+        if time.perf_counter() >= next_report:
+            next_report = time.perf_counter() + PROGRESS_EVERY_SEC
+            st = embedder.stats
+            print(f"upserted: {st.items + len(payloads)}  {st.rate():.1f} msg/s  requests={st.requests} retries={st.retries}")
+
+    try:
+        stats = await embedder.run(iter_pending(path, ckpt.done), sink)
+        if pending:
+            await rag.flush()
+            mark_durable()
+    finally:
+        ckpt.close()
+        await rag.close_client()
+    print("DONE.", stats.as_dict())
+    if embedder.cache is not None:
+        print("embed cache:", embedder.cache.stats())
 
-    print("DONE. total:", upserted)
 
 if __name__ == "__main__":
-    import sys
     if len(sys.argv) < 2:
         print("Usage: python scripts/index_tg_export_to_qdrant.py /root/tg_export/result.json")
         raise SystemExit(2)
-    main(sys.argv[1])
+    asyncio.run(main(sys.argv[1]))
@@ -0,0 +1,86 @@
+"""Экспорт Telegram за один проход: tg_history в Postgres + векторная база.
+
+    python scripts/ingest_tg_export.py /root/tg_export/result.json
+    python scripts/ingest_tg_export.py result.json --no-vectors      # только БД
+    python scripts/ingest_tg_export.py result.json --no-db           # только векторы
+    python scripts/ingest_tg_export.py result.json --chat-id -100123
+
+Файл читается потоком, стадии работают параллельно (bot/export_pipeline.py).
+Каждые 10 секунд — прогресс по стадиям, в конце — итог. Повторный запуск
+безопасен: дубли в БД отбрасываются, точки перезаписываются по тем же ID,
+эмбеддинги берутся из кэша.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncpg  # noqa: E402
+from openai import AsyncOpenAI  # noqa: E402
+
+from bot import rag  # noqa: E402
+from bot.embedder import embedder_from_settings  # noqa: E402
+from bot.export_pipeline import ExportPipeline  # noqa: E402
+from bot.settings import settings  # noqa: E402
+
+
+def _print_stats(stats: dict) -> None:
+    parts = [f"{stats['elapsed_sec']}s"]
+    for name in ("parse", "normalize", "db", "vectors"):
+        st = stats.get(name)
+        if st:
+            parts.append(f"{name}={st['items']} ({st['per_sec']}/s)")
+    print("  ".join(parts))
+
+
+async def main(args: argparse.Namespace) -> None:
+    pool = None
+    embedder = None
+    if not args.no_db:
+        pool = await asyncpg.create_pool(
+            host=settings.DB_HOST,
+            port=settings.DB_PORT,
+            user=settings.DB_USER,
+            password=settings.DB_PASSWORD,
+            database=settings.DB_NAME,
+            min_size=1,
+            max_size=2,
+        )
+    if not args.no_vectors:
+        if not settings.OPENAI_API_KEY:
+            print("OPENAI_API_KEY is not set (use --no-vectors to import only the DB)")
+            raise SystemExit(2)
+        embedder = embedder_from_settings(AsyncOpenAI(api_key=settings.OPENAI_API_KEY))
+
+    pipeline = ExportPipeline(
+        chat_id=args.chat_id,
+        pool=pool,
+        embedder=embedder,
+        batch_rows=int(getattr(settings, "EXPORT_BATCH_ROWS", 500)),
+        queue_batches=int(getattr(settings, "EXPORT_QUEUE_BATCHES", 8)),
+        progress=_print_stats,
+    )
+    try:
+        stats = await pipeline.run(args.path)
+    finally:
+        if pool is not None:
+            await pool.close()
+        await rag.close_client()
+
+    print("DONE.")
+    for name, st in stats.items():
+        print(f"  {name}: {st}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Import a Telegram export into tg_history and the vector store")
+    ap.add_argument("path", help="result.json from Telegram Desktop export")
+    ap.add_argument("--chat-id", type=int, default=int(getattr(settings, "TARGET_GROUP_ID", 0) or 0))
+    ap.add_argument("--no-db", action="store_true")
+    ap.add_argument("--no-vectors", action="store_true")
+    args = ap.parse_args()
+    if args.no_db and args.no_vectors:
+        ap.error("nothing to do: both --no-db and --no-vectors")
+    asyncio.run(main(args))
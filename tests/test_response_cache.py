@@ -0,0 +1,58 @@
+import pytest
+
+from bot.response_cache import ResponseCache
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_fresh_reply_not_served_back_within_no_repeat():
+    clock = FakeClock()
+    cache = ResponseCache(ttl_sec=1800, no_repeat_sec=600, clock=clock)
+    cache.store(1, "normal", "как дела?", "ctx", "норм")
+
+    # только что сгенерирован и отправлен — дословно в этом же чате не отдаём
+    clock.now += 1
+    assert cache.lookup(1, "normal", "как дела?", "ctx") is None
+    # в другом чате его ещё не слышали
+    cache.store(2, "normal", "как дела?", "ctx", "норм")
+    clock.now += 1
+    assert cache.lookup(1, "normal", "как дела?", "ctx") is None
+
+    # после no_repeat_sec — отдаём, до конца TTL
+    clock.now = 1000.0 + 700
+    assert cache.lookup(1, "normal", "как дела?", "ctx") == "норм"
+    assert cache.stats()["hits"] == 1
+
+
+def test_served_variant_not_repeated_until_no_repeat_passes():
+    clock = FakeClock()
+    cache = ResponseCache(ttl_sec=1800, no_repeat_sec=600, clock=clock)
+    cache.store(1, "normal", "как дела?", "ctx", "норм")
+
+    clock.now += 700
+    assert cache.lookup(1, "normal", "как дела?", "ctx") == "норм"
+    clock.now += 10
+    assert cache.lookup(1, "normal", "как дела?", "ctx") is None
+    clock.now += 600
+    assert cache.lookup(1, "normal", "как дела?", "ctx") == "норм"
+
+
+@pytest.mark.parametrize("text", ["?", ")))", "😂", "ок"])
+def test_near_empty_text_is_not_cached(text):
+    clock = FakeClock()
+    cache = ResponseCache(ttl_sec=1800, no_repeat_sec=600, clock=clock)
+    cache.store(1, "normal", text, "ctx", "ну")
+    clock.now += 700
+    assert cache.lookup(1, "normal", text, "ctx") is None
+    assert cache.stats()["items"] == 0
+
+
+def test_no_repeat_must_be_shorter_than_ttl():
+    with pytest.raises(ValueError):
+        ResponseCache(ttl_sec=1800, no_repeat_sec=3600)
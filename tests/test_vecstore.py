@@ -0,0 +1,57 @@
+import glob
+import os
+import threading
+
+import numpy as np
+
+from bot import vecstore
+from bot.vecstore import VectorCollection
+
+
+def test_search_survives_concurrent_compact(tmp_path, monkeypatch):
+    coll = VectorCollection(str(tmp_path / "c"), 8, segment_rows=10)
+    rng = np.random.default_rng(0)
+    for i in range(30):
+        coll.upsert([{"id": i, "vector": rng.normal(size=8).tolist(), "payload": {"n": i}}])
+    assert len(coll.segments) == 3
+
+    # compact() в другом потоке — между перебором векторов и чтением payload
+    orig = vecstore._Segment.search
+    compacted = []
+
+    def racing_search(self, *args, **kwargs):
+        out = orig(self, *args, **kwargs)
+        if not compacted:
+            compacted.append(True)
+            t = threading.Thread(target=coll.compact)
+            t.start()
+            t.join()
+        return out
+
+    monkeypatch.setattr(vecstore._Segment, "search", racing_search)
+    hits = coll.search(rng.normal(size=8).tolist(), 5)
+
+    assert len(hits) == 5
+    assert all(h.payload == {"n": h.id} for h in hits)
+    # файлы выведенных сегментов удалены, как только поиск закончил
+    assert len(coll.segments) == 1
+    assert len(glob.glob(os.path.join(str(tmp_path / "c"), "seg_*.payload.jsonl"))) == 1
+
+
+def test_delete_survives_restart_without_flush(tmp_path):
+    path = str(tmp_path / "c")
+    rng = np.random.default_rng(1)
+    vecs = [rng.normal(size=8).tolist() for _ in range(30)]
+    coll = VectorCollection(path, 8, segment_rows=10)
+    coll.upsert([{"id": i, "vector": v, "payload": {"n": i}} for i, v in enumerate(vecs)])
+    coll.delete([3, 17])
+
+    # «падение»: открываем заново без flush()
+    reopened = VectorCollection(path, 8, segment_rows=10)
+    ids = {h.id for h in reopened.search(vecs[3], 30)} | {h.id for h in reopened.search(vecs[17], 30)}
+    assert 3 not in ids and 17 not in ids
+
+    reopened.compact()
+    hits = reopened.search(vecs[5], 30)
+    assert len(hits) == 28
+    assert all(h.payload == {"n": h.id} for h in hits)